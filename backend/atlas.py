@@ -0,0 +1,225 @@
+# atlas.py
+# ピース画像のスプライトアトラス生成
+# puzzle_logic.js の initPuzzle / createPiece と同じ分割・形状で
+# 全ピースを1枚の PNG に並べ、座標メタデータと一緒にディスクへキャッシュする
+import io
+import json
+import math
+import os
+import threading
+
+from fastapi import HTTPException
+
+from images import cache_path, decode_errors, load_image, known_hash
+
+# PIL は起動を遅くするので、アトラスを生成するときに import する
+
+# initPuzzle と同じ表示領域の最大サイズ
+MAX_DRAW_SIZE = 480
+
+# 難易度名 -> 短い辺の基準分割数 (initPuzzle と同じ対応)
+DIFFICULTY_BASE = {"easy": 4, "normal": 6, "hard": 8, "expert": 10}
+
+# 数値指定の難易度の許容範囲（スライダーの範囲より少し広め）
+MIN_BASE_COUNT = 2
+MAX_BASE_COUNT = 30
+
+# 同じアトラスを同時に生成しないためのロック
+_build_locks = {}
+_build_locks_guard = threading.Lock()
+
+
+def _js_round(value: float) -> int:
+    # JavaScript の Math.round と同じ丸め (Python の round は偶数丸めのため)
+    return int(math.floor(value + 0.5))
+
+
+def base_piece_count(difficulty: str) -> int:
+    if difficulty and str(difficulty).isdigit():
+        return int(difficulty)
+    return DIFFICULTY_BASE.get(difficulty, 6)
+
+
+def normalize_difficulty(difficulty) -> str:
+    """難易度を検証してキャッシュキーに使える文字列にする"""
+    difficulty = str(difficulty or "normal")
+    if difficulty in DIFFICULTY_BASE:
+        return difficulty
+    if difficulty.isdigit() and MIN_BASE_COUNT <= int(difficulty) <= MAX_BASE_COUNT:
+        return str(int(difficulty))
+    raise HTTPException(status_code=400, detail="difficulty が不正です")
+
+
+def compute_grid(width: int, height: int, difficulty: str):
+    """画像サイズと難易度から (rowMax, colMax, pieceSize) を求める"""
+    base = base_piece_count(difficulty)
+    aspect = width / height
+
+    if aspect >= 1:
+        draw_width = MAX_DRAW_SIZE
+    else:
+        draw_width = MAX_DRAW_SIZE * aspect
+
+    target_total = base * base
+    if aspect >= 1:
+        row_max = max(2, _js_round(math.sqrt(target_total / aspect)))
+        col_max = _js_round(row_max * aspect)
+    else:
+        col_max = max(2, _js_round(math.sqrt(target_total * aspect)))
+        row_max = _js_round(col_max / aspect)
+
+    piece_size = int(math.floor(draw_width / col_max))
+    return row_max, col_max, piece_size
+
+
+def piece_tabs(row: int, col: int, row_max: int, col_max: int):
+    """各辺の凹凸 (1: 凸, -1: 凹, 0: 平ら) を createPiece と同じ規則で返す"""
+    even = (row + col) % 2 == 0
+    return {
+        "top": 0 if row == 0 else (1 if even else -1),
+        "right": 0 if col == col_max - 1 else (-1 if even else 1),
+        "bottom": 0 if row == row_max - 1 else (1 if even else -1),
+        "left": 0 if col == 0 else (-1 if even else 1),
+    }
+
+
+def _piece_mask(tile: int, s: float, tabs: dict) -> "Image.Image":
+    from PIL import Image, ImageDraw
+
+    mask = Image.new("L", (tile, tile), 0)
+    draw = ImageDraw.Draw(mask)
+    draw.rectangle([s, s, s * 5, s * 5], fill=255)
+
+    centers = {
+        "top": (s * 3, s),
+        "right": (s * 5, s * 3),
+        "bottom": (s * 3, s * 5),
+        "left": (s, s * 3),
+    }
+    # 凸を先に描いてから凹を抜く（隣の辺の円とは角でしか接しない）
+    for sign, fill in ((1, 255), (-1, 0)):
+        for edge, (cx, cy) in centers.items():
+            if tabs[edge] == sign:
+                draw.ellipse([cx - s, cy - s, cx + s, cy + s], fill=fill)
+    return mask
+
+
+def render_atlas(data: bytes, difficulty: str):
+    """アトラス画像 (PNG bytes) とメタデータを生成する"""
+    from PIL import Image
+
+    source = Image.open(io.BytesIO(data))
+    source = source.convert("RGBA")
+    row_max, col_max, piece_size = compute_grid(source.width, source.height, difficulty)
+
+    area_w = col_max * piece_size
+    area_h = row_max * piece_size
+    resized = source.resize((area_w, area_h), Image.LANCZOS)
+
+    s = piece_size / 4
+    tile = int(s * 6)
+
+    atlas = Image.new("RGBA", (tile * col_max, tile * row_max), (0, 0, 0, 0))
+    pieces = []
+    for row in range(row_max):
+        for col in range(col_max):
+            tabs = piece_tabs(row, col, row_max, col_max)
+            # createPiece の drawImage(sourceImage, -(col*pieceSize - s), -(row*pieceSize - s)) に相当
+            left = int(round(col * piece_size - s))
+            top = int(round(row * piece_size - s))
+            # 画像外にはみ出す部分は crop で透明になる
+            region = resized.crop((left, top, left + tile, top + tile))
+            piece = Image.new("RGBA", (tile, tile), (0, 0, 0, 0))
+            piece.paste(region, (0, 0), _piece_mask(tile, s, tabs))
+
+            ax, ay = col * tile, row * tile
+            atlas.paste(piece, (ax, ay))
+            pieces.append({
+                "index": row * col_max + col,
+                "row": row,
+                "col": col,
+                "atlas_x": ax,
+                "atlas_y": ay,
+                "tabs": tabs,
+            })
+
+    buf = io.BytesIO()
+    atlas.save(buf, format="PNG", optimize=True)
+
+    meta = {
+        "rows": row_max,
+        "cols": col_max,
+        "piece_size": piece_size,
+        "tile_size": tile,
+        "width": atlas.width,
+        "height": atlas.height,
+        "pieces": pieces,
+    }
+    return buf.getvalue(), meta
+
+
+def _atlas_key(digest: str, difficulty: str) -> str:
+    return f"{digest}_{difficulty}"
+
+
+def _paths(key: str):
+    return cache_path("atlas", f"{key}.png"), cache_path("atlas", f"{key}.json")
+
+
+def atlas_file(key: str):
+    """キャッシュ済みアトラス PNG のパス（無ければ None）"""
+    # key はハッシュ + 難易度のみ。パス区切り等は受け付けない
+    if not key.replace("_", "").isalnum():
+        return None
+    png_path, _ = _paths(key)
+    return png_path if os.path.isfile(png_path) else None
+
+
+def _read_meta(key: str):
+    _, meta_path = _paths(key)
+    if not os.path.isfile(meta_path):
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _key_lock(key: str) -> threading.Lock:
+    with _build_locks_guard:
+        return _build_locks.setdefault(key, threading.Lock())
+
+
+def get_atlas(image_url: str, difficulty: str) -> dict:
+    """(画像, 難易度) のアトラスメタデータを返す。無ければ生成してキャッシュする"""
+    difficulty = normalize_difficulty(difficulty)
+
+    # 以前取得したURLならディスクのキャッシュを直接使う
+    digest = known_hash(image_url)
+    if digest:
+        meta = _read_meta(_atlas_key(digest, difficulty))
+        if meta:
+            return meta
+
+    data, digest = load_image(image_url)
+    key = _atlas_key(digest, difficulty)
+
+    with _key_lock(key):
+        meta = _read_meta(key)
+        if meta:
+            return meta
+
+        try:
+            png, meta = render_atlas(data, difficulty)
+        except decode_errors() as e:
+            print(f"Atlas render error: {e}")
+            raise HTTPException(status_code=400, detail="画像を読み込めません")
+        meta["key"] = key
+        meta["atlas_url"] = f"/puzzle/atlas/{key}.png"
+
+        png_path, meta_path = _paths(key)
+        # 書き込み途中のファイルを読まれないよう、一時ファイル経由で置き換える
+        for path, content, mode in ((png_path, png, "wb"), (meta_path, json.dumps(meta), "w")):
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, mode) as f:
+                f.write(content)
+            os.replace(tmp, path)
+        return meta
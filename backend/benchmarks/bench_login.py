@@ -0,0 +1,74 @@
+# benchmarks/bench_login.py
+# ログイン殺到時のスループットとイベントループの遅延を計測する
+#
+#   cd backend && python benchmarks/bench_login.py --users 40 --rounds 12
+#
+# 「inline」は従来通りイベントループ上で bcrypt.checkpw を呼んだ場合、
+# 「offloaded」は passwords.verify_password (専用プール + 同時実行制限) を使った場合。
+# loop lag は 10ms ごとに動くティッカーが実際に何ms遅れたか（= WebSocket が止まる時間）。
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import passwords  # noqa: E402
+
+TICK = 0.01
+
+
+async def _ticker(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+
+async def _inline_login(password: str, hashed: str):
+    # 修正前の login と同じく、イベントループ上で直接検証する
+    return passwords.verify_password_sync(password, hashed)
+
+
+async def _offloaded_login(password: str, hashed: str):
+    return await passwords.verify_password(password, hashed)
+
+
+async def run(name: str, login, users: int, password: str, hashed: str):
+    lags = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(_ticker(lags, stop))
+    await asyncio.sleep(TICK * 2)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(login(password, hashed) for _ in range(users)), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await ticker
+    ok = sum(1 for r in results if r is True)
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99) - 1] if lags else 0.0
+    print(f"{name:>10}: {users} logins in {elapsed:.2f}s "
+          f"({ok / elapsed:.1f} logins/s, ok={ok}), "
+          f"loop lag max={max(lags, default=0) * 1000:.0f}ms p99={p99 * 1000:.0f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=40, help="同時にログインする人数")
+    parser.add_argument("--rounds", type=int, default=passwords.BCRYPT_ROUNDS, help="bcrypt の work factor")
+    args = parser.parse_args()
+
+    password = "correct horse battery staple"
+    hashed = passwords.hash_password_sync(password, rounds=args.rounds)
+    print(f"bcrypt rounds={args.rounds}, hash concurrency={passwords.HASH_CONCURRENCY}, "
+          f"queue timeout={passwords.HASH_QUEUE_TIMEOUT}s")
+
+    asyncio.run(run("inline", _inline_login, args.users, password, hashed))
+    asyncio.run(run("offloaded", _offloaded_login, args.users, password, hashed))
+
+
+if __name__ == "__main__":
+    main()
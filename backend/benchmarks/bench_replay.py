@@ -0,0 +1,124 @@
+# benchmarks/bench_replay.py
+# リプレイ記録が MOVE の処理に足す時間を計測する
+# WebSocket の MOVE 受信時と同じ処理 (状態更新・送信先の決定・MOVED の JSON 化) を
+# 記録なし / 記録ありで繰り返し、1回あたりの時間と差分を比べる。
+#
+#   cd backend && python benchmarks/bench_replay.py --moves 200000
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("REPLAY_DIR", tempfile.mkdtemp())
+
+from multiplay import replay  # noqa: E402
+from multiplay.interest import InterestManager  # noqa: E402
+
+ROOM_ID = "00000000-0000-0000-0000-000000000001"
+USER_ID = "bench-user"
+
+
+class _State:
+    """GameStateManager と同じ形の最小限の状態（routers を import すると DB 設定が必要になるため）"""
+
+    def __init__(self, pieces: int):
+        self.game_states = {ROOM_ID: {
+            i: {"x": float(i), "y": 0.0, "rotation": 0, "group": [i], "locked_by": USER_ID}
+            for i in range(pieces)
+        }}
+
+    def update_piece(self, room_id, index, x, y, rotation, user_id):
+        piece = self.game_states[room_id].get(index)
+        if piece and piece["locked_by"] == user_id:
+            piece["x"] = x
+            piece["y"] = y
+            piece["rotation"] = rotation
+
+    def get_image(self, room_id):
+        return "/static/bench.png"
+
+    def get_start_time(self, room_id):
+        return int(time.time())
+
+
+def run_moves(state, interest, recorder, moves: int, pieces: int, rounds: int):
+    connections = list(range(8))
+    per_round = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for i in range(moves):
+            idx = i % pieces
+            x = (i * 7) % 2000 + 0.5
+            y = (i * 13) % 2000 + 0.25
+            state.update_piece(ROOM_ID, idx, x, y, 90, USER_ID)
+            if recorder is not None:
+                recorder.move(ROOM_ID, idx, x, y, 90)
+            interest.recipients(ROOM_ID, connections, idx, x, y)
+            json.dumps({"type": "MOVED", "index": idx, "x": x, "y": y, "rotation": 90, "user_id": USER_ID})
+        per_round.append((time.perf_counter() - start) / moves)
+        if recorder is not None:
+            # 書き出しはスレッドプールで行うので、ループ側の負担はバッファの取り出しだけ
+            rec = recorder.rooms[ROOM_ID]
+            rec.ring.drain()
+            rec.dirty = False
+    return statistics.median(per_round)
+
+
+async def main_async(args):
+    state = _State(args.pieces)
+    interest = InterestManager()
+    interest.reset_pieces(ROOM_ID, [{"index": i, "x": float(i), "y": 0.0} for i in range(args.pieces)])
+
+    recorder = replay.ReplayRecorder(state)
+    recorder.open(ROOM_ID)
+    recorder.start(ROOM_ID, [], int(time.time()))
+
+    # 1ラウンド分がリングバッファに収まるようにしておく（溢れた分は捨てられるので速く見えてしまう）
+    need = args.moves * replay._MOVE.size
+    if need > replay.REPLAY_BUFFER_BYTES:
+        rec = recorder.rooms[ROOM_ID]
+        rec.ring = replay.RingBuffer(need)
+
+    run_moves(state, interest, None, 1000, args.pieces, 1)  # ウォームアップ
+    base = run_moves(state, interest, None, args.moves, args.pieces, args.rounds)
+    recorded = run_moves(state, interest, recorder, args.moves, args.pieces, args.rounds)
+
+    # 1回の書き出し (REPLAY_FLUSH_INTERVAL 秒分) でループ上で行うバッファの取り出し
+    rec = recorder.rooms[ROOM_ID]
+    flush_bytes = int(args.rate * replay.REPLAY_FLUSH_INTERVAL) * replay._MOVE.size
+    chunk = b"\0" * flush_bytes
+    drain = 0.0
+    for _ in range(100):
+        rec.ring.write(chunk)
+        start = time.perf_counter()
+        rec.ring.drain()
+        drain += time.perf_counter() - start
+    drain /= 100
+
+    print(f"moves={args.moves}, pieces={args.pieces}, rounds={args.rounds}")
+    print(f"{'path':<20}{'us/move':>10}")
+    print(f"{'MOVE (no record)':<20}{base * 1e6:>10.3f}")
+    print(f"{'MOVE (record)':<20}{recorded * 1e6:>10.3f}")
+    print(f"overhead: {(recorded - base) * 1e6:.3f} us/move ({(recorded / base - 1) * 100:.1f}%), "
+          f"dropped records: {rec.dropped}")
+    print(f"ring drain per flush ({args.rate} moves/s -> {flush_bytes} bytes): {drain * 1e6:.1f} us")
+    await recorder.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--moves", type=int, default=100000)
+    parser.add_argument("--pieces", type=int, default=400)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--rate", type=int, default=480, help="ルーム全体の MOVE/秒 (8人 x 60fps)")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
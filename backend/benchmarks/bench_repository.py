@@ -0,0 +1,89 @@
+# benchmarks/bench_repository.py
+# ストレージ実装ごとに、シングルプレイの典型的な操作（セッション保存・読み込み・ルーム一覧）の
+# レイテンシを同じ負荷で計測する
+#
+#   cd backend && python benchmarks/bench_repository.py --backend sqlite
+#   cd backend && python benchmarks/bench_repository.py --backend supabase   (SUPABASE_* が必要)
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _timeit(samples: dict, name: str, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    samples.setdefault(name, []).append(time.perf_counter() - start)
+    return result
+
+
+def run(repo, iterations: int, pieces: int):
+    samples = {}
+    user_id = str(uuid.uuid4())
+    username = f"bench_{user_id[:8]}"
+    repo.create_user(user_id, username, "x")
+    puzzle = repo.create_puzzle_master(user_id, "/static/uploads/bench.jpg", "bench")
+
+    room_ids = []
+    for i in range(20):
+        room_id = str(uuid.uuid4())
+        repo.create_room({"id": room_id, "name": f"bench{i}", "host_user_id": user_id,
+                          "max_players": 4, "difficulty": "normal", "password": None, "image_url": None})
+        repo.add_member(room_id, user_id)
+        room_ids.append(room_id)
+
+    session_ids = []
+    for i in range(iterations):
+        session = _timeit(samples, "create_session", repo.create_session, user_id, puzzle["id"], "normal")
+        sid = session["id"]
+        session_ids.append(sid)
+        rows = [{"session_id": sid, "piece_index": p, "x": p * 1.5, "y": p * 2.5, "rotation": 0,
+                 "is_locked": False, "group_id": p} for p in range(pieces)]
+        _timeit(samples, "upsert_pieces", repo.upsert_pieces, rows)
+        _timeit(samples, "update_session", repo.update_session, sid, i, i % 2 == 0)
+        _timeit(samples, "get_session", repo.get_session, sid)
+        _timeit(samples, "list_pieces", repo.list_pieces, sid)
+        _timeit(samples, "list_rooms_with_counts", repo.list_rooms_with_counts)
+        _timeit(samples, "get_username", repo.get_username, user_id)
+
+    # 後片付け
+    repo.delete_pieces(session_ids)
+    repo.delete_sessions_by_puzzle(puzzle["id"])
+    repo.delete_puzzle_master(puzzle["id"])
+    for room_id in room_ids:
+        repo.delete_room(room_id)
+
+    print(f"{'operation':<24}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for name, values in samples.items():
+        values.sort()
+        p95 = values[max(0, int(len(values) * 0.95) - 1)]
+        print(f"{name:<24}{statistics.median(values) * 1000:>10.2f}{p95 * 1000:>10.2f}{values[-1] * 1000:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=["sqlite", "supabase"], default="sqlite")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--pieces", type=int, default=100, help="1セッションあたりのピース数")
+    args = parser.parse_args()
+
+    from repository import SQLiteRepository, SupabaseRepository
+
+    if args.backend == "sqlite":
+        path = os.path.join(tempfile.mkdtemp(), "bench.db")
+        repo = SQLiteRepository(path)
+    else:
+        from supabase import create_client
+        repo = SupabaseRepository(create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_SERVICE_KEY"]))
+
+    print(f"backend={args.backend}, iterations={args.iterations}, pieces={args.pieces}")
+    run(repo, args.iterations, args.pieces)
+
+
+if __name__ == "__main__":
+    main()
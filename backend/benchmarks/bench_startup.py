@@ -0,0 +1,98 @@
+# benchmarks/bench_startup.py
+# コールドスタート（プロセス起動 → 最初のレスポンス）にかかる時間を計測する
+# uvicorn を別プロセスで起動し、指定したパスが 200 を返すまでの時間を --runs 回測る。
+# Render の再起動・スケールアウトのたびに払う時間に相当する。
+#
+#   cd backend && python benchmarks/bench_startup.py --runs 5
+#   cd backend && python benchmarks/bench_startup.py --path /room/list   # DB を使う最初のリクエスト
+#
+# 既定では STORAGE_BACKEND=sqlite（一時ファイル）で起動する。
+# Supabase で測るときは --backend supabase（SUPABASE_URL / SUPABASE_SERVICE_KEY が必要）。
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+POLL_INTERVAL = 0.005
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _get(url: str) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=5) as res:
+            res.read()
+            return res.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def measure(path: str, env: dict, timeout: float) -> float:
+    """起動してから path が 200 を返すまでの秒数"""
+    port = _free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        url = f"http://127.0.0.1:{port}{path}"
+        while time.perf_counter() - start < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"サーバーが終了しました (code {proc.returncode})")
+            try:
+                status = _get(url)
+            except (urllib.error.URLError, ConnectionError, OSError):
+                time.sleep(POLL_INTERVAL)
+                continue
+            if status != 200:
+                raise RuntimeError(f"{path} が {status} を返しました")
+            return time.perf_counter() - start
+        raise RuntimeError(f"{timeout} 秒以内に応答がありませんでした")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/", help="最初に要求するパス")
+    parser.add_argument("--backend", choices=("sqlite", "supabase"), default="sqlite")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    env = dict(os.environ, STORAGE_BACKEND=args.backend)
+    tmp = None
+    if args.backend == "sqlite":
+        tmp = tempfile.mkdtemp()
+        env["SQLITE_PATH"] = os.path.join(tmp, "bench.db")
+        env.setdefault("CACHE_DIR", os.path.join(tmp, "cache"))
+        env.setdefault("REPLAY_DIR", os.path.join(tmp, "replays"))
+
+    # 1回目は .pyc の生成などが入るので捨てる
+    measure(args.path, env, args.timeout)
+    times = [measure(args.path, env, args.timeout) * 1000 for _ in range(args.runs)]
+
+    print(f"cold start -> first 200 on {args.path} ({args.backend}, {args.runs} runs)")
+    print(f"  min    {min(times):8.1f} ms")
+    print(f"  median {statistics.median(times):8.1f} ms")
+    print(f"  max    {max(times):8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
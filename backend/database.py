@@ -1,7 +1,9 @@
 # database.py
-from supabase import create_client
 from dotenv import load_dotenv
 import os
+import threading
+
+from repository import create_repository
 
 load_dotenv()
 # 環境変数から取得（安全なやり方）
@@ -9,4 +11,28 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
 
-supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+# データの保存先: supabase (既定) / sqlite
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase")
+
+# Supabase は Storage (画像) にも使うので、設定があれば sqlite モードでも使う
+SUPABASE_ENABLED = bool(SUPABASE_URL and SUPABASE_SERVICE_KEY)
+# supabase パッケージの import とクライアントの作成は重いので、起動時ではなく最初に使うときに
+# 1つだけ作り、以降はプロセス全体で使い回す（HTTP 接続もクライアント内で再利用される）
+_supabase = None
+_supabase_lock = threading.Lock()
+
+
+def get_supabase():
+    """共有の Supabase クライアント。設定が無ければ None"""
+    global _supabase
+    if _supabase is None and SUPABASE_ENABLED:
+        with _supabase_lock:
+            if _supabase is None:
+                from supabase import create_client
+                _supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+    return _supabase
+
+
+# ルーターはこの repo 経由でデータにアクセスする
+# (Supabase のクライアントは最初のクエリで作られる)
+repo = create_repository(STORAGE_BACKEND, get_supabase if SUPABASE_ENABLED else None)
@@ -0,0 +1,148 @@
+# images.py
+# パズル画像の取得（ローカルの uploads / Supabase Storage の公開URL）と
+# 生成物キャッシュの置き場所をまとめたモジュール
+import hashlib
+import os
+import re
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from fastapi import HTTPException
+
+from database import SUPABASE_URL
+
+base_path = os.path.dirname(os.path.abspath(__file__))
+frontend_path = os.path.abspath(os.path.join(base_path, "../frontend"))
+
+# 生成物（スプライトアトラス等）のキャッシュ先
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(base_path, "cache"))
+
+# 取得する元画像の上限サイズ (bytes)
+MAX_SOURCE_BYTES = int(os.getenv("MAX_SOURCE_BYTES", str(20 * 1024 * 1024)))
+
+# image_url -> (content hash, 置き換えの検出用の値) (同じURLを毎回ハッシュし直さないため)
+# ・件数は URL_HASH_CACHE_SIZE までの LRU
+# ・content hash 名の URL (ローカル・Storage とも) は内容が変わらないのでそのまま使う
+# ・それ以外のローカルファイルは mtime / size が変わっていれば、Storage の URL は
+#   URL_HASH_REMOTE_TTL 秒ごとに、置き換えられたかもしれないので使わない（取り直す）
+# ・画像を削除したら forget_hash で消す
+URL_HASH_CACHE_SIZE = int(os.getenv("URL_HASH_CACHE_SIZE", "4096"))
+URL_HASH_REMOTE_TTL = float(os.getenv("URL_HASH_REMOTE_TTL", "300"))
+_url_hashes = OrderedDict()
+_url_hashes_lock = threading.Lock()
+# content hash 名 (uploads.py) のファイルは内容が変わらない
+_HASHED_NAME = re.compile(r"^[0-9a-f]{64}\.[a-z]+$")
+
+
+def cache_path(*parts: str) -> str:
+    """キャッシュディレクトリ配下のパスを返す（ディレクトリは作成済みにする）"""
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _local_path(image_url: str):
+    """/static/... のURLを frontend 配下の実ファイルパスに変換する"""
+    path = urlparse(image_url).path
+    if not path.startswith("/static/"):
+        return None
+    full = os.path.abspath(os.path.join(frontend_path, path[len("/static/"):]))
+    # ディレクトリトラバーサル防止
+    if not full.startswith(frontend_path + os.sep):
+        return None
+    return full
+
+
+def load_image_bytes(image_url: str) -> bytes:
+    """パズル画像のバイト列を取得する（ローカル or Supabase Storage のみ許可）"""
+    if not image_url:
+        raise HTTPException(status_code=400, detail="image_url が指定されていません")
+
+    local = _local_path(image_url)
+    if local:
+        if not os.path.isfile(local):
+            raise HTTPException(status_code=404, detail="画像が存在しません")
+        with open(local, "rb") as f:
+            data = f.read(MAX_SOURCE_BYTES + 1)
+    else:
+        data = _fetch_remote(image_url)
+
+    if len(data) > MAX_SOURCE_BYTES:
+        raise HTTPException(status_code=413, detail="画像サイズが大きすぎます")
+    return data
+
+
+def _fetch_remote(image_url: str) -> bytes:
+    # 任意のURLを取りに行かないよう、自分の Supabase Storage のみに限定
+    if not SUPABASE_URL or not image_url.startswith(SUPABASE_URL.rstrip("/") + "/storage/"):
+        raise HTTPException(status_code=400, detail="この画像URLは使用できません")
+
+    try:
+        with urllib.request.urlopen(image_url, timeout=10) as res:
+            return res.read(MAX_SOURCE_BYTES + 1)
+    except Exception as e:
+        print(f"Image fetch error: {e}")
+        raise HTTPException(status_code=502, detail="画像の取得に失敗しました")
+
+
+def _signature(image_url: str):
+    """置き換えを検出するための値。内容が変わらない URL は None"""
+    if _HASHED_NAME.match(os.path.basename(urlparse(image_url).path)):
+        return None
+    local = _local_path(image_url)
+    if not local:
+        # Storage: 一定時間で取り直す
+        return int(time.monotonic() // URL_HASH_REMOTE_TTL) if URL_HASH_REMOTE_TTL > 0 else time.monotonic()
+    try:
+        st = os.stat(local)
+    except OSError:
+        return "missing"
+    return st.st_mtime_ns, st.st_size
+
+
+def load_image(image_url: str):
+    """画像を取得して (bytes, content_hash) を返す"""
+    signature = _signature(image_url)
+    data = load_image_bytes(image_url)
+    digest = content_hash(data)
+    with _url_hashes_lock:
+        _url_hashes[image_url] = (digest, signature)
+        _url_hashes.move_to_end(image_url)
+        while len(_url_hashes) > URL_HASH_CACHE_SIZE:
+            _url_hashes.popitem(last=False)
+    return data, digest
+
+
+def known_hash(image_url: str):
+    """以前に取得したことがあり、その後置き換えられていないURLなら、その content hash を返す"""
+    with _url_hashes_lock:
+        cached = _url_hashes.get(image_url)
+    if not cached:
+        return None
+    digest, signature = cached
+    if signature is not None and _signature(image_url) != signature:
+        forget_hash(image_url)
+        return None
+    with _url_hashes_lock:
+        if image_url in _url_hashes:
+            _url_hashes.move_to_end(image_url)
+    return digest
+
+
+def forget_hash(image_url: str):
+    """削除・置き換えられた画像の URL を忘れる"""
+    with _url_hashes_lock:
+        _url_hashes.pop(image_url, None)
+
+
+def decode_errors():
+    """PIL が画像を読めなかったときの例外（PIL は起動時に読み込まないので、必要になってから参照する）"""
+    from PIL import Image
+    return (OSError, Image.DecompressionBombError)
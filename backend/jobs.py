@@ -0,0 +1,229 @@
+# jobs.py
+# プロセス内のバックグラウンドジョブキュー（削除の連鎖処理用）
+# ・削除 API はジョブを積むだけで即座に返る
+# ・ワーカーは同じ種類のジョブをまとめて取り出して一括処理する（ピース・Storage の削除など）
+# ・失敗したジョブは指数バックオフで再試行する
+# 削除待ちの ID は pending に入れておき、一覧 API からはすぐに見えなくする。
+import asyncio
+import os
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Set
+from urllib.parse import urlparse
+
+from starlette.concurrency import run_in_threadpool
+
+from database import repo, get_supabase, SUPABASE_ENABLED, SUPABASE_URL
+from images import forget_hash
+import uploads
+from leaderboard import leaderboards
+from multiplay.chat import CHAT_PERSIST
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE = float(os.getenv("JOB_RETRY_BASE", "1.0"))
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", "50"))
+
+HASHED_NAME = re.compile(r"^[0-9a-f]{64}\.[a-z]+$")
+
+
+@dataclass
+class Job:
+    kind: str
+    payload: Any
+    attempts: int = 0
+
+
+@dataclass
+class JobQueue:
+    queue: asyncio.Queue = None
+    workers: List[asyncio.Task] = field(default_factory=list)
+    handlers: Dict[str, Callable[[List[Any]], None]] = field(default_factory=dict)
+    # kind -> 処理待ちの payload (一覧から除外する用)
+    pending: Dict[str, Set[Any]] = field(default_factory=lambda: defaultdict(set))
+
+    def register(self, kind: str):
+        """kind のジョブを payload のリストで受け取る一括処理関数を登録するデコレータ"""
+        def deco(func):
+            self.handlers[kind] = func
+            return func
+        return deco
+
+    def _ensure_started(self):
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        self.workers = [w for w in self.workers if not w.done()]
+        while len(self.workers) < JOB_WORKERS:
+            self.workers.append(asyncio.get_running_loop().create_task(self._worker()))
+
+    def enqueue(self, kind: str, payload: Any):
+        """ジョブを積む（イベントループ上から呼ぶこと）"""
+        self._ensure_started()
+        self.pending[kind].add(payload)
+        self.queue.put_nowait(Job(kind, payload))
+
+    def is_pending(self, kind: str, payload: Any) -> bool:
+        return payload in self.pending.get(kind, ())
+
+    def _take_batch(self, first: Job) -> List[Job]:
+        """同じ種類のジョブをキューから最大 JOB_BATCH_SIZE 件まとめて取り出す"""
+        batch, others = [first], []
+        while len(batch) < JOB_BATCH_SIZE and not self.queue.empty():
+            job = self.queue.get_nowait()
+            (batch if job.kind == first.kind else others).append(job)
+        for job in others:
+            self.queue.put_nowait(job)
+        return batch
+
+    async def _worker(self):
+        while True:
+            first = await self.queue.get()
+            batch = self._take_batch(first)
+            payloads = list(dict.fromkeys(job.payload for job in batch))
+            try:
+                await run_in_threadpool(self.handlers[first.kind], payloads)
+            except Exception as e:
+                print(f"Job {first.kind} failed ({len(batch)} items): {e}")
+                for job in batch:
+                    self._retry(job)
+            else:
+                for payload in payloads:
+                    self.pending[first.kind].discard(payload)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _retry(self, job: Job):
+        job.attempts += 1
+        if job.attempts >= JOB_MAX_ATTEMPTS:
+            print(f"Job {job.kind} {job.payload!r} gave up after {job.attempts} attempts")
+            self.pending[job.kind].discard(job.payload)
+            return
+        delay = JOB_RETRY_BASE * (2 ** (job.attempts - 1))
+        # 再投入まで task_done を待たせないよう、遅延してから積み直す
+        asyncio.get_running_loop().call_later(delay, self.queue.put_nowait, job)
+
+    async def drain(self, timeout: float = 10):
+        """シャットダウン時に、積まれているジョブをできるだけ処理する"""
+        if self.queue is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"Job queue drain timed out ({self.queue.qsize()} jobs left)")
+        for w in self.workers:
+            w.cancel()
+
+
+job_queue = JobQueue()
+
+
+# ==========================================================
+#  削除の連鎖処理
+# ==========================================================
+
+def _enqueue_threadsafe(kind: str, payload: Any, delay: float = 0):
+    # ハンドラはスレッドプールで動くので、ループに戻して積む
+    if delay:
+        _loop.call_soon_threadsafe(_loop.call_later, delay, job_queue.enqueue, kind, payload)
+    else:
+        _loop.call_soon_threadsafe(job_queue.enqueue, kind, payload)
+
+
+@job_queue.register("delete_puzzle")
+def _delete_puzzles(puzzle_ids: List[int]):
+    # ベスト記録はまとめて1回で消す
+    repo.delete_best_records(puzzle_ids)
+    for puzzle_id in puzzle_ids:
+        puzzle = repo.get_puzzle_master(puzzle_id)
+        session_ids = [s["id"] for s in repo.list_sessions_by_puzzle(puzzle_id)]
+
+        # ピース -> セッション -> パズル本体 の順に消す（外部キー制約のため）
+        repo.delete_pieces(session_ids)
+        repo.delete_sessions_by_puzzle(puzzle_id)
+        repo.delete_puzzle_master(puzzle_id)
+        leaderboards.drop_puzzle(puzzle_id)
+
+        if puzzle and puzzle.get("image_url"):
+            _enqueue_threadsafe("delete_image", puzzle["image_url"])
+
+
+@job_queue.register("delete_session")
+def _delete_sessions(session_ids: List[str]):
+    repo.delete_pieces(session_ids)
+    for session_id in session_ids:
+        repo.delete_session(session_id)
+
+
+@job_queue.register("delete_room")
+def _delete_rooms(room_ids: List[str]):
+    for room_id in room_ids:
+        room = repo.get_room(room_id)
+        repo.delete_room_members(room_id)
+        repo.delete_room(room_id)
+        if CHAT_PERSIST:
+            repo.delete_chat_messages(room_id)
+        if room and room.get("image_url"):
+            _enqueue_threadsafe("delete_image", room["image_url"])
+
+
+def _storage_object(image_url: str):
+    """Supabase Storage の公開URLから (bucket, path) を取り出す"""
+    prefix = f"{(SUPABASE_URL or '').rstrip('/')}/storage/v1/object/public/"
+    if not SUPABASE_URL or not image_url.startswith(prefix):
+        return None
+    bucket, _, path = image_url[len(prefix):].partition("/")
+    return bucket, path.split("?")[0]
+
+
+@job_queue.register("delete_image")
+def _delete_images(image_urls: List[str]):
+    # 画像は content-addressed で共有されているので、どこからも参照されなくなったものだけ消す
+    by_bucket = defaultdict(list)
+    # 削除が終わるまで同じ内容の保存を待たせる（保存と削除が入れ違って、使う画像を消さないように）
+    with uploads.deleting() as recently_stored:
+        for url in image_urls:
+            if repo.image_in_use(url):
+                continue
+            obj = _storage_object(url) if SUPABASE_ENABLED else None
+            if obj:
+                name = os.path.basename(obj[1])
+            elif urlparse(url).path.startswith("/static/uploads/"):
+                name = os.path.basename(urlparse(url).path)
+            else:
+                continue
+            # ローカルは uploads.py が content hash 名で保存したファイルだけが対象
+            hashed = HASHED_NAME.match(name) is not None
+            if hashed and recently_stored(name.split(".")[0]):
+                # 保存されたばかりで、これから部屋・パズルに使われるかもしれない -> 猶予の後に見直す
+                _enqueue_threadsafe("delete_image", url, delay=uploads.UPLOAD_REUSE_GRACE)
+                continue
+            forget_hash(url)
+            if obj:
+                by_bucket[obj[0]].append(obj[1])
+                uploads.forget_pushed(*obj)
+            # Storage に送った画像もローカルに元のファイルが残っている。ローカルの URL など
+            # 別の形で同じ内容を参照しているところがあれば、ローカルのファイルは残す
+            if hashed and not repo.content_in_use(name.split(".")[0]):
+                local = os.path.join(uploads.UPLOAD_DIR, name)
+                if os.path.isfile(local):
+                    os.remove(local)
+
+        for bucket, paths in by_bucket.items():
+            # Storage の削除は一括 API で1回にまとめる
+            get_supabase().storage.from_(bucket).remove(paths)
+
+
+_loop = None
+
+
+def enqueue(kind: str, payload: Any):
+    """API から呼ぶ入口。ハンドラから積み直すためにループを覚えておく"""
+    global _loop
+    _loop = asyncio.get_running_loop()
+    job_queue.enqueue(kind, payload)
+
+
+def is_pending(kind: str, payload: Any) -> bool:
+    return job_queue.is_pending(kind, payload)
@@ -0,0 +1,250 @@
+# leaderboard.py
+# パズル・難易度ごとのランキング（プロセス内のインデックス）
+# ・起動時に user_best_records を一度だけ読み込んで構築し、以降は save_session の
+#   自己ベスト更新のたびに差分で反映する（リクエストのたびにテーブルを並べ替えない）
+# ・ボードごとに順位付きスキップリスト（各リンクが飛ばす件数を持つ）を使い、
+#   上位 K 件・ユーザーの順位・任意のページを O(log n) で引ける
+# 同タイムは先に記録した人が上位。
+import itertools
+import random
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from database import repo
+
+MAX_LEVEL = 32
+LEVEL_P = 0.25
+
+# (elapsed_time, 記録順, user_id)
+Key = Tuple[int, int, str]
+
+
+class _Node:
+    __slots__ = ("key", "forward", "span")
+
+    def __init__(self, key, level: int):
+        self.key = key
+        self.forward: List[Optional["_Node"]] = [None] * level
+        # forward[i] までに飛ばす要素数
+        self.span: List[int] = [0] * level
+
+
+class RankedIndex:
+    """順位（位置）で引けるスキップリスト"""
+
+    def __init__(self):
+        self.head = _Node(None, MAX_LEVEL)
+        self.level = 1
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    @staticmethod
+    def _random_level() -> int:
+        level = 1
+        while level < MAX_LEVEL and random.random() < LEVEL_P:
+            level += 1
+        return level
+
+    def insert(self, key):
+        update = [self.head] * MAX_LEVEL
+        rank = [0] * MAX_LEVEL
+        x = self.head
+        for i in reversed(range(self.level)):
+            rank[i] = 0 if i == self.level - 1 else rank[i + 1]
+            while x.forward[i] is not None and x.forward[i].key < key:
+                rank[i] += x.span[i]
+                x = x.forward[i]
+            update[i] = x
+
+        level = self._random_level()
+        if level > self.level:
+            for i in range(self.level, level):
+                rank[i] = 0
+                update[i] = self.head
+                self.head.span[i] = self.length
+            self.level = level
+
+        node = _Node(key, level)
+        for i in range(level):
+            node.forward[i] = update[i].forward[i]
+            update[i].forward[i] = node
+            node.span[i] = update[i].span[i] - (rank[0] - rank[i])
+            update[i].span[i] = (rank[0] - rank[i]) + 1
+        for i in range(level, self.level):
+            update[i].span[i] += 1
+        self.length += 1
+
+    def remove(self, key) -> bool:
+        update = [self.head] * MAX_LEVEL
+        x = self.head
+        for i in reversed(range(self.level)):
+            while x.forward[i] is not None and x.forward[i].key < key:
+                x = x.forward[i]
+            update[i] = x
+        x = x.forward[0]
+        if x is None or x.key != key:
+            return False
+
+        for i in range(self.level):
+            if update[i].forward[i] is x:
+                update[i].span[i] += x.span[i] - 1
+                update[i].forward[i] = x.forward[i]
+            else:
+                update[i].span[i] -= 1
+        while self.level > 1 and self.head.forward[self.level - 1] is None:
+            self.level -= 1
+        self.length -= 1
+        return True
+
+    def rank(self, key) -> Optional[int]:
+        """key の順位 (1始まり)。無ければ None"""
+        traversed = 0
+        x = self.head
+        for i in reversed(range(self.level)):
+            while x.forward[i] is not None and x.forward[i].key <= key:
+                traversed += x.span[i]
+                x = x.forward[i]
+            if x is not self.head and x.key == key:
+                return traversed
+        return None
+
+    def range(self, offset: int, limit: int) -> list:
+        """順位 offset+1 から最大 limit 件の key"""
+        if offset < 0 or limit <= 0 or offset >= self.length:
+            return []
+        target = offset + 1
+        traversed = 0
+        x = self.head
+        for i in reversed(range(self.level)):
+            while x.forward[i] is not None and traversed + x.span[i] <= target:
+                traversed += x.span[i]
+                x = x.forward[i]
+            if traversed == target:
+                break
+        keys = []
+        while x is not None and len(keys) < limit:
+            keys.append(x.key)
+            x = x.forward[0]
+        return keys
+
+
+class Board:
+    def __init__(self):
+        self.index = RankedIndex()
+        # user_id -> 現在の key
+        self.entries: Dict[str, Key] = {}
+
+    def submit(self, user_id: str, elapsed_time: int, seq: int) -> bool:
+        """自己ベストなら反映して True"""
+        old = self.entries.get(user_id)
+        if old is not None:
+            if old[0] <= elapsed_time:
+                return False
+            self.index.remove(old)
+        key = (elapsed_time, seq, user_id)
+        self.entries[user_id] = key
+        self.index.insert(key)
+        return True
+
+
+class Leaderboards:
+    def __init__(self):
+        self.boards: Dict[Tuple[int, str], Board] = {}
+        self.usernames: Dict[str, str] = {}
+        self.lock = threading.Lock()
+        self._seq = itertools.count()
+        # 構築中に来た更新（構築後にもう一度当てる）
+        self._during_warm: Optional[list] = None
+        self.warmed = False
+
+    # --- 構築・更新 (スレッドプールから呼ばれる) ---
+
+    def warm(self):
+        """DB の user_best_records から全ボードを作る（起動時に1回）"""
+        with self.lock:
+            self._during_warm = []
+        try:
+            rows = repo.list_best_records()
+            usernames = repo.get_usernames({r["user_id"] for r in rows})
+        except Exception as e:
+            print(f"Leaderboard warm-up failed: {e}")
+            with self.lock:
+                self._during_warm = None
+            return
+
+        # 同タイムは先に記録した人を上にするため、更新日時順に積む
+        rows.sort(key=lambda r: (r["elapsed_time"], r.get("updated_at") or ""))
+        boards: Dict[Tuple[int, str], Board] = {}
+        with self.lock:
+            for r in rows:
+                key = (r["puzzle_id"], r["difficulty"] or "normal")
+                board = boards.get(key)
+                if board is None:
+                    board = boards[key] = Board()
+                board.submit(r["user_id"], r["elapsed_time"], next(self._seq))
+            for user_id, puzzle_id, difficulty, elapsed_time in self._during_warm:
+                boards.setdefault((puzzle_id, difficulty), Board()).submit(user_id, elapsed_time, next(self._seq))
+            self.boards = boards
+            self.usernames.update(usernames)
+            self._during_warm = None
+            self.warmed = True
+        print(f"Leaderboards warmed: {len(rows)} records, {len(boards)} boards")
+
+    def record(self, user_id: str, puzzle_id: int, difficulty: str, elapsed_time: int):
+        """クリア記録を反映する（自己ベストでなければ何もしない）"""
+        difficulty = difficulty or "normal"
+        if user_id not in self.usernames:
+            try:
+                name = repo.get_username(user_id)
+            except Exception as e:
+                print(f"Username fetch error: {e}")
+                name = None
+            if name:
+                self.usernames[user_id] = name
+        with self.lock:
+            if self._during_warm is not None:
+                self._during_warm.append((user_id, puzzle_id, difficulty, elapsed_time))
+            board = self.boards.get((puzzle_id, difficulty))
+            if board is None:
+                board = self.boards[(puzzle_id, difficulty)] = Board()
+            board.submit(user_id, elapsed_time, next(self._seq))
+
+    def drop_puzzle(self, puzzle_id: int):
+        with self.lock:
+            for key in [k for k in self.boards if k[0] == puzzle_id]:
+                del self.boards[key]
+
+    # --- 参照 ---
+
+    def _entry(self, rank: int, key: Key) -> dict:
+        return {
+            "rank": rank,
+            "user_id": key[2],
+            "username": self.usernames.get(key[2]),
+            "elapsed_time": key[0],
+        }
+
+    def page(self, puzzle_id: int, difficulty: str, offset: int = 0, limit: int = 10) -> dict:
+        """順位 offset+1 から limit 件（offset=0 なら上位 K 件）"""
+        with self.lock:
+            board = self.boards.get((puzzle_id, difficulty))
+            if board is None:
+                return {"total": 0, "entries": []}
+            keys = board.index.range(offset, limit)
+            return {
+                "total": len(board.index),
+                "entries": [self._entry(offset + i + 1, k) for i, k in enumerate(keys)],
+            }
+
+    def rank_of(self, puzzle_id: int, difficulty: str, user_id: str) -> dict:
+        with self.lock:
+            board = self.boards.get((puzzle_id, difficulty))
+            key = board.entries.get(user_id) if board else None
+            if key is None:
+                return {"total": len(board.index) if board else 0, "rank": None, "elapsed_time": None}
+            return {"total": len(board.index), "rank": board.index.rank(key), "elapsed_time": key[0]}
+
+
+leaderboards = Leaderboards()
@@ -1,19 +1,19 @@
-from fastapi.staticfiles import StaticFiles
 import os
-from fastapi import FastAPI
+import asyncio
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import JSONResponse, Response
 from routers import puzzle, user, room, multiplayer
-from dotenv import load_dotenv
-from supabase import create_client, Client
+from uploads import UploadSizeLimitMiddleware
+from static_files import StaticIndex, CachedStaticFiles
+from jobs import job_queue
+from leaderboard import leaderboards
+from database import get_supabase
+from starlette.concurrency import run_in_threadpool
+from tracing import TracingMiddleware, profiler
 
 
 app = FastAPI()
-load_dotenv()
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-
-supabase_client: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 # ベースパスとフロントエンドパスの設定
 base_path = os.path.dirname(os.path.abspath(__file__))
@@ -29,10 +29,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# アップロードのサイズ上限を受信中にチェック（巨大なボディを最後まで受け取らない）
+app.add_middleware(UploadSizeLimitMiddleware)
+
+# リクエストごとの処理時間の内訳 (Server-Timing ヘッダ・遅いリクエストのログ)
+# 最後に追加したものが一番外側になるので、他のミドルウェアの時間も含めて測れる
+app.add_middleware(TracingMiddleware)
+
 # --- 静的ファイルの提供 ---
 # フロントエンド内の /static ディレクトリを /static として公開
 # 画像、CSS、JavaScriptファイルなどを提供
-app.mount("/static", StaticFiles(directory=os.path.join(frontend_path)), name="static")
+# 起動時に一覧・ETag・圧縮版を作っておき、リクエストごとにファイルを探さない
+static_index = StaticIndex(frontend_path)
+static_index.build()
+app.mount("/static", CachedStaticFiles(static_index), name="static")
 
 # --- ルーター登録 ---
 # ピースの保存・取得などのロジックは routers/puzzle.py に集約されています
@@ -47,101 +57,110 @@ app.include_router(multiplayer.router, tags=["Multiplayer"])
 
 # --- ホーム画面 (index.html) ---
 @app.get("/")
-def serve_index_html():
-    path = os.path.join(frontend_path, "index.html")
-    if not os.path.exists(path):
-        return JSONResponse(content={"error": "index.html が存在しません"}, status_code=404)
-    return FileResponse(path)
+def serve_index_html(request: Request):
+    return static_index.page(request, "index.html")
 
 # --- アップロード画面 ---
 @app.get("/upload")
-def serve_upload_html():
-    path = os.path.join(frontend_path, "upload.html")
-    if not os.path.exists(path):
-        return JSONResponse(content={"error": "upload.html が存在しません"}, status_code=404)
-    return FileResponse(path)
+def serve_upload_html(request: Request):
+    return static_index.page(request, "upload.html")
 
 # --- パズルプレイ画面 ---
 @app.get("/play")
-def serve_play_html():
+def serve_play_html(request: Request):
     # シングルプレイ（進行度保存/再開）とマルチプレイの両方で使用される
-    path = os.path.join(frontend_path, "play.html")
-    if not os.path.exists(path):
-        return JSONResponse(content={"error": "play.html が存在しません"}, status_code=404)
-    return FileResponse(path)
+    return static_index.page(request, "play.html")
 
 @app.get("/multi_play.html")
-def serve_multi_play_html():
-    path = os.path.join(frontend_path, "multi_play.html")
-    if not os.path.exists(path):
-        return JSONResponse(content={"error": "multi_play.html が存在しません"}, status_code=404)
-    return FileResponse(path)
-
-
+def serve_multi_play_html(request: Request):
+    return static_index.page(request, "multi_play.html")
 
 # --- ログイン画面 ---
 @app.get("/user/login")
-def serve_login_html():
-    path = os.path.join(frontend_path, "login.html")
-    if not os.path.exists(path):
-        return JSONResponse(content={"error": "login.html が存在しません"}, status_code=404)
-    return FileResponse(path)
+def serve_login_html(request: Request):
+    return static_index.page(request, "login.html")
 
 # --- 新規登録画面 ---
 @app.get("/user/signup")
-def serve_signup_html():
-    path = os.path.join(frontend_path, "signup.html")
-    if not os.path.exists(path):
-        return JSONResponse(content={"error": "signup.html が存在しません"}, status_code=404)
-    return FileResponse(path)
+def serve_signup_html(request: Request):
+    return static_index.page(request, "signup.html")
 
 # ログイン後 モード選択画面
 @app.get("/mode")
-def serve_mode_select():
-    path = os.path.join(frontend_path, "mode_select.html")
-    return FileResponse(path)
+def serve_mode_select(request: Request):
+    return static_index.page(request, "mode_select.html")
 
 # 🚀 【新規追加】シングルプレイ：ギャラリー画面
 @app.get("/single/gallery")
-def serve_single_gallery():
-    path = os.path.join(frontend_path, "single_gallery.html")
-    if not os.path.exists(path):
-        # single_gallery.html が存在しない場合、エラーを返す
-        return JSONResponse(content={"error": "single_gallery.html が存在しません。Step 4のファイル作成を確認してください。"}, status_code=404)
-    return FileResponse(path)
+def serve_single_gallery(request: Request):
+    return static_index.page(request, "single_gallery.html")
 
 # --- ルーム関連 ---
 @app.get("/room/create")
-def serve_room_create():
-    path = os.path.join(frontend_path, "room_create.html")
-    return FileResponse(path)
+def serve_room_create(request: Request):
+    return static_index.page(request, "room_create.html")
 
 @app.get("/room/join")
-def serve_room_join():
-    path = os.path.join(frontend_path, "room_join.html")
-    return FileResponse(path)
+def serve_room_join(request: Request):
+    return static_index.page(request, "room_join.html")
 
 # --- ルーム一覧ページ ---
 @app.get("/room/list")
-def serve_room_list():
-    path = os.path.join(frontend_path, "room_list.html")
-    if not os.path.exists(path):
-        return JSONResponse(content={"error": "room_list.html が存在しません"}, status_code=404)
-    return FileResponse(path)
-
+def serve_room_list(request: Request):
+    return static_index.page(request, "room_list.html")
 
 # ルーム一覧ページ
 @app.get("/room/list-page")
-def serve_room_list():
-    path = os.path.join(frontend_path, "room_list.html")
-    return FileResponse(path)
+def serve_room_list(request: Request):
+    return static_index.page(request, "room_list.html")
 
 @app.get("/error")
-def serve_error_html():
-    path = os.path.join(frontend_path, "error.html")
-    if not os.path.exists(path):
-         return JSONResponse(content={"error": "error.html が存在しません"}, status_code=404)
-    return FileResponse(path)
+def serve_error_html(request: Request):
+    return static_index.page(request, "error.html")
+
+# 起動を速くするため import 時には読み込んでいない重いもの (Supabase クライアント・PyJWT・PIL) を、
+# 起動後にバックグラウンドで用意しておく（最初のリクエストがその分を待たないように）
+def preload_deferred():
+    import jwt  # noqa: F401
+    from PIL import Image  # noqa: F401
+    get_supabase()
+
+@app.on_event("startup")
+async def start_preload():
+    app.state.preload = asyncio.create_task(run_in_threadpool(preload_deferred))
+
+# ランキングのインデックスを DB から構築しておく（起動を待たせないようバックグラウンドで）
+@app.on_event("startup")
+async def warm_leaderboards():
+    app.state.leaderboard_warmup = asyncio.create_task(run_in_threadpool(leaderboards.warm))
+
+# PROFILER=1 のときだけサンプリングプロファイラを動かし、終了時に結果を書き出す
+@app.on_event("startup")
+def start_profiler():
+    if profiler:
+        profiler.start()
+
+@app.on_event("shutdown")
+def dump_profile():
+    if profiler:
+        profiler.stop()
+        profiler.dump()
+
+# 終了時は積まれている削除ジョブをできるだけ処理してから止める
+@app.on_event("shutdown")
+async def drain_background_jobs():
+    await job_queue.drain()
+
+# 記録中のリプレイ・未保存のチャットを書き出してから止める
+@app.on_event("shutdown")
+async def flush_replays():
+    await multiplayer.recorder.shutdown()
+    await multiplayer.chat_history.flush()
+
+# 観戦者への配信ループを止める
+@app.on_event("shutdown")
+async def stop_spectator_feeds():
+    await multiplayer.spectators.shutdown()
 
 # 404 エラーハンドリング
 from starlette.exceptions import HTTPException as StarletteHTTPException
@@ -150,7 +169,7 @@ from starlette.exceptions import HTTPException as StarletteHTTPException
 async def http_exception_handler(request, exc):
     if exc.status_code == 404:
         # フロントエンドの error.html を返す
-        path = os.path.join(frontend_path, "error.html")
-        if os.path.exists(path):
-            return FileResponse(path, status_code=404)
-    return JSONResponse({"detail": str(exc.detail)}, status_code=exc.status_code)
+        entry = static_index.lookup("error.html")
+        if entry:
+            return Response(entry.bodies[""], media_type=entry.media_type, status_code=404)
+    return JSONResponse({"detail": str(exc.detail)}, status_code=exc.status_code, headers=getattr(exc, "headers", None))
@@ -0,0 +1,2 @@
+# multiplay パッケージ
+# マルチプレイ (routers/multiplayer.py) の WebSocket まわりの補助機能
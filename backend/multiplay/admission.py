@@ -0,0 +1,136 @@
+# multiplay/admission.py
+# ルームの定員 (max_players) とプロセス全体の接続数の上限
+# ・ルームごとに「席」(user_id) をメモリ上で数え、/room/join と WebSocket の受け入れ時に
+#   ロックの中で確認と確保を同時に行う（DB に人数を問い合わせない）
+#   - /room/join で取った席は SEAT_RESERVATION_TTL 秒以内に WebSocket で接続しないと空く
+#   - WebSocket で接続している間は席を持ち続け、最後の接続が切れたら空く
+#   （同じユーザーが複数タブで接続しても席は1つ）
+# ・定員はルーム作成時、または WebSocket 接続時に取得するルーム情報から覚える
+#   （再起動後など定員が分からないルームは制限しない）
+# ・プレイヤーと観戦者の WebSocket の合計が MAX_CONNECTIONS を超えたら、新しい接続は
+#   ADMISSION_RETRY_AFTER 秒後に再試行するよう伝えて断る
+# 1プロセス内での管理なので、複数ワーカーで動かす場合は上限もワーカーごとになる。
+import os
+import threading
+import time
+from typing import Dict
+
+MAX_CONNECTIONS = int(os.getenv("MAX_CONNECTIONS", "1000"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "5"))
+SEAT_RESERVATION_TTL = float(os.getenv("SEAT_RESERVATION_TTL", "120"))
+
+
+class RoomSeats:
+    __slots__ = ("max_players", "seats")
+
+    def __init__(self, max_players: int = None):
+        self.max_players = max_players
+        # user_id -> [接続数, 予約の期限]
+        self.seats: Dict[str, list] = {}
+
+    def _has_room(self, now: float) -> bool:
+        if not self.max_players or len(self.seats) < self.max_players:
+            return True
+        # 満員に見えるときだけ、期限切れの予約を掃除してから数え直す
+        for user_id in [u for u, s in self.seats.items() if s[0] == 0 and s[1] <= now]:
+            del self.seats[user_id]
+        return len(self.seats) < self.max_players
+
+
+class Admission:
+    def __init__(self, max_connections: int = MAX_CONNECTIONS):
+        self.max_connections = max_connections
+        self.connections = 0
+        self.rooms: Dict[str, RoomSeats] = {}
+        # /room/join はスレッドプール、WebSocket はイベントループから呼ばれる
+        self.lock = threading.Lock()
+
+    # --- プロセス全体 ---
+
+    def overloaded(self) -> bool:
+        return self.connections >= self.max_connections
+
+    def open_connection(self) -> bool:
+        with self.lock:
+            if self.connections >= self.max_connections:
+                return False
+            self.connections += 1
+            return True
+
+    def close_connection(self):
+        with self.lock:
+            self.connections = max(0, self.connections - 1)
+
+    # --- ルームの定員 ---
+
+    def knows(self, room_id: str) -> bool:
+        room = self.rooms.get(room_id)
+        return room is not None and room.max_players is not None
+
+    def register(self, room_id: str, max_players):
+        try:
+            max_players = int(max_players) if max_players else None
+        except (TypeError, ValueError):
+            max_players = None
+        with self.lock:
+            room = self.rooms.get(room_id)
+            if room is None:
+                self.rooms[room_id] = RoomSeats(max_players if max_players and max_players > 0 else None)
+            elif max_players and max_players > 0:
+                room.max_players = max_players
+
+    def reserve(self, room_id: str, user_id: str, force: bool = False) -> bool:
+        """/room/join: 席を予約する。満員なら False（既に席を持っていれば期限を延ばすだけ）"""
+        now = time.monotonic()
+        with self.lock:
+            room = self.rooms.setdefault(room_id, RoomSeats())
+            seat = room.seats.get(user_id)
+            if seat is None:
+                if not force and not room._has_room(now):
+                    return False
+                seat = room.seats[user_id] = [0, 0.0]
+            seat[1] = now + SEAT_RESERVATION_TTL
+            return True
+
+    def cancel(self, room_id: str, user_id: str):
+        """予約を取り消す（参加登録に失敗したとき）"""
+        with self.lock:
+            room = self.rooms.get(room_id)
+            seat = room.seats.get(user_id) if room else None
+            if seat and seat[0] == 0:
+                del room.seats[user_id]
+
+    def enter(self, room_id: str, user_id: str) -> bool:
+        """WebSocket の受け入れ時: 席（予約済みならそれ）を使う。満員なら False"""
+        now = time.monotonic()
+        with self.lock:
+            room = self.rooms.setdefault(room_id, RoomSeats())
+            seat = room.seats.get(user_id)
+            if seat is None:
+                if not room._has_room(now):
+                    return False
+                seat = room.seats[user_id] = [0, 0.0]
+            seat[0] += 1
+            return True
+
+    def leave(self, room_id: str, user_id: str):
+        """WebSocket の切断時: 最後の接続なら席を空ける"""
+        with self.lock:
+            room = self.rooms.get(room_id)
+            seat = room.seats.get(user_id) if room else None
+            if seat is None:
+                return
+            seat[0] -= 1
+            if seat[0] <= 0:
+                del room.seats[user_id]
+
+    def occupancy(self, room_id: str) -> int:
+        room = self.rooms.get(room_id)
+        return len(room.seats) if room else 0
+
+    def drop_room(self, room_id: str):
+        with self.lock:
+            self.rooms.pop(room_id, None)
+
+
+admission = Admission()
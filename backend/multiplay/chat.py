@@ -0,0 +1,110 @@
+# multiplay/chat.py
+# ルームごとのチャット履歴
+# ・ルームごとに直近 CHAT_HISTORY_PER_ROOM 件だけを持つリングバッファ (deque)
+# ・全ルーム合計のおおよそのメモリ量が CHAT_HISTORY_MAX_BYTES を超えたら、
+#   しばらく発言の無いルームの古いメッセージから捨てる
+# ・JOIN した人には CHAT_BACKLOG として1フレームでまとめて送る
+# ・CHAT_PERSIST=1 のときは、一定間隔でまとめて DB (chat_messages) に書き出し、
+#   再起動後に最初に JOIN された時点で直近の履歴を読み戻す
+#   （Supabase の場合は chat_messages (room_id, user_id, username, message, timestamp) テーブルが必要）
+import asyncio
+import os
+import sys
+from collections import OrderedDict, deque
+from typing import Deque, List
+
+from starlette.concurrency import run_in_threadpool
+
+from database import repo
+
+CHAT_HISTORY_PER_ROOM = int(os.getenv("CHAT_HISTORY_PER_ROOM", "50"))
+CHAT_HISTORY_MAX_BYTES = int(os.getenv("CHAT_HISTORY_MAX_BYTES", str(8 * 1024 * 1024)))
+CHAT_PERSIST = os.getenv("CHAT_PERSIST", "0") == "1"
+CHAT_FLUSH_INTERVAL = float(os.getenv("CHAT_FLUSH_INTERVAL", "5"))
+
+# dict 1件あたりのおおよそのオーバーヘッド
+_ENTRY_OVERHEAD = 200
+
+
+def _size(message: dict) -> int:
+    return _ENTRY_OVERHEAD + sum(sys.getsizeof(v) for v in message.values())
+
+
+class ChatHistory:
+    def __init__(self):
+        # room_id -> deque (発言があった順に並べ、メモリ超過時は先頭のルームから削る)
+        self.rooms: "OrderedDict[str, Deque[dict]]" = OrderedDict()
+        self.total_bytes = 0
+        self.loaded = set()
+        self._pending: List[dict] = []
+        self._task: asyncio.Task = None
+
+    def add(self, room_id: str, message: dict):
+        """message: {"user_id", "username", "message", "timestamp"}"""
+        history = self.rooms.get(room_id)
+        if history is None:
+            history = self.rooms[room_id] = deque()
+        self.rooms.move_to_end(room_id)
+
+        if len(history) >= CHAT_HISTORY_PER_ROOM:
+            self.total_bytes -= _size(history.popleft())
+        history.append(message)
+        self.total_bytes += _size(message)
+        self._evict()
+
+        if CHAT_PERSIST:
+            self._pending.append({"room_id": room_id, **message})
+            if self._task is None or self._task.done():
+                self._task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    def _evict(self):
+        while self.total_bytes > CHAT_HISTORY_MAX_BYTES and self.rooms:
+            room_id, history = next(iter(self.rooms.items()))
+            if history:
+                self.total_bytes -= _size(history.popleft())
+            if not history:
+                del self.rooms[room_id]
+
+    async def backlog(self, room_id: str) -> List[dict]:
+        if CHAT_PERSIST and room_id not in self.rooms and room_id not in self.loaded:
+            # 再起動後など、メモリに無ければ DB から直近分を読み戻す
+            self.loaded.add(room_id)
+            try:
+                rows = await run_in_threadpool(repo.list_chat_messages, room_id, CHAT_HISTORY_PER_ROOM)
+            except Exception as e:
+                print(f"Chat history load error: {e}")
+                rows = []
+            if rows and room_id not in self.rooms:
+                history = self.rooms[room_id] = deque()
+                for r in rows:
+                    message = {k: r[k] for k in ("user_id", "username", "message", "timestamp")}
+                    history.append(message)
+                    self.total_bytes += _size(message)
+                self.rooms.move_to_end(room_id)
+                self._evict()
+        return list(self.rooms.get(room_id, ()))
+
+    def drop_room(self, room_id: str):
+        """ルーム解散時に履歴を捨てる（まだ書き出していない分も書かない）"""
+        history = self.rooms.pop(room_id, None)
+        if history:
+            self.total_bytes -= sum(_size(m) for m in history)
+        self.loaded.discard(room_id)
+        self._pending = [m for m in self._pending if m["room_id"] != room_id]
+
+    # --- 永続化 ---
+
+    async def flush(self):
+        if not self._pending:
+            return
+        rows, self._pending = self._pending, []
+        try:
+            await run_in_threadpool(repo.insert_chat_messages, rows)
+        except Exception as e:
+            # チャットは失っても致命的ではないので、再試行せずに捨てる
+            print(f"Chat persist error ({len(rows)} messages): {e}")
+
+    async def _flush_loop(self):
+        while self._pending:
+            await asyncio.sleep(CHAT_FLUSH_INTERVAL)
+            await self.flush()
@@ -0,0 +1,135 @@
+# multiplay/heartbeat.py
+# WebSocket の生存確認 (アプリケーションレベルの PING/PONG)
+# ・しばらく何も受信していない接続にだけ {"type": "PING"} を送り、クライアントは PONG を返す
+# ・HEARTBEAT_TIMEOUT 秒なにも届かない接続（相手が落ちたままの half-open）と、
+#   IDLE_TIMEOUT 秒 PONG 以外の操作が無い接続を切断する
+# ・タイマーは接続ごとのタスクではなく、全接続で共有する1つのタイミングホイールで管理する
+#   （受信のたびに時刻を書き換えるだけで、ホイール上の位置は確認時に付け直す）
+# 切断と判断した接続は、すぐに on_dead でルームの送信先から外し、受信待ちのハンドラを止める。
+import asyncio
+import json
+import math
+import os
+import time
+from typing import Callable, Dict, List, Set
+
+from fastapi import WebSocket
+
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", "15"))
+HEARTBEAT_TIMEOUT = float(os.getenv("HEARTBEAT_TIMEOUT", "45"))
+# 0 なら無効
+IDLE_TIMEOUT = float(os.getenv("IDLE_TIMEOUT", "1800"))
+HEARTBEAT_TICK = float(os.getenv("HEARTBEAT_TICK", "1"))
+
+# 切断時の close code
+CLOSE_TIMEOUT = 4408
+CLOSE_IDLE = 4409
+
+
+class Conn:
+    __slots__ = ("websocket", "room_id", "user_id", "task", "last_seen", "last_activity", "last_ping", "expired")
+
+    def __init__(self, websocket: WebSocket, room_id: str, user_id: str, task: asyncio.Task):
+        now = time.monotonic()
+        self.websocket = websocket
+        self.room_id = room_id
+        self.user_id = user_id
+        self.task = task
+        self.last_seen = now
+        self.last_activity = now
+        self.last_ping = 0.0
+        self.expired = None
+
+
+class HeartbeatMonitor:
+    def __init__(self, on_dead: Callable[[str, WebSocket], None]):
+        self.on_dead = on_dead
+        self.conns: Dict[WebSocket, Conn] = {}
+        longest = max(HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT, IDLE_TIMEOUT)
+        self.wheel: List[Set[Conn]] = [set() for _ in range(int(math.ceil(longest / HEARTBEAT_TICK)) + 2)]
+        self.cursor = 0
+        self._task: asyncio.Task = None
+
+    def register(self, websocket: WebSocket, room_id: str, user_id: str) -> Conn:
+        """受信ループを回しているタスクから呼ぶ"""
+        conn = Conn(websocket, room_id, user_id, asyncio.current_task())
+        self.conns[websocket] = conn
+        self._schedule(conn, HEARTBEAT_INTERVAL)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return conn
+
+    def touch(self, websocket: WebSocket, activity: bool = True):
+        """メッセージを受信した（PONG なら activity=False）"""
+        conn = self.conns.get(websocket)
+        if conn:
+            conn.last_seen = time.monotonic()
+            if activity:
+                conn.last_activity = conn.last_seen
+
+    def unregister(self, websocket: WebSocket):
+        # ホイール上に残った分は確認時に捨てる
+        self.conns.pop(websocket, None)
+
+    def expire(self, websocket: WebSocket, reason: str, code: int = CLOSE_TIMEOUT):
+        """接続を死んだものとして扱う: 送信先から外し、ハンドラの受信待ちを止める"""
+        conn = self.conns.pop(websocket, None)
+        if conn is None or conn.expired:
+            return
+        conn.expired = reason
+        print(f"Closing connection of {conn.user_id} in room {conn.room_id}: {reason}")
+        self.on_dead(conn.room_id, websocket)
+        asyncio.get_running_loop().create_task(self._close(websocket, code))
+        if conn.task is not None and conn.task is not asyncio.current_task():
+            conn.task.cancel()
+
+    @staticmethod
+    async def _close(websocket: WebSocket, code: int):
+        try:
+            await asyncio.wait_for(websocket.close(code=code), HEARTBEAT_TICK * 5)
+        except Exception:
+            pass
+
+    @staticmethod
+    async def _ping(websocket: WebSocket):
+        try:
+            await asyncio.wait_for(websocket.send_text(json.dumps({"type": "PING"})), HEARTBEAT_INTERVAL)
+        except Exception:
+            pass  # 届かなければタイムアウトで切断される
+
+    def _schedule(self, conn: Conn, delay: float):
+        ticks = min(len(self.wheel) - 1, max(1, int(math.ceil(delay / HEARTBEAT_TICK))))
+        self.wheel[(self.cursor + ticks) % len(self.wheel)].add(conn)
+
+    def _check(self, conn: Conn, now: float):
+        if self.conns.get(conn.websocket) is not conn:
+            return  # 切断済み
+        silent = now - conn.last_seen
+        if silent >= HEARTBEAT_TIMEOUT:
+            self.expire(conn.websocket, "heartbeat timeout", CLOSE_TIMEOUT)
+            return
+        if IDLE_TIMEOUT and now - conn.last_activity >= IDLE_TIMEOUT:
+            self.expire(conn.websocket, "idle", CLOSE_IDLE)
+            return
+        if silent >= HEARTBEAT_INTERVAL and now - conn.last_ping >= HEARTBEAT_INTERVAL:
+            conn.last_ping = now
+            asyncio.get_running_loop().create_task(self._ping(conn.websocket))
+
+        # 次に確認が必要になる時刻（PING の送信・タイムアウト・アイドルのうち早いもの）
+        deadlines = [conn.last_seen + HEARTBEAT_INTERVAL, conn.last_seen + HEARTBEAT_TIMEOUT]
+        if conn.last_ping > conn.last_seen:
+            deadlines[0] = conn.last_ping + HEARTBEAT_INTERVAL
+        if IDLE_TIMEOUT:
+            deadlines.append(conn.last_activity + IDLE_TIMEOUT)
+        self._schedule(conn, min(deadlines) - now)
+
+    async def _run(self):
+        while self.conns:
+            await asyncio.sleep(HEARTBEAT_TICK)
+            self.cursor = (self.cursor + 1) % len(self.wheel)
+            due, self.wheel[self.cursor] = self.wheel[self.cursor], set()
+            now = time.monotonic()
+            for conn in due:
+                self._check(conn, now)
+        for slot in self.wheel:
+            slot.clear()
@@ -0,0 +1,161 @@
+# multiplay/interest.py
+# 視野 (viewport) に基づく MOVED の送信先の絞り込み
+# ・クライアントは自分の表示範囲 (ワールド座標の矩形) を VIEWPORT メッセージで送る
+# ・サーバーはルームごとに一様グリッドでピースの位置（セル）と、各セルを見ているクライアントを管理し、
+#   ピースの移動元・移動先のセルを見ているクライアントにだけ MOVED を送る
+# ・見ていない間に動いたピースは「見逃し」として覚えておき、視野が変わったときに
+#   新しく見えるようになったものだけ CATCH_UP でまとめて送る
+# 視野を送ってこないクライアント (古いクライアントなど) には従来通り全て送る。
+import math
+import os
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from fastapi import WebSocket
+
+# グリッドの1セルの大きさ（ワールド座標）
+INTEREST_CELL_SIZE = float(os.getenv("INTEREST_CELL_SIZE", "256"))
+# 視野の周囲に足す余白（ピースの大きさやアニメーション分）
+INTEREST_MARGIN = float(os.getenv("INTEREST_MARGIN", "160"))
+# これより多くのセルを覆う視野（大きく縮小している場合）は全体を見ているとみなす
+INTEREST_MAX_CELLS = int(os.getenv("INTEREST_MAX_CELLS", "4096"))
+
+Cell = Tuple[int, int]
+
+
+def _is_point(x, y) -> bool:
+    return all(isinstance(v, (int, float)) and math.isfinite(v) for v in (x, y))
+
+
+class Viewer:
+    def __init__(self, cells: Set[Cell]):
+        self.cells = cells
+        # 見逃したピース -> クライアントが最後に知っている位置のセル
+        self.missed: Dict[int, Cell] = {}
+
+
+class RoomGrid:
+    def __init__(self, cell_size: float):
+        self.cell_size = cell_size
+        # ピース -> 現在のセル
+        self.piece_cells: Dict[int, Cell] = {}
+        # 視野を報告したクライアントだけが入る
+        self.viewers: Dict[WebSocket, Viewer] = {}
+        self.cell_viewers: Dict[Cell, Set[WebSocket]] = {}
+
+    def cell_of(self, x: float, y: float) -> Cell:
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def cells_in(self, x: float, y: float, w: float, h: float) -> Optional[Set[Cell]]:
+        x0, y0 = self.cell_of(x - INTEREST_MARGIN, y - INTEREST_MARGIN)
+        x1, y1 = self.cell_of(x + w + INTEREST_MARGIN, y + h + INTEREST_MARGIN)
+        if x1 < x0 or y1 < y0 or (x1 - x0 + 1) * (y1 - y0 + 1) > INTEREST_MAX_CELLS:
+            return None
+        return {(cx, cy) for cx in range(x0, x1 + 1) for cy in range(y0, y1 + 1)}
+
+    def move_piece(self, index: int, cell: Cell) -> Optional[Cell]:
+        """ピースのセルを更新して、移動前のセルを返す"""
+        old = self.piece_cells.get(index)
+        self.piece_cells[index] = cell
+        return old
+
+    def drop_viewer(self, websocket: WebSocket):
+        viewer = self.viewers.pop(websocket, None)
+        if not viewer:
+            return
+        for cell in viewer.cells:
+            watchers = self.cell_viewers.get(cell)
+            if watchers:
+                watchers.discard(websocket)
+                if not watchers:
+                    del self.cell_viewers[cell]
+
+
+class InterestManager:
+    def __init__(self, cell_size: float = INTEREST_CELL_SIZE):
+        self.cell_size = cell_size
+        self.rooms: Dict[str, RoomGrid] = {}
+
+    def _room(self, room_id: str) -> RoomGrid:
+        grid = self.rooms.get(room_id)
+        if grid is None:
+            grid = self.rooms[room_id] = RoomGrid(self.cell_size)
+        return grid
+
+    def reset_pieces(self, room_id: str, pieces: Iterable[dict]):
+        """ゲーム開始時に全ピースを登録し直す（全員に全体が送られるので見逃しも消す）"""
+        grid = self._room(room_id)
+        grid.piece_cells.clear()
+        for p in pieces:
+            grid.move_piece(p["index"], grid.cell_of(p["x"], p["y"]))
+        for viewer in grid.viewers.values():
+            viewer.missed.clear()
+
+    def set_viewport(self, room_id: str, websocket: WebSocket,
+                     x: float, y: float, w: float, h: float) -> List[int]:
+        """視野を更新し、追いつきのために送るべきピースの index を返す"""
+        grid = self._room(room_id)
+        cells = grid.cells_in(x, y, w, h)
+        previous = grid.viewers.get(websocket)
+        missed = previous.missed if previous else {}
+        grid.drop_viewer(websocket)
+
+        if cells is None:
+            # 全体を見ている -> 見逃し分は全部送って、以降は全て受け取る
+            return list(missed)
+
+        viewer = Viewer(cells)
+        for cell in cells:
+            grid.cell_viewers.setdefault(cell, set()).add(websocket)
+        grid.viewers[websocket] = viewer
+
+        # 今見えている位置にあるもの、またはクライアントが見えている位置にあると思っているもの
+        catch_up = [
+            idx for idx, known_cell in missed.items()
+            if known_cell in cells or grid.piece_cells.get(idx) in cells
+        ]
+        sent = set(catch_up)
+        viewer.missed = {idx: c for idx, c in missed.items() if idx not in sent}
+        return catch_up
+
+    def recipients(self, room_id: str, connections: List[WebSocket], index: int,
+                   x: float, y: float, grouped: bool = False) -> List[WebSocket]:
+        """ピース index が (x, y) に動いたとき MOVED を送る相手を返す"""
+        grid = self.rooms.get(room_id)
+        if grid is None or not _is_point(x, y):
+            return connections
+
+        cell = grid.cell_of(x, y)
+        old = grid.move_piece(index, cell)
+        if not grid.viewers or grouped:
+            # グループのメンバーの位置はサーバーでは追っていないので全員に送る
+            return connections
+
+        watching = grid.cell_viewers.get(cell, set())
+        watching_old = grid.cell_viewers.get(old, set()) if old is not None else set()
+        targets = []
+        for ws in connections:
+            viewer = grid.viewers.get(ws)
+            if viewer is None or ws in watching or ws in watching_old:
+                targets.append(ws)
+                if viewer is not None:
+                    viewer.missed.pop(index, None)
+            elif index not in viewer.missed and old is not None:
+                viewer.missed[index] = old
+        return targets
+
+    def synced(self, room_id: str, index: int, x: float, y: float):
+        """全員に位置が送られた（UNLOCKED など）ピースの見逃しを消す"""
+        grid = self.rooms.get(room_id)
+        if grid is None or not _is_point(x, y):
+            return
+        grid.move_piece(index, grid.cell_of(x, y))
+        for viewer in grid.viewers.values():
+            viewer.missed.pop(index, None)
+
+    def remove(self, room_id: str, websocket: WebSocket):
+        grid = self.rooms.get(room_id)
+        if grid:
+            grid.drop_viewer(websocket)
+
+    def cleanup_room(self, room_id: str):
+        self.rooms.pop(room_id, None)
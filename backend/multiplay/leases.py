@@ -0,0 +1,139 @@
+# multiplay/leases.py
+# ピースのロックの期限 (リース)
+# ・GRAB で取ったロックは LOCK_LEASE_TTL 秒で期限切れになり、本人から何かメッセージが届くたびに延長される
+#   （ピースを持ったまま止まっている間は、クライアントが HOLD を送って延長する）
+# ・(room_id, user_id) ごとに持っているロックを覚えておき、切断時はその分だけ解放する
+#   （ルームの全ピースを走査しない）
+# ・期限は1つのヒープで管理し、1本のタスクが一番近い期限まで眠って、切れたものを on_expire に渡す
+#   延長のたびにヒープへ積み直すことはせず、取り出した時点で実際の期限が延びていれば積み直す
+#   リースごとの世代番号をヒープにも入れ、解放・取り直しで古くなったエントリは取り出した時点で捨てる
+#   （古いエントリが溜まりすぎたらヒープを作り直す）
+import asyncio
+import heapq
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Set, Tuple
+
+LOCK_LEASE_TTL = float(os.getenv("LOCK_LEASE_TTL", "10"))
+# ヒープがリース数のこの倍 (+ 余裕) を超えたら古いエントリを捨てて作り直す
+HEAP_COMPACT_RATIO = 2
+HEAP_COMPACT_SLACK = 64
+
+LeaseKey = Tuple[str, int]  # (room_id, piece index)
+
+
+class LeaseTable:
+    def __init__(self, on_expire: Callable[[str, int, str], Awaitable[None]], ttl: float = LOCK_LEASE_TTL):
+        self.on_expire = on_expire
+        self.ttl = ttl
+        # (room_id, index) -> [deadline, user_id, 世代]
+        self.leases: Dict[LeaseKey, list] = {}
+        # (room_id, user_id) -> 持っている index
+        self.held: Dict[Tuple[str, str], Set[int]] = {}
+        # (deadline, 世代, room_id, index)
+        self.heap: List[Tuple[float, int, str, int]] = []
+        self._generation = 0
+        self._wakeup: asyncio.Event = None
+        self._task: asyncio.Task = None
+
+    def _ensure_started(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def grant(self, room_id: str, index: int, user_id: str):
+        self._ensure_started()
+        deadline = time.monotonic() + self.ttl
+        key = (room_id, index)
+        self.held.setdefault((room_id, user_id), set()).add(index)
+        old = self.leases.get(key)
+        if old:
+            # 取り直し: ヒープのエントリはそのまま使い、取り出した時点で新しい期限で積み直す
+            if old[1] != user_id:
+                self._forget_held(room_id, old[1], index)
+            old[0] = deadline
+            old[1] = user_id
+            return
+        self._generation += 1
+        self.leases[key] = [deadline, user_id, self._generation]
+        was_empty = not self.heap
+        heapq.heappush(self.heap, (deadline, self._generation, room_id, index))
+        self._maybe_compact()
+        if was_empty:
+            self._wakeup.set()
+
+    def renew(self, room_id: str, user_id: str):
+        """本人からメッセージを受けたら、そのユーザーがルームで持っているロックを全て延長する"""
+        indices = self.held.get((room_id, user_id))
+        if not indices:
+            return
+        deadline = time.monotonic() + self.ttl
+        for index in indices:
+            lease = self.leases.get((room_id, index))
+            if lease:
+                lease[0] = deadline
+
+    def release(self, room_id: str, index: int, user_id: str):
+        lease = self.leases.get((room_id, index))
+        if lease and lease[1] == user_id:
+            del self.leases[(room_id, index)]
+            self._forget_held(room_id, user_id, index)
+            self._maybe_compact()
+
+    def release_user(self, room_id: str, user_id: str) -> List[int]:
+        """ユーザーの持っているロックを全て外し、その index を返す（切断時）"""
+        indices = self.held.pop((room_id, user_id), set())
+        for index in indices:
+            self.leases.pop((room_id, index), None)
+        self._maybe_compact()
+        return list(indices)
+
+    def drop_room(self, room_id: str):
+        for key in [k for k in self.held if k[0] == room_id]:
+            for index in self.held.pop(key):
+                self.leases.pop((room_id, index), None)
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        """解放済みのエントリが溜まったら、今のリースだけでヒープを作り直す"""
+        if len(self.heap) <= HEAP_COMPACT_RATIO * len(self.leases) + HEAP_COMPACT_SLACK:
+            return
+        self.heap = [(lease[0], lease[2], room_id, index) for (room_id, index), lease in self.leases.items()]
+        heapq.heapify(self.heap)
+
+    def _forget_held(self, room_id: str, user_id: str, index: int):
+        indices = self.held.get((room_id, user_id))
+        if indices is not None:
+            indices.discard(index)
+            if not indices:
+                del self.held[(room_id, user_id)]
+
+    async def _run(self):
+        while True:
+            if not self.heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            delay = self.heap[0][0] - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            _, generation, room_id, index = heapq.heappop(self.heap)
+            lease = self.leases.get((room_id, index))
+            if lease is None or lease[2] != generation:
+                continue  # 既に解放済み（取り直されたリースは別のエントリが持つ）
+            now = time.monotonic()
+            if lease[0] > now:
+                # 延長されていた -> 実際の期限で積み直す
+                heapq.heappush(self.heap, (lease[0], generation, room_id, index))
+                continue
+
+            user_id = lease[1]
+            del self.leases[(room_id, index)]
+            self._forget_held(room_id, user_id, index)
+            try:
+                await self.on_expire(room_id, index, user_id)
+            except Exception as e:
+                print(f"Lease expire error: {e}")
@@ -0,0 +1,130 @@
+# multiplay/presence.py
+# 他のプレイヤーのカーソル表示 (プレゼンス)
+# ・CURSOR メッセージはルームごとのスロット表 (user_id -> 最新の位置) を上書きするだけで、その場では送らない
+# ・ルームごとに一定間隔 (PRESENCE_INTERVAL 秒) で、変化があれば全員分を1つの CURSORS フレームにまとめ、
+#   1回だけ JSON 化してプレイヤー全員に送る（人数 × 頻度で帯域が決まり、MOVE の量には依存しない）
+# ・送るものが無い間はタスクは Event を待って眠り、PRESENCE_IDLE_TIMEOUT 秒変化が無ければ終了する
+#   （次の CURSOR / JOIN / 退出で作り直す）
+# ・ピースのイベント (MOVED など) とは別に送り、前の CURSORS がまだ送れていない接続には
+#   そのフレームを送らない（詰まったときに最初に捨てられるのはカーソル）
+#
+# 送信するフレーム:
+#   {"type": "CURSORS", "cursors": [[user_id, username, x, y], ...]}
+#   （自分のカーソルも含まれるので、クライアント側で除外する）
+import asyncio
+import json
+import os
+from typing import Dict, Set
+
+from fastapi import WebSocket
+
+PRESENCE_INTERVAL = float(os.getenv("PRESENCE_INTERVAL", "0.1"))
+PRESENCE_SEND_TIMEOUT = float(os.getenv("PRESENCE_SEND_TIMEOUT", "1.0"))
+PRESENCE_IDLE_TIMEOUT = float(os.getenv("PRESENCE_IDLE_TIMEOUT", "5.0"))
+
+
+class RoomPresence:
+    def __init__(self):
+        # user_id -> [user_id, username, x, y]
+        self.slots: Dict[str, list] = {}
+        self.names: Dict[str, str] = {}
+        self.dirty = False
+        # 前の CURSORS を送信中の接続と、詰まっていて最新のフレームを送れなかった接続
+        self.sending: Set[WebSocket] = set()
+        self.skipped: Set[WebSocket] = set()
+        self.frame: str = None
+        self.task: asyncio.Task = None
+        # dirty / skipped が立ったときに送信タスクを起こす
+        self.wakeup = asyncio.Event()
+
+
+class PresenceHub:
+    def __init__(self, connections, interval: float = PRESENCE_INTERVAL):
+        self.connections = connections
+        self.interval = interval
+        self.rooms: Dict[str, RoomPresence] = {}
+
+    def join(self, room_id: str, user_id: str, username: str):
+        room = self.rooms.setdefault(room_id, RoomPresence())
+        room.names[user_id] = username
+        slot = room.slots.get(user_id)
+        if slot:
+            slot[1] = username
+        if room.slots:
+            # 途中参加者にも今のカーソルが見えるよう、次の tick で全員分を送り直す
+            room.dirty = True
+            self._wake(room_id, room)
+
+    def update(self, room_id: str, user_id: str, x: int, y: int):
+        """最新の位置で上書きする（送信は次の tick でまとめて行う）"""
+        room = self.rooms.setdefault(room_id, RoomPresence())
+        slot = room.slots.get(user_id)
+        if slot is None:
+            room.slots[user_id] = [user_id, room.names.get(user_id) or f"Guest_{user_id[:4]}", x, y]
+        elif slot[2] == x and slot[3] == y:
+            return
+        else:
+            slot[2] = x
+            slot[3] = y
+        room.dirty = True
+        self._wake(room_id, room)
+
+    def leave(self, room_id: str, user_id: str):
+        room = self.rooms.get(room_id)
+        if not room:
+            return
+        room.names.pop(user_id, None)
+        if room.slots.pop(user_id, None) is not None:
+            room.dirty = True  # 消えたことを次の tick で伝える
+            self._wake(room_id, room)
+
+    def drop_room(self, room_id: str):
+        room = self.rooms.pop(room_id, None)
+        if room and room.task:
+            room.task.cancel()
+
+    def _wake(self, room_id: str, room: RoomPresence):
+        room.wakeup.set()
+        if room.task is None or room.task.done():
+            room.task = asyncio.get_running_loop().create_task(self._run(room_id, room))
+
+    async def _send(self, room_id: str, room: RoomPresence, websocket: WebSocket, frame: str):
+        try:
+            await asyncio.wait_for(websocket.send_text(frame), PRESENCE_SEND_TIMEOUT)
+        except Exception:
+            pass  # 届かない接続の後始末は受信ループ側（生存確認）に任せる
+        finally:
+            room.sending.discard(websocket)
+            if websocket in room.skipped and self.rooms.get(room_id) is room:
+                # 詰まっている間に飛ばしたフレームがある -> 最新を送ってもらう
+                self._wake(room_id, room)
+
+    async def _run(self, room_id: str, room: RoomPresence):
+        while True:
+            if not room.dirty and room.skipped <= room.sending:
+                # 送るものが無い（飛ばした接続もまだ送信中）間は変化を待つ
+                # （しばらく何も無ければタスクを終える）
+                room.wakeup.clear()
+                try:
+                    await asyncio.wait_for(room.wakeup.wait(), PRESENCE_IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    return
+                continue
+            connections = self.connections.active_connections.get(room_id, [])
+            if room.dirty:
+                room.dirty = False
+                room.frame = json.dumps({"type": "CURSORS", "cursors": list(room.slots.values())}, separators=(",", ":"))
+                targets = list(connections)
+            else:
+                # 変化は無いが、前回飛ばした接続には最新のフレームを送る
+                targets = [ws for ws in connections if ws in room.skipped]
+            room.skipped.clear()
+            for websocket in targets:
+                if websocket in room.sending:
+                    # 前のフレームが詰まっている -> 今回は捨てる（空いたら最新を送る）
+                    room.skipped.add(websocket)
+                    continue
+                room.sending.add(websocket)
+                asyncio.get_running_loop().create_task(self._send(room_id, room, websocket, room.frame))
+            # 次のフレームまでは PRESENCE_INTERVAL 空ける（その間の CURSOR は上書きでまとまる）
+            await asyncio.sleep(self.interval)
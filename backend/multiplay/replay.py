@@ -0,0 +1,386 @@
+# multiplay/replay.py
+# マルチプレイの対戦記録 (リプレイ)
+# ・受理したイベントを小さなバイナリレコードにしてルームごとのリングバッファに積む
+#   （MOVE の処理中に行うのは struct.pack とメモリコピーだけ）
+# ・REPLAY_FLUSH_INTERVAL ごとにバッファをまとめてファイルへ追記する（スレッドプールで実行）
+# ・REPLAY_KEYFRAME_INTERVAL ごとに全ピースの状態 (KEYFRAME) を書き、
+#   別ファイルの索引 (.idx) から任意の時刻に近い位置へシークできるようにする
+#
+# ファイル形式 ({REPLAY_DIR}/{room_id}.jlog, リトルエンディアン):
+#   ヘッダ  : b"JGRP" + version(u8) + 記録開始時刻 unix ms (u64)
+#   レコード: 経過ms (u32) + 種類 (u8) + 本体
+#     START   (1): 長さ(u32) + JSON {"pieces": [...], "start_time": int}
+#     IMAGE   (2): 長さ(u16) + URL (utf-8)
+#     USER    (3): スロット(u8) + 長さ(u16) + user_id (utf-8)   以降 LOCK はスロット番号で参照
+#     LOCK    (4): index(u16) + スロット(u8)
+#     MOVE    (5): index(u16) + x(f32) + y(f32) + rotation(i16)
+#     UNLOCK  (6): index(u16) + x(f32) + y(f32) + rotation(i16)
+#     MERGE   (7): index1(u16) + index2(u16)
+#     KEYFRAME(8): ゲーム開始時刻 unix 秒(u32) + 個数(u16)
+#                  + 個数 x [index(u16) + x(f32) + y(f32) + rotation(i16) + group(u16)]
+#                  group はグループ内の最小の index。KEYFRAME の直前には IMAGE と全 USER を書き直すので、
+#                  索引から途中再生しても必要な情報は揃う
+#     END     (9): 本体なし（ルーム解散）
+# 索引 ({room_id}.idx): [経過ms(u32) + KEYFRAME (の前置き) のファイル内オフセット(u32)] の並び
+# 全員が抜けたルームの記録は END を書かずに閉じ、同じルームに再び接続があれば既存のファイルへ追記する
+# （経過ms はヘッダの記録開始時刻からの値を続ける）
+import asyncio
+import json
+import os
+import re
+import struct
+import time
+from typing import Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+REPLAY_DIR = os.getenv("REPLAY_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "replays"))
+REPLAY_BUFFER_BYTES = int(os.getenv("REPLAY_BUFFER_BYTES", str(256 * 1024)))
+REPLAY_FLUSH_INTERVAL = float(os.getenv("REPLAY_FLUSH_INTERVAL", "1.0"))
+REPLAY_KEYFRAME_INTERVAL = float(os.getenv("REPLAY_KEYFRAME_INTERVAL", "10"))
+# 書き込みに失敗したデータを次回に持ち越す上限。超えたらそのルームの記録をやめる
+REPLAY_RETRY_LIMIT = int(os.getenv("REPLAY_RETRY_LIMIT", str(4 * REPLAY_BUFFER_BYTES)))
+
+MAGIC = b"JGRP"
+VERSION = 1
+FILE_HEADER = struct.Struct("<4sBQ")
+RECORD_HEADER = struct.Struct("<IB")
+INDEX_ENTRY = struct.Struct("<II")
+
+START, IMAGE, USER, LOCK, MOVE, UNLOCK, MERGE, KEYFRAME, END = range(1, 10)
+
+_MOVE = struct.Struct("<IBHffh")  # ヘッダ込み (MOVE / UNLOCK)
+_LOCK = struct.Struct("<IBHB")
+_MERGE = struct.Struct("<IBHH")
+_KEY_PIECE = struct.Struct("<HffhH")
+
+ROOM_ID = re.compile(r"^[0-9a-fA-F-]{1,64}$")
+
+
+class RingBuffer:
+    """固定容量のバイトリングバッファ。満杯のときは書き込みを捨てて False を返す"""
+
+    def __init__(self, capacity: int):
+        self.buf = bytearray(capacity)
+        self.capacity = capacity
+        self.head = 0  # 次に読む位置
+        self.size = 0
+
+    def write(self, data: bytes) -> bool:
+        n = len(data)
+        if n > self.capacity - self.size:
+            return False
+        tail = (self.head + self.size) % self.capacity
+        first = self.capacity - tail
+        if n <= first:
+            self.buf[tail:tail + n] = data
+        else:
+            self.buf[tail:] = data[:first]
+            self.buf[:n - first] = data[first:]
+        self.size += n
+        return True
+
+    def drain(self) -> bytes:
+        end = self.head + self.size
+        if end <= self.capacity:
+            data = bytes(self.buf[self.head:end])
+        else:
+            data = bytes(self.buf[self.head:]) + bytes(self.buf[:end - self.capacity])
+        self.head = end % self.capacity
+        self.size = 0
+        return data
+
+
+class RoomRecording:
+    def __init__(self, room_id: str, resume: Optional[tuple] = None):
+        self.room_id = room_id
+        # バッファは最初のレコードを積むときに確保する（何も起きないルームではメモリを使わない）
+        self.ring: Optional[RingBuffer] = None
+        self.pending_index = []
+        # 書き込みに失敗して次回に書き直すデータと索引（offset・索引はこれが書けた前提で進んでいる）
+        self.unwritten = b""
+        self.unwritten_index = b""
+        if resume:
+            # 既存の記録へ追記: (記録開始時刻 unix ms, ファイルサイズ)
+            started_ms, size = resume
+            self.t0 = time.monotonic() - max(0.0, time.time() - started_ms / 1000)
+            self.offset = size
+            self.header = None
+            self.header_written = True
+        else:
+            self.t0 = time.monotonic()
+            # ファイル先頭からの論理オフセット（ヘッダ分から始まる）
+            self.offset = FILE_HEADER.size
+            self.header = FILE_HEADER.pack(MAGIC, VERSION, int(time.time() * 1000))
+            self.header_written = False
+        self.users: Dict[str, int] = {}
+        self.dirty = False
+        self.started = False
+        self.need_keyframe = False
+        self.last_keyframe = 0.0
+        self.closed = False
+        self.dropped = 0
+
+    def now_ms(self) -> int:
+        return int((time.monotonic() - self.t0) * 1000)
+
+    def append(self, data: bytes):
+        if self.ring is None:
+            self.ring = RingBuffer(REPLAY_BUFFER_BYTES)
+        if self.ring.write(data):
+            self.offset += len(data)
+            self.dirty = True
+        else:
+            # バッファが溢れた（書き込みが追いついていない）: 次の KEYFRAME で状態を取り戻す
+            self.dropped += 1
+            self.need_keyframe = True
+
+
+class ReplayRecorder:
+    def __init__(self, game_state):
+        self.game_state = game_state
+        self.rooms: Dict[str, RoomRecording] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    # --- 記録 (イベントループ上から呼ぶ) ---
+
+    async def open(self, room_id: str):
+        rec = self.rooms.get(room_id)
+        if rec:
+            # 閉じてまだ書き出していない記録はそのまま使い続ける
+            rec.closed = False
+            return
+        if not ROOM_ID.match(room_id):
+            return
+        resume = await run_in_threadpool(self._existing, room_id)
+        if room_id in self.rooms:
+            return
+        self.rooms[room_id] = RoomRecording(room_id, resume)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    def _blob(self, room_id: str, kind: int, length_fmt: str, data: bytes):
+        rec = self.rooms.get(room_id)
+        if rec:
+            rec.append(RECORD_HEADER.pack(rec.now_ms(), kind) + struct.pack(length_fmt, len(data)) + data)
+
+    def start(self, room_id: str, pieces, start_time: int):
+        rec = self.rooms.get(room_id)
+        if not rec:
+            return
+        data = json.dumps({"pieces": pieces, "start_time": start_time}, separators=(",", ":")).encode("utf-8")
+        self._blob(room_id, START, "<I", data)
+        rec.started = True
+        rec.need_keyframe = True
+
+    def image(self, room_id: str, url: str):
+        if url:
+            self._blob(room_id, IMAGE, "<H", str(url).encode("utf-8")[:65535])
+
+    def _slot(self, rec: RoomRecording, user_id: str) -> int:
+        slot = rec.users.get(user_id)
+        if slot is None:
+            slot = min(len(rec.users), 255)
+            rec.users[user_id] = slot
+            data = user_id.encode("utf-8")[:255]
+            rec.append(RECORD_HEADER.pack(rec.now_ms(), USER) + struct.pack("<BH", slot, len(data)) + data)
+        return slot
+
+    def lock(self, room_id: str, index: int, user_id: str):
+        rec = self.rooms.get(room_id)
+        if rec:
+            try:
+                rec.append(_LOCK.pack(rec.now_ms(), LOCK, index, self._slot(rec, user_id)))
+            except struct.error:
+                pass
+
+    def move(self, room_id: str, index: int, x: float, y: float, rotation: int, kind: int = MOVE):
+        rec = self.rooms.get(room_id)
+        if rec:
+            try:
+                rec.append(_MOVE.pack(rec.now_ms(), kind, index, x, y, rotation))
+            except struct.error:
+                # 不正な値（範囲外・数値以外）は記録しない
+                pass
+
+    def unlock(self, room_id: str, index: int, x: float, y: float, rotation: int):
+        self.move(room_id, index, x, y, rotation, kind=UNLOCK)
+
+    def merge(self, room_id: str, index1: int, index2: int):
+        rec = self.rooms.get(room_id)
+        if rec:
+            try:
+                rec.append(_MERGE.pack(rec.now_ms(), MERGE, index1, index2))
+            except struct.error:
+                pass
+
+    def close(self, room_id: str, end: bool = True):
+        """最後の状態を書いて、次の書き出しで閉じる。ルーム解散なら END も書く"""
+        rec = self.rooms.get(room_id)
+        if not rec or rec.closed:
+            return
+        if rec.ring is None and not rec.header_written:
+            # 何も記録していない -> ファイルを作らずに捨てる
+            self.rooms.pop(room_id, None)
+            return
+        if rec.started:
+            self._keyframe(rec)
+        if end:
+            rec.append(RECORD_HEADER.pack(rec.now_ms(), END))
+        rec.closed = True
+
+    # --- KEYFRAME ---
+
+    def _keyframe(self, rec: RoomRecording):
+        t = rec.now_ms()
+        # 途中から再生するときのための前置き (IMAGE, USER)
+        prelude = bytearray()
+        image = self.game_state.get_image(rec.room_id)
+        if image:
+            data = str(image).encode("utf-8")[:65535]
+            prelude += RECORD_HEADER.pack(t, IMAGE) + struct.pack("<H", len(data)) + data
+        for user_id, slot in rec.users.items():
+            data = user_id.encode("utf-8")[:255]
+            prelude += RECORD_HEADER.pack(t, USER) + struct.pack("<BH", slot, len(data)) + data
+
+        state = self.game_state.game_states.get(rec.room_id, {})
+        start_time = self.game_state.get_start_time(rec.room_id) or 0
+        body = bytearray(struct.pack("<IH", start_time, len(state)))
+        for idx, p in state.items():
+            try:
+                body += _KEY_PIECE.pack(idx, p["x"], p["y"], p["rotation"], min(p["group"]))
+            except (struct.error, TypeError, ValueError):
+                body += _KEY_PIECE.pack(idx, 0, 0, 0, idx)
+
+        offset = rec.offset
+        before = rec.dropped
+        rec.append(bytes(prelude) + RECORD_HEADER.pack(t, KEYFRAME) + bytes(body))
+        if rec.dropped == before:
+            rec.pending_index.append(INDEX_ENTRY.pack(t, offset))
+            rec.need_keyframe = False
+        rec.last_keyframe = time.monotonic()
+
+    # --- 書き出し ---
+
+    @staticmethod
+    def path(room_id: str, ext: str = "jlog") -> str:
+        return os.path.join(REPLAY_DIR, f"{room_id}.{ext}")
+
+    def _existing(self, room_id: str) -> Optional[tuple]:
+        """追記できる既存の記録があれば (記録開始時刻 unix ms, ファイルサイズ)"""
+        try:
+            with open(self.path(room_id), "rb") as f:
+                head = f.read(FILE_HEADER.size)
+                size = os.fstat(f.fileno()).st_size
+        except FileNotFoundError:
+            return None
+        if len(head) < FILE_HEADER.size:
+            return None
+        magic, version, started_ms = FILE_HEADER.unpack(head)
+        if magic != MAGIC or version != VERSION:
+            return None
+        return started_ms, size
+
+    def _write(self, room_id: str, header: Optional[bytes], data: bytes, index: bytes):
+        os.makedirs(REPLAY_DIR, exist_ok=True)
+        # ヘッダを書くのは新しい記録の最初だけ（読めない古いファイルがあれば作り直す）
+        mode = "wb" if header else "ab"
+        # 失敗したら書きかけの分を切り詰めて、ファイルを書き込み前の長さに戻す
+        # （呼び出し側が同じデータを次回書き直すので、offset・索引とずれない）
+        with open(self.path(room_id), mode) as f:
+            log_start = f.tell()
+            try:
+                if header:
+                    f.write(header)
+                f.write(data)
+                f.flush()
+            except OSError:
+                f.truncate(log_start)
+                raise
+        # 索引はログ本体を書いた後に追記する（索引が指す位置は必ずファイル内にある）
+        if index or header:
+            try:
+                with open(self.path(room_id, "idx"), mode) as f:
+                    idx_start = f.tell()
+                    try:
+                        f.write(index)
+                        f.flush()
+                    except OSError:
+                        f.truncate(idx_start)
+                        raise
+            except OSError:
+                with open(self.path(room_id), "r+b") as f:
+                    f.truncate(log_start)
+                raise
+
+    async def flush(self):
+        now = time.monotonic()
+        for room_id, rec in list(self.rooms.items()):
+            if rec.started and not rec.closed and (
+                    rec.need_keyframe or (rec.dirty and now - rec.last_keyframe >= REPLAY_KEYFRAME_INTERVAL)):
+                self._keyframe(rec)
+            if not rec.dirty and not rec.pending_index and not rec.unwritten and not rec.unwritten_index:
+                continue
+            header = None if rec.header_written else rec.header
+            data = rec.unwritten + (rec.ring.drain() if rec.ring else b"")
+            index = rec.unwritten_index + b"".join(rec.pending_index)
+            rec.pending_index.clear()
+            rec.dirty = False
+            try:
+                await run_in_threadpool(self._write, room_id, header, data, index)
+            except OSError as e:
+                print(f"Replay write error ({room_id}): {e}")
+                if len(data) > REPLAY_RETRY_LIMIT:
+                    # 書けない状態が続いている -> これ以上メモリに溜めず、このルームの記録をやめる
+                    print(f"Replay recording for {room_id} abandoned ({len(data)} bytes unwritten)")
+                    self.rooms.pop(room_id, None)
+                else:
+                    rec.unwritten = data
+                    rec.unwritten_index = index
+                continue
+            rec.unwritten = b""
+            rec.unwritten_index = b""
+            rec.header_written = True
+            if rec.closed:
+                self.rooms.pop(room_id, None)
+
+    async def _flush_loop(self):
+        while self.rooms:
+            await asyncio.sleep(REPLAY_FLUSH_INTERVAL)
+            await self.flush()
+
+    async def shutdown(self):
+        for room_id in list(self.rooms):
+            self.close(room_id)
+        await self.flush()
+
+
+# --- 再生 ---
+
+def read_index(room_id: str):
+    """[(経過ms, オフセット), ...] を返す"""
+    try:
+        with open(ReplayRecorder.path(room_id, "idx"), "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+    usable = len(data) - len(data) % INDEX_ENTRY.size
+    return [INDEX_ENTRY.unpack_from(data, i) for i in range(0, usable, INDEX_ENTRY.size)]
+
+
+def stream_replay(room_id: str, from_ms: int = 0, chunk_size: int = 64 * 1024):
+    """ヘッダ + (from_ms 以前で最も近い KEYFRAME から) のレコードを順に返すジェネレータ"""
+    offset = FILE_HEADER.size
+    if from_ms > 0:
+        for t, key_offset in read_index(room_id):
+            if t > from_ms:
+                break
+            offset = key_offset
+    with open(ReplayRecorder.path(room_id), "rb") as f:
+        yield f.read(FILE_HEADER.size)
+        f.seek(offset)
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
@@ -0,0 +1,209 @@
+# multiplay/spectators.py
+# 観戦者 (spectator) 向けの配信
+# ・観戦者はプレイヤーの接続リスト (ConnectionManager) には入らず、max_players やロックの対象外
+# ・MOVED などのイベントは転送せず、ルームごとに一定間隔 (SPECTATOR_INTERVAL 秒) で
+#   変化したピースだけをまとめた DELTA フレームを1回だけ JSON 化して全観戦者に送る
+# ・送信が詰まっている観戦者はそのフレームを飛ばし、次回は SNAPSHOT (全体) を送って追いつかせる
+#   SPECTATOR_SEND_TIMEOUT 秒以内に送れなかった（または送信に失敗した）観戦者は 1013 で切断し、
+#   再接続 (SNAPSHOT から) で追いつかせる
+#
+# 送信するフレーム:
+#   {"type": "SNAPSHOT", "started", "start_time", "image_url", "difficulty", "players",
+#    "pieces": [[index, x, y, rotation], ...], "groups": [[index, ...], ...]}
+#   {"type": "DELTA", "pieces": [...変化したピース...], "groups"?: [...], "players"?: n, ...}
+#   {"type": "ROOM_CLOSED", "message": str}
+# 観戦できるのはこのプロセスで進行中のルームだけ（無ければ 4404、満員なら 1013 で閉じる）
+import asyncio
+import json
+import os
+from typing import Dict, Set
+
+from fastapi import WebSocket
+
+SPECTATOR_INTERVAL = float(os.getenv("SPECTATOR_INTERVAL", "1.0"))
+SPECTATOR_SEND_TIMEOUT = float(os.getenv("SPECTATOR_SEND_TIMEOUT", "2.0"))
+MAX_SPECTATORS_PER_ROOM = int(os.getenv("MAX_SPECTATORS_PER_ROOM", "500"))
+
+
+class Spectator:
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.needs_snapshot = True
+        self.sending = False
+        self.task: asyncio.Task = None
+
+
+class RoomFeed:
+    def __init__(self):
+        self.spectators: Dict[WebSocket, Spectator] = {}
+        # 前回送った状態 (DELTA の計算用)
+        self.last_pieces: Dict[int, list] = {}
+        self.last_groups = None
+        self.last_meta = None
+        self.task: asyncio.Task = None
+        # 送信中のタスク（参照を持っておかないと送信の途中で GC されうる）
+        self.sends: Set[asyncio.Task] = set()
+
+
+class SpectatorHub:
+    def __init__(self, game_state, connections, interval: float = SPECTATOR_INTERVAL):
+        self.game_state = game_state
+        self.connections = connections
+        self.interval = interval
+        self.feeds: Dict[str, RoomFeed] = {}
+
+    # --- 接続管理 ---
+
+    async def join(self, room_id: str, websocket: WebSocket) -> bool:
+        # 閉じるコードをブラウザに届けるため、断る場合も先に受け入れる
+        await websocket.accept()
+        if room_id not in self.game_state.room_status:
+            await websocket.close(code=4404)  # 進行中のルームが無い
+            return False
+        feed = self.feeds.setdefault(room_id, RoomFeed())
+        if len(feed.spectators) >= MAX_SPECTATORS_PER_ROOM:
+            await websocket.close(code=1013)  # Try Again Later
+            return False
+        feed.spectators[websocket] = Spectator(websocket)
+        if feed.task is None or feed.task.done():
+            feed.task = asyncio.get_running_loop().create_task(self._run(room_id, feed))
+            feed.task.add_done_callback(lambda t: self._task_done(room_id, t))
+        return True
+
+    def leave(self, room_id: str, websocket: WebSocket):
+        feed = self.feeds.get(room_id)
+        if not feed:
+            return
+        spectator = feed.spectators.pop(websocket, None)
+        if spectator and spectator.task and spectator.task is not asyncio.current_task():
+            spectator.task.cancel()
+        if not feed.spectators:
+            # 最後の観戦者が抜けたら配信ループも止める（次の観戦者が来たら作り直す）
+            if feed.task:
+                feed.task.cancel()
+                feed.task = None
+            self.feeds.pop(room_id, None)
+
+    def get_count(self, room_id: str) -> int:
+        feed = self.feeds.get(room_id)
+        return len(feed.spectators) if feed else 0
+
+    async def close_room(self, room_id: str, message: str):
+        """ルーム解散時に観戦者へ通知して切断する"""
+        feed = self.feeds.pop(room_id, None)
+        if not feed:
+            return
+        if feed.task:
+            feed.task.cancel()
+        for task in list(feed.sends):
+            task.cancel()
+        frame = json.dumps({"type": "ROOM_CLOSED", "message": message})
+        for spectator in list(feed.spectators.values()):
+            try:
+                await asyncio.wait_for(spectator.websocket.send_text(frame), SPECTATOR_SEND_TIMEOUT)
+                await spectator.websocket.close()
+            except Exception:
+                pass
+
+    async def shutdown(self):
+        """サーバー停止時に配信ループを止める"""
+        tasks = [feed.task for feed in self.feeds.values() if feed.task]
+        tasks += [task for feed in self.feeds.values() for task in feed.sends]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    @staticmethod
+    def _task_done(room_id: str, task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            print(f"Spectator feed for room {room_id} failed: {task.exception()!r}")
+
+    # --- 状態のエンコード ---
+
+    def _pieces(self, room_id: str) -> Dict[int, list]:
+        state = self.game_state.game_states.get(room_id, {})
+        return {
+            idx: [idx, round(p["x"], 1), round(p["y"], 1), p["rotation"]]
+            for idx, p in state.items()
+        }
+
+    def _groups(self, room_id: str):
+        state = self.game_state.game_states.get(room_id, {})
+        seen = {}
+        for p in state.values():
+            group = p["group"]
+            if len(group) > 1:
+                seen[id(group)] = group
+        return sorted(sorted(g) for g in seen.values())
+
+    def _meta(self, room_id: str) -> dict:
+        gs = self.game_state
+        return {
+            "started": bool(gs.room_status.get(room_id)),
+            "start_time": gs.get_start_time(room_id),
+            "image_url": gs.get_image(room_id),
+            "difficulty": gs.get_difficulty(room_id),
+            "players": self.connections.get_member_count(room_id),
+        }
+
+    def _build_frames(self, room_id: str, feed: RoomFeed):
+        """(snapshot, delta) の JSON 文字列を作る。delta は変化が無ければ None"""
+        pieces = self._pieces(room_id)
+        groups = self._groups(room_id)
+        meta = self._meta(room_id)
+
+        snapshot = json.dumps({
+            "type": "SNAPSHOT",
+            **meta,
+            "pieces": list(pieces.values()),
+            "groups": groups,
+        }, separators=(",", ":"))
+
+        delta = {"type": "DELTA"}
+        changed = [p for idx, p in pieces.items() if feed.last_pieces.get(idx) != p]
+        if changed:
+            delta["pieces"] = changed
+        if groups != feed.last_groups:
+            delta["groups"] = groups
+        if meta != feed.last_meta:
+            delta.update({k: v for k, v in meta.items() if not feed.last_meta or feed.last_meta.get(k) != v})
+
+        feed.last_pieces = pieces
+        feed.last_groups = groups
+        feed.last_meta = meta
+        delta_frame = json.dumps(delta, separators=(",", ":")) if len(delta) > 1 else None
+        return snapshot, delta_frame
+
+    # --- 配信ループ ---
+
+    async def _send(self, room_id: str, spectator: Spectator, frame: str):
+        spectator.sending = True
+        try:
+            await asyncio.wait_for(spectator.websocket.send_text(frame), SPECTATOR_SEND_TIMEOUT)
+            spectator.needs_snapshot = False
+        except Exception:
+            # 送れない観戦者は切断して外す（クライアントは再接続して SNAPSHOT から追いつく）
+            try:
+                await asyncio.wait_for(spectator.websocket.close(code=1013, reason="resync"), SPECTATOR_SEND_TIMEOUT)
+            except Exception:
+                pass
+            self.leave(room_id, spectator.websocket)
+        finally:
+            spectator.sending = False
+
+    async def _run(self, room_id: str, feed: RoomFeed):
+        while feed.spectators:
+            snapshot, delta = self._build_frames(room_id, feed)
+            for spectator in list(feed.spectators.values()):
+                if spectator.sending:
+                    # 前のフレームがまだ送れていない -> 今回は飛ばし、次回は全体を送る
+                    spectator.needs_snapshot = True
+                    continue
+                frame = snapshot if spectator.needs_snapshot else delta
+                if frame is not None:
+                    # プレイヤー側の処理を待たせないよう、送信は個別のタスクで行う
+                    task = asyncio.get_running_loop().create_task(self._send(room_id, spectator, frame))
+                    spectator.task = task
+                    feed.sends.add(task)
+                    task.add_done_callback(feed.sends.discard)
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,97 @@
+# passwords.py
+# bcrypt によるパスワードのハッシュ化・検証
+# bcrypt は1回あたり数百ms CPU を使うため、イベントループ上で実行すると
+# その間すべての WebSocket ルームが止まる。専用のスレッドプールで実行し、
+# 同時実行数と待ち時間に上限を設けて、ログインが殺到しても他の処理を守る。
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+from fastapi import HTTPException
+
+# bcrypt の work factor (コスト)。既存ハッシュはハッシュ内のコストで検証されるので変更しても互換性あり
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# 同時にハッシュ計算する数（bcrypt は GIL を解放するのでコア数程度まで並列に動く）
+HASH_CONCURRENCY = int(os.getenv("HASH_CONCURRENCY", str(min(4, os.cpu_count() or 1))))
+# 実行枠が空くまで待つ最大秒数。超えたら 503 を返す
+HASH_QUEUE_TIMEOUT = float(os.getenv("HASH_QUEUE_TIMEOUT", "5"))
+# 待ち行列の最大長。これ以上は待たせずに 503
+HASH_MAX_WAITING = int(os.getenv("HASH_MAX_WAITING", "64"))
+
+_executor = ThreadPoolExecutor(max_workers=HASH_CONCURRENCY, thread_name_prefix="bcrypt")
+_slots = None
+_waiting = 0
+
+
+def _get_slots() -> asyncio.Semaphore:
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(HASH_CONCURRENCY)
+    return _slots
+
+
+def check_length(password: str) -> bytes:
+    # bcryptはbytesを扱うためエンコード
+    pwd_bytes = password.encode('utf-8')
+
+    # 🔒 bcryptの72byte制限チェック
+    if len(pwd_bytes) > 72:
+        raise HTTPException(
+            status_code=400,
+            detail="パスワードは72バイト以内で入力してください"
+        )
+    return pwd_bytes
+
+
+def hash_password_sync(password: str, rounds: int = None) -> str:
+    pwd_bytes = check_length(password)
+    # ソルトを生成してハッシュ化
+    salt = bcrypt.gensalt(rounds=rounds or BCRYPT_ROUNDS)
+    hashed = bcrypt.hashpw(pwd_bytes, salt)
+    return hashed.decode('utf-8')
+
+
+def verify_password_sync(plain_password: str, hashed_password: str) -> bool:
+    try:
+        if not hashed_password: return False
+        return bcrypt.checkpw(
+            plain_password.encode('utf-8'),
+            hashed_password.encode('utf-8')
+        )
+    except ValueError:
+        return False
+
+
+async def _run(func, *args):
+    """実行枠を確保してから専用プールで func を実行する（アドミッション制御）"""
+    global _waiting
+    slots = _get_slots()
+    if slots.locked() and _waiting >= HASH_MAX_WAITING:
+        raise HTTPException(status_code=503, detail="混雑しています。しばらくしてから再度お試しください",
+                            headers={"Retry-After": "2"})
+
+    _waiting += 1
+    try:
+        await asyncio.wait_for(slots.acquire(), timeout=HASH_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="混雑しています。しばらくしてから再度お試しください",
+                            headers={"Retry-After": "2"})
+    finally:
+        _waiting -= 1
+
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, func, *args)
+    finally:
+        slots.release()
+
+
+async def hash_password(password: str) -> str:
+    # 長さチェックは即座にエラーを返せるよう先に行う
+    check_length(password)
+    return await _run(hash_password_sync, password)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await _run(verify_password_sync, plain_password, hashed_password)
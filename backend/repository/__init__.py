@@ -0,0 +1,24 @@
+# repository パッケージ
+# STORAGE_BACKEND 環境変数で実装を切り替える
+#   supabase (既定) : Supabase (PostgREST)
+#   sqlite          : 組み込み SQLite (SQLITE_PATH, 既定 backend/data/jigsaw.db)
+import os
+
+from .base import Repository
+from .sqlite_repo import SQLiteRepository
+from .supabase_repo import SupabaseRepository
+
+__all__ = ["Repository", "SQLiteRepository", "SupabaseRepository", "create_repository"]
+
+DEFAULT_SQLITE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "jigsaw.db")
+
+
+def create_repository(backend: str, supabase_client=None) -> Repository:
+    """supabase_client はクライアント、またはクライアントを返す関数（遅延作成用）"""
+    if backend == "sqlite":
+        return SQLiteRepository(os.getenv("SQLITE_PATH", DEFAULT_SQLITE_PATH))
+    if backend == "supabase":
+        if supabase_client is None:
+            raise RuntimeError("STORAGE_BACKEND=supabase には SUPABASE_URL / SUPABASE_SERVICE_KEY が必要です")
+        return SupabaseRepository(supabase_client)
+    raise RuntimeError(f"未対応の STORAGE_BACKEND です: {backend}")
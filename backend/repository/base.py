@@ -0,0 +1,154 @@
+# repository/base.py
+# データアクセスのインターフェース
+# ルーターは Supabase の PostgREST クエリを直接書かず、このクラスのメソッドを呼ぶ。
+# 戻り値は Supabase の行と同じ形の dict (見つからなければ None / 空リスト)。
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+Row = Dict[str, Any]
+
+
+class Repository(ABC):
+    name = "base"
+
+    # --- users ---
+
+    @abstractmethod
+    def get_user_by_username(self, username: str) -> Optional[Row]: ...
+
+    @abstractmethod
+    def get_username(self, user_id: str) -> Optional[str]: ...
+
+    @abstractmethod
+    def create_user(self, user_id: str, username: str, password_hash: str) -> Row: ...
+
+    @abstractmethod
+    def get_usernames(self, user_ids: List[str]) -> Dict[str, str]:
+        """user_id -> username (見つからないものは含まない)"""
+
+    # --- rooms ---
+
+    @abstractmethod
+    def create_room(self, room: Row) -> Optional[Row]: ...
+
+    @abstractmethod
+    def get_room(self, room_id: str) -> Optional[Row]: ...
+
+    @abstractmethod
+    def list_rooms_with_counts(self) -> List[Row]:
+        """全ルームを current_players (room_members の件数) 付きで返す"""
+
+    @abstractmethod
+    def delete_room(self, room_id: str) -> None: ...
+
+    @abstractmethod
+    def image_in_use(self, image_url: str) -> bool:
+        """puzzle_masters / rooms のどこかがこの画像URLを参照しているか"""
+
+    @abstractmethod
+    def content_in_use(self, digest: str) -> bool:
+        """同じ内容ハッシュの画像を、URL の形（ローカル・Storage）を問わずどこかが参照しているか"""
+
+    # --- room_members ---
+
+    @abstractmethod
+    def add_member(self, room_id: str, user_id: str) -> None: ...
+
+    @abstractmethod
+    def is_member(self, room_id: str, user_id: str) -> bool: ...
+
+    @abstractmethod
+    def list_members(self, room_id: str) -> List[Row]: ...
+
+    @abstractmethod
+    def remove_member(self, room_id: str, user_id: str) -> None: ...
+
+    @abstractmethod
+    def delete_room_members(self, room_id: str) -> None: ...
+
+    # --- puzzle_masters ---
+
+    @abstractmethod
+    def list_puzzle_masters(self, user_id: Optional[str] = None) -> List[Row]: ...
+
+    @abstractmethod
+    def get_puzzle_master(self, puzzle_id: int) -> Optional[Row]: ...
+
+    @abstractmethod
+    def create_puzzle_master(self, user_id: str, image_url: str, title: str) -> Row: ...
+
+    @abstractmethod
+    def delete_puzzle_master(self, puzzle_id: int) -> None: ...
+
+    # --- single_sessions ---
+
+    @abstractmethod
+    def create_session(self, user_id: str, puzzle_id: int, difficulty: str) -> Optional[Row]: ...
+
+    @abstractmethod
+    def get_session(self, session_id: str) -> Optional[Row]:
+        """セッションを puzzle_masters(*) を埋め込んだ形で返す"""
+
+    @abstractmethod
+    def list_user_sessions(self, user_id: str) -> List[Row]:
+        """ユーザーのセッションを puzzle_masters(title, image_url) 付きで新しい順に返す"""
+
+    @abstractmethod
+    def update_session(self, session_id: str, elapsed_time: int, is_completed: bool) -> None: ...
+
+    @abstractmethod
+    def delete_session(self, session_id: str) -> bool:
+        """削除できたら True"""
+
+    @abstractmethod
+    def list_sessions_by_puzzle(self, puzzle_id: int) -> List[Row]: ...
+
+    @abstractmethod
+    def delete_sessions_by_puzzle(self, puzzle_id: int) -> None: ...
+
+    @abstractmethod
+    def best_session_time(self, user_id: str, puzzle_id: int, difficulty: str) -> Optional[int]: ...
+
+    @abstractmethod
+    def list_completed_times(self, user_id: str) -> List[Row]:
+        """クリア済みセッションの puzzle_id, difficulty, elapsed_time"""
+
+    # --- single_session_pieces ---
+
+    @abstractmethod
+    def list_pieces(self, session_id: str) -> List[Row]: ...
+
+    @abstractmethod
+    def upsert_pieces(self, pieces: List[Row]) -> None:
+        """(session_id, piece_index) 単位でまとめて upsert"""
+
+    @abstractmethod
+    def delete_pieces(self, session_ids: List[str]) -> None: ...
+
+    # --- user_best_records ---
+
+    @abstractmethod
+    def get_best_record(self, user_id: str, puzzle_id: int, difficulty: str) -> Optional[Row]: ...
+
+    @abstractmethod
+    def upsert_best_record(self, user_id: str, puzzle_id: int, difficulty: str, elapsed_time: int) -> None: ...
+
+    @abstractmethod
+    def delete_best_records(self, puzzle_ids: List[int]) -> None: ...
+
+    # --- chat_messages ---
+
+    @abstractmethod
+    def insert_chat_messages(self, messages: List[Row]) -> None:
+        """(room_id, user_id, username, message, timestamp) をまとめて insert"""
+
+    @abstractmethod
+    def list_chat_messages(self, room_id: str, limit: int) -> List[Row]:
+        """ルームの直近 limit 件を古い順に返す"""
+
+    @abstractmethod
+    def delete_chat_messages(self, room_id: str) -> None: ...
+
+    @abstractmethod
+    def list_best_records(self) -> List[Row]:
+        """全ユーザーのベスト記録 (user_id, puzzle_id, difficulty, elapsed_time, updated_at)"""
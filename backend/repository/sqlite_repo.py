@@ -0,0 +1,362 @@
+# repository/sqlite_repo.py
+# 組み込み SQLite 実装（単一ノード運用・オフラインでのベンチマーク用）
+# ・接続はスレッドごとに1本（FastAPI の同期エンドポイントはスレッドプールで動くため）
+# ・WAL モードで読み込みと書き込みを並行させる
+# ・SQL は定数文字列 + プレースホルダのみ（sqlite3 の statement cache でプリペアド文として再利用される）
+# ・ピースの保存は executemany による一括 upsert
+import os
+import sqlite3
+import threading
+import uuid
+from typing import List, Optional
+
+from .base import Repository, Row
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    password_hash TEXT NOT NULL,
+    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+);
+CREATE TABLE IF NOT EXISTS rooms (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    host_user_id TEXT,
+    max_players INTEGER NOT NULL,
+    difficulty TEXT DEFAULT 'normal',
+    password TEXT,
+    image_url TEXT,
+    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+);
+CREATE TABLE IF NOT EXISTS room_members (
+    id TEXT PRIMARY KEY,
+    room_id TEXT NOT NULL REFERENCES rooms(id) ON DELETE CASCADE,
+    user_id TEXT NOT NULL,
+    joined_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+);
+CREATE INDEX IF NOT EXISTS idx_room_members_room ON room_members(room_id, user_id);
+CREATE TABLE IF NOT EXISTS puzzle_masters (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    image_url TEXT NOT NULL,
+    title TEXT,
+    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+);
+CREATE INDEX IF NOT EXISTS idx_puzzle_masters_user ON puzzle_masters(user_id);
+CREATE INDEX IF NOT EXISTS idx_puzzle_masters_image ON puzzle_masters(image_url);
+CREATE TABLE IF NOT EXISTS single_sessions (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    puzzle_id INTEGER NOT NULL,
+    difficulty TEXT DEFAULT 'normal',
+    elapsed_time INTEGER NOT NULL DEFAULT 0,
+    is_completed INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    updated_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_user ON single_sessions(user_id, updated_at);
+CREATE INDEX IF NOT EXISTS idx_sessions_puzzle ON single_sessions(puzzle_id);
+CREATE TABLE IF NOT EXISTS single_session_pieces (
+    session_id TEXT NOT NULL,
+    piece_index INTEGER NOT NULL,
+    x REAL NOT NULL,
+    y REAL NOT NULL,
+    rotation REAL NOT NULL,
+    is_locked INTEGER NOT NULL DEFAULT 0,
+    group_id INTEGER,
+    PRIMARY KEY (session_id, piece_index)
+);
+CREATE TABLE IF NOT EXISTS user_best_records (
+    user_id TEXT NOT NULL,
+    puzzle_id INTEGER NOT NULL,
+    difficulty TEXT NOT NULL,
+    elapsed_time INTEGER NOT NULL,
+    updated_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    PRIMARY KEY (user_id, puzzle_id, difficulty)
+);
+CREATE TABLE IF NOT EXISTS chat_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    room_id TEXT NOT NULL,
+    user_id TEXT,
+    username TEXT,
+    message TEXT NOT NULL,
+    timestamp INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chat_messages_room ON chat_messages(room_id, timestamp);
+"""
+
+NOW = "strftime('%Y-%m-%dT%H:%M:%fZ', 'now')"
+
+SQL_UPSERT_PIECE = """
+INSERT INTO single_session_pieces (session_id, piece_index, x, y, rotation, is_locked, group_id)
+VALUES (:session_id, :piece_index, :x, :y, :rotation, :is_locked, :group_id)
+ON CONFLICT (session_id, piece_index) DO UPDATE SET
+    x = excluded.x, y = excluded.y, rotation = excluded.rotation,
+    is_locked = excluded.is_locked, group_id = excluded.group_id
+"""
+
+SQL_UPSERT_BEST = f"""
+INSERT INTO user_best_records (user_id, puzzle_id, difficulty, elapsed_time)
+VALUES (?, ?, ?, ?)
+ON CONFLICT (user_id, puzzle_id, difficulty) DO UPDATE SET
+    elapsed_time = excluded.elapsed_time, updated_at = {NOW}
+"""
+
+SQL_ROOMS_WITH_COUNTS = """
+SELECT r.id, r.name, r.max_players, r.password, r.difficulty, r.image_url,
+       (SELECT COUNT(*) FROM room_members m WHERE m.room_id = r.id) AS current_players
+FROM rooms r
+"""
+
+SQL_SESSION_WITH_MASTER = """
+SELECT s.*, p.id AS pm_id, p.user_id AS pm_user_id, p.image_url AS pm_image_url,
+       p.title AS pm_title, p.created_at AS pm_created_at
+FROM single_sessions s LEFT JOIN puzzle_masters p ON p.id = s.puzzle_id
+"""
+
+# bool として返すカラム
+BOOL_COLUMNS = ("is_completed", "is_locked")
+
+
+def _row(cur_row: sqlite3.Row) -> Row:
+    row = dict(cur_row)
+    for col in BOOL_COLUMNS:
+        if col in row:
+            row[col] = bool(row[col])
+    return row
+
+
+def _with_master(cur_row: sqlite3.Row, columns=("id", "user_id", "image_url", "title", "created_at")) -> Row:
+    """pm_* カラムを Supabase の埋め込み形式 (puzzle_masters: {...}) にまとめる"""
+    row = _row(cur_row)
+    master = {c: row.pop(f"pm_{c}") for c in ("id", "user_id", "image_url", "title", "created_at")}
+    row["puzzle_masters"] = {c: master[c] for c in columns} if master["id"] is not None else None
+    return row
+
+
+class SQLiteRepository(Repository):
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, cached_statements=256, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def _one(self, sql: str, params=()) -> Optional[Row]:
+        cur = self._conn().execute(sql, params)
+        r = cur.fetchone()
+        return _row(r) if r else None
+
+    def _all(self, sql: str, params=()) -> List[Row]:
+        return [_row(r) for r in self._conn().execute(sql, params).fetchall()]
+
+    def _write(self, sql: str, params=()) -> sqlite3.Cursor:
+        conn = self._conn()
+        with conn:
+            return conn.execute(sql, params)
+
+    # --- users ---
+
+    def get_user_by_username(self, username):
+        return self._one("SELECT * FROM users WHERE username = ?", (username,))
+
+    def get_username(self, user_id):
+        row = self._one("SELECT username FROM users WHERE id = ?", (user_id,))
+        return row["username"] if row else None
+
+    def create_user(self, user_id, username, password_hash):
+        self._write("INSERT INTO users (id, username, password_hash) VALUES (?, ?, ?)",
+                    (user_id, username, password_hash))
+        return self._one("SELECT * FROM users WHERE id = ?", (user_id,))
+
+    def get_usernames(self, user_ids):
+        names = {}
+        ids = list(user_ids)
+        # SQLite のプレースホルダ数の上限に収まるよう分割する
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            rows = self._all(f"SELECT id, username FROM users WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+            names.update({r["id"]: r["username"] for r in rows})
+        return names
+
+    # --- rooms ---
+
+    def create_room(self, room):
+        self._write(
+            "INSERT INTO rooms (id, name, host_user_id, max_players, difficulty, password, image_url) "
+            "VALUES (:id, :name, :host_user_id, :max_players, :difficulty, :password, :image_url)",
+            {k: room.get(k) for k in ("id", "name", "host_user_id", "max_players", "difficulty", "password", "image_url")}
+        )
+        return self.get_room(room["id"])
+
+    def get_room(self, room_id):
+        return self._one("SELECT * FROM rooms WHERE id = ?", (room_id,))
+
+    def list_rooms_with_counts(self):
+        return self._all(SQL_ROOMS_WITH_COUNTS)
+
+    def delete_room(self, room_id):
+        self._write("DELETE FROM rooms WHERE id = ?", (room_id,))
+
+    def image_in_use(self, image_url):
+        return self._one("SELECT 1 AS ok WHERE EXISTS (SELECT 1 FROM puzzle_masters WHERE image_url = ?) "
+                         "OR EXISTS (SELECT 1 FROM rooms WHERE image_url = ?)",
+                         (image_url, image_url)) is not None
+
+    def content_in_use(self, digest):
+        # 保存名は {digest}{ext} なので、どちらの URL でも "/{digest}." を含む
+        pattern = f"%/{digest}.%"
+        return self._one("SELECT 1 AS ok WHERE EXISTS (SELECT 1 FROM puzzle_masters WHERE image_url LIKE ?) "
+                         "OR EXISTS (SELECT 1 FROM rooms WHERE image_url LIKE ?)",
+                         (pattern, pattern)) is not None
+
+    # --- room_members ---
+
+    def add_member(self, room_id, user_id):
+        self._write("INSERT INTO room_members (id, room_id, user_id) VALUES (?, ?, ?)",
+                    (str(uuid.uuid4()), room_id, user_id))
+
+    def is_member(self, room_id, user_id):
+        return self._one("SELECT 1 AS ok FROM room_members WHERE room_id = ? AND user_id = ? LIMIT 1",
+                         (room_id, user_id)) is not None
+
+    def list_members(self, room_id):
+        return self._all("SELECT user_id FROM room_members WHERE room_id = ?", (room_id,))
+
+    def remove_member(self, room_id, user_id):
+        self._write("DELETE FROM room_members WHERE room_id = ? AND user_id = ?", (room_id, user_id))
+
+    def delete_room_members(self, room_id):
+        self._write("DELETE FROM room_members WHERE room_id = ?", (room_id,))
+
+    # --- puzzle_masters ---
+
+    def list_puzzle_masters(self, user_id=None):
+        if user_id:
+            return self._all("SELECT * FROM puzzle_masters WHERE user_id = ?", (user_id,))
+        return self._all("SELECT * FROM puzzle_masters")
+
+    def get_puzzle_master(self, puzzle_id):
+        return self._one("SELECT * FROM puzzle_masters WHERE id = ?", (puzzle_id,))
+
+    def create_puzzle_master(self, user_id, image_url, title):
+        cur = self._write("INSERT INTO puzzle_masters (user_id, image_url, title) VALUES (?, ?, ?)",
+                          (user_id, image_url, title))
+        return self.get_puzzle_master(cur.lastrowid)
+
+    def delete_puzzle_master(self, puzzle_id):
+        self._write("DELETE FROM puzzle_masters WHERE id = ?", (puzzle_id,))
+
+    # --- single_sessions ---
+
+    def create_session(self, user_id, puzzle_id, difficulty):
+        session_id = str(uuid.uuid4())
+        self._write("INSERT INTO single_sessions (id, user_id, puzzle_id, difficulty, elapsed_time) "
+                    "VALUES (?, ?, ?, ?, 0)", (session_id, user_id, puzzle_id, difficulty))
+        return self._one("SELECT * FROM single_sessions WHERE id = ?", (session_id,))
+
+    def get_session(self, session_id):
+        r = self._conn().execute(SQL_SESSION_WITH_MASTER + " WHERE s.id = ?", (session_id,)).fetchone()
+        return _with_master(r) if r else None
+
+    def list_user_sessions(self, user_id):
+        rows = self._conn().execute(
+            SQL_SESSION_WITH_MASTER + " WHERE s.user_id = ? ORDER BY s.updated_at DESC", (user_id,)
+        ).fetchall()
+        return [_with_master(r, columns=("title", "image_url")) for r in rows]
+
+    def update_session(self, session_id, elapsed_time, is_completed):
+        self._write(f"UPDATE single_sessions SET elapsed_time = ?, is_completed = ?, updated_at = {NOW} "
+                    "WHERE id = ?", (elapsed_time, int(is_completed), session_id))
+
+    def delete_session(self, session_id):
+        cur = self._write("DELETE FROM single_sessions WHERE id = ?", (session_id,))
+        return cur.rowcount > 0
+
+    def list_sessions_by_puzzle(self, puzzle_id):
+        return self._all("SELECT id FROM single_sessions WHERE puzzle_id = ?", (puzzle_id,))
+
+    def delete_sessions_by_puzzle(self, puzzle_id):
+        self._write("DELETE FROM single_sessions WHERE puzzle_id = ?", (puzzle_id,))
+
+    def best_session_time(self, user_id, puzzle_id, difficulty):
+        row = self._one("SELECT MIN(elapsed_time) AS best FROM single_sessions "
+                        "WHERE user_id = ? AND puzzle_id = ? AND difficulty = ? AND is_completed = 1",
+                        (user_id, puzzle_id, difficulty))
+        return row["best"] if row else None
+
+    def list_completed_times(self, user_id):
+        return self._all("SELECT puzzle_id, difficulty, elapsed_time FROM single_sessions "
+                         "WHERE user_id = ? AND is_completed = 1", (user_id,))
+
+    # --- single_session_pieces ---
+
+    def list_pieces(self, session_id):
+        return self._all("SELECT * FROM single_session_pieces WHERE session_id = ?", (session_id,))
+
+    def upsert_pieces(self, pieces):
+        if not pieces:
+            return
+        rows = [{**p, "is_locked": int(bool(p.get("is_locked")))} for p in pieces]
+        conn = self._conn()
+        with conn:
+            conn.executemany(SQL_UPSERT_PIECE, rows)
+
+    def delete_pieces(self, session_ids):
+        conn = self._conn()
+        with conn:
+            conn.executemany("DELETE FROM single_session_pieces WHERE session_id = ?",
+                             [(sid,) for sid in session_ids])
+
+    # --- user_best_records ---
+
+    def get_best_record(self, user_id, puzzle_id, difficulty):
+        return self._one("SELECT elapsed_time FROM user_best_records "
+                         "WHERE user_id = ? AND puzzle_id = ? AND difficulty = ?",
+                         (user_id, puzzle_id, difficulty))
+
+    def upsert_best_record(self, user_id, puzzle_id, difficulty, elapsed_time):
+        self._write(SQL_UPSERT_BEST, (user_id, puzzle_id, difficulty, elapsed_time))
+
+    def delete_best_records(self, puzzle_ids):
+        conn = self._conn()
+        with conn:
+            conn.executemany("DELETE FROM user_best_records WHERE puzzle_id = ?",
+                             [(pid,) for pid in puzzle_ids])
+
+    # --- chat_messages ---
+
+    def insert_chat_messages(self, messages):
+        if not messages:
+            return
+        conn = self._conn()
+        with conn:
+            conn.executemany("INSERT INTO chat_messages (room_id, user_id, username, message, timestamp) "
+                             "VALUES (:room_id, :user_id, :username, :message, :timestamp)", messages)
+
+    def list_chat_messages(self, room_id, limit):
+        rows = self._all("SELECT user_id, username, message, timestamp FROM chat_messages "
+                         "WHERE room_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?", (room_id, limit))
+        return rows[::-1]
+
+    def delete_chat_messages(self, room_id):
+        self._write("DELETE FROM chat_messages WHERE room_id = ?", (room_id,))
+
+    def list_best_records(self):
+        return self._all("SELECT user_id, puzzle_id, difficulty, elapsed_time, updated_at "
+                         "FROM user_best_records")
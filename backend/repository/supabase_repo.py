@@ -0,0 +1,295 @@
+# repository/supabase_repo.py
+# Supabase (PostgREST) 実装。これまでルーターに直接書いていたクエリをそのまま移したもの
+import uuid
+from typing import List, Optional
+
+import tracing
+
+from .base import Repository, Row
+
+
+def _first(res) -> Optional[Row]:
+    return res.data[0] if res.data else None
+
+
+class _TracedQuery:
+    """クエリビルダーを包み、execute() の時間を span("db", "テーブル.操作") として記録する"""
+
+    __slots__ = ("_builder", "_table", "_op")
+
+    def __init__(self, builder, table: str, op: str = None):
+        self._builder = builder
+        self._table = table
+        self._op = op
+
+    def __getattr__(self, name):
+        attr = getattr(self._builder, name)
+        if name == "execute":
+            def execute(*args, **kwargs):
+                with tracing.span("db", f"{self._table}.{self._op or 'query'}"):
+                    return attr(*args, **kwargs)
+            return execute
+        if not callable(attr):
+            return attr
+
+        def chain(*args, **kwargs):
+            # select / insert / update / upsert / delete のうち最初に呼ばれたものを操作名にする
+            return _TracedQuery(attr(*args, **kwargs), self._table, self._op or name)
+        return chain
+
+
+class SupabaseRepository(Repository):
+    name = "supabase"
+
+    def __init__(self, client):
+        # client は Supabase クライアント、または初回に作って返す関数 (database.get_supabase)
+        self._get_client = client if callable(client) else (lambda: client)
+
+    @property
+    def client(self):
+        return self._get_client()
+
+    def table(self, name: str):
+        return _TracedQuery(self.client.table(name), name)
+
+    # --- users ---
+
+    def get_user_by_username(self, username):
+        return _first(self.table("users").select("*").eq("username", username).limit(1).execute())
+
+    def get_username(self, user_id):
+        row = _first(self.table("users").select("username").eq("id", user_id).limit(1).execute())
+        return row.get("username") if row else None
+
+    def create_user(self, user_id, username, password_hash):
+        return _first(self.table("users").insert({
+            "id": user_id,
+            "username": username,
+            "password_hash": password_hash
+        }).execute())
+
+    def get_usernames(self, user_ids):
+        names = {}
+        ids = list(user_ids)
+        # URL が長くなりすぎないよう分割して in 検索する
+        for i in range(0, len(ids), 200):
+            rows = self.table("users").select("id, username").in_("id", ids[i:i + 200]).execute().data or []
+            names.update({r["id"]: r["username"] for r in rows})
+        return names
+
+    # --- rooms ---
+
+    def create_room(self, room):
+        return _first(self.table("rooms").insert(room).execute())
+
+    def get_room(self, room_id):
+        return _first(self.table("rooms").select("*").eq("id", room_id).limit(1).execute())
+
+    def list_rooms_with_counts(self):
+        rooms = self.table("rooms").select(
+            "id, name, max_players, password, difficulty, image_url"
+        ).execute().data or []
+        if not rooms:
+            return []
+
+        # ルームごとに count クエリを投げず、メンバーを1回で取得して数える
+        members = self.table("room_members") \
+            .select("room_id") \
+            .in_("room_id", [r["id"] for r in rooms]) \
+            .execute().data or []
+        counts = {}
+        for m in members:
+            counts[m["room_id"]] = counts.get(m["room_id"], 0) + 1
+        for r in rooms:
+            r["current_players"] = counts.get(r["id"], 0)
+        return rooms
+
+    def delete_room(self, room_id):
+        self.table("rooms").delete().eq("id", room_id).execute()
+
+    def image_in_use(self, image_url):
+        for table in ("puzzle_masters", "rooms"):
+            if self.table(table).select("id").eq("image_url", image_url).limit(1).execute().data:
+                return True
+        return False
+
+    def content_in_use(self, digest):
+        # 保存名は {digest}{ext} なので、どちらの URL でも "/{digest}." を含む
+        for table in ("puzzle_masters", "rooms"):
+            if self.table(table).select("id").like("image_url", f"%/{digest}.%").limit(1).execute().data:
+                return True
+        return False
+
+    # --- room_members ---
+
+    def add_member(self, room_id, user_id):
+        self.table("room_members").insert({
+            "id": str(uuid.uuid4()),
+            "room_id": room_id,
+            "user_id": user_id
+        }).execute()
+
+    def is_member(self, room_id, user_id):
+        res = self.table("room_members") \
+            .select("id") \
+            .eq("room_id", room_id) \
+            .eq("user_id", user_id) \
+            .limit(1) \
+            .execute()
+        return bool(res.data)
+
+    def list_members(self, room_id):
+        return self.table("room_members").select("user_id").eq("room_id", room_id).execute().data or []
+
+    def remove_member(self, room_id, user_id):
+        self.table("room_members").delete().eq("room_id", room_id).eq("user_id", user_id).execute()
+
+    def delete_room_members(self, room_id):
+        self.table("room_members").delete().eq("room_id", room_id).execute()
+
+    # --- puzzle_masters ---
+
+    def list_puzzle_masters(self, user_id=None):
+        query = self.table("puzzle_masters").select("*")
+        if user_id:
+            query = query.eq("user_id", user_id)
+        return query.execute().data or []
+
+    def get_puzzle_master(self, puzzle_id):
+        return _first(self.table("puzzle_masters").select("*").eq("id", puzzle_id).limit(1).execute())
+
+    def create_puzzle_master(self, user_id, image_url, title):
+        return _first(self.table("puzzle_masters").insert({
+            "user_id": user_id,
+            "image_url": image_url,
+            "title": title
+        }).execute())
+
+    def delete_puzzle_master(self, puzzle_id):
+        self.table("puzzle_masters").delete().eq("id", puzzle_id).execute()
+
+    # --- single_sessions ---
+
+    def create_session(self, user_id, puzzle_id, difficulty):
+        return _first(self.table("single_sessions").insert({
+            "user_id": user_id,
+            "puzzle_id": puzzle_id,
+            "difficulty": difficulty,
+            "elapsed_time": 0
+        }).execute())
+
+    def get_session(self, session_id):
+        return _first(self.table("single_sessions")
+                      .select("*, puzzle_masters(*)")
+                      .eq("id", session_id).limit(1).execute())
+
+    def list_user_sessions(self, user_id):
+        return self.table("single_sessions")\
+            .select("*, puzzle_masters(title, image_url)")\
+            .eq("user_id", user_id)\
+            .order("updated_at", desc=True)\
+            .execute().data or []
+
+    def update_session(self, session_id, elapsed_time, is_completed):
+        self.table("single_sessions").update({
+            "elapsed_time": elapsed_time,
+            "is_completed": is_completed,
+            "updated_at": "now()"
+        }).eq("id", session_id).execute()
+
+    def delete_session(self, session_id):
+        res = self.table("single_sessions").delete().eq("id", session_id).execute()
+        return bool(res.data)
+
+    def list_sessions_by_puzzle(self, puzzle_id):
+        return self.table("single_sessions").select("id").eq("puzzle_id", puzzle_id).execute().data or []
+
+    def delete_sessions_by_puzzle(self, puzzle_id):
+        self.table("single_sessions").delete().eq("puzzle_id", puzzle_id).execute()
+
+    def best_session_time(self, user_id, puzzle_id, difficulty):
+        row = _first(self.table("single_sessions")
+                     .select("elapsed_time")
+                     .eq("user_id", user_id)
+                     .eq("puzzle_id", puzzle_id)
+                     .eq("difficulty", difficulty)
+                     .eq("is_completed", True)
+                     .order("elapsed_time", desc=False)
+                     .limit(1)
+                     .execute())
+        return row["elapsed_time"] if row else None
+
+    def list_completed_times(self, user_id):
+        return self.table("single_sessions")\
+            .select("puzzle_id, difficulty, elapsed_time")\
+            .eq("user_id", user_id)\
+            .eq("is_completed", True)\
+            .execute().data or []
+
+    # --- single_session_pieces ---
+
+    def list_pieces(self, session_id):
+        return self.table("single_session_pieces").select("*").eq("session_id", session_id).execute().data or []
+
+    def upsert_pieces(self, pieces: List[Row]):
+        if pieces:
+            self.table("single_session_pieces").upsert(pieces).execute()
+
+    def delete_pieces(self, session_ids):
+        if session_ids:
+            self.table("single_session_pieces").delete().in_("session_id", list(session_ids)).execute()
+
+    # --- user_best_records ---
+
+    def get_best_record(self, user_id, puzzle_id, difficulty):
+        return _first(self.table("user_best_records")
+                      .select("elapsed_time")
+                      .eq("user_id", user_id)
+                      .eq("puzzle_id", puzzle_id)
+                      .eq("difficulty", difficulty)
+                      .limit(1)
+                      .execute())
+
+    def upsert_best_record(self, user_id, puzzle_id, difficulty, elapsed_time):
+        self.table("user_best_records").upsert({
+            "user_id": user_id,
+            "puzzle_id": puzzle_id,
+            "difficulty": difficulty,
+            "elapsed_time": elapsed_time,
+            "updated_at": "now()"
+        }).execute()
+
+    def delete_best_records(self, puzzle_ids):
+        if puzzle_ids:
+            self.table("user_best_records").delete().in_("puzzle_id", list(puzzle_ids)).execute()
+
+    # --- chat_messages ---
+
+    def insert_chat_messages(self, messages):
+        if messages:
+            self.table("chat_messages").insert(messages).execute()
+
+    def list_chat_messages(self, room_id, limit):
+        rows = self.table("chat_messages") \
+            .select("user_id, username, message, timestamp") \
+            .eq("room_id", room_id) \
+            .order("timestamp", desc=True) \
+            .limit(limit) \
+            .execute().data or []
+        return rows[::-1]
+
+    def delete_chat_messages(self, room_id):
+        self.table("chat_messages").delete().eq("room_id", room_id).execute()
+
+    def list_best_records(self):
+        # PostgREST は1回に返す件数に上限があるのでページングして全件取る
+        rows, page = [], 1000
+        while True:
+            data = self.table("user_best_records") \
+                .select("user_id, puzzle_id, difficulty, elapsed_time, updated_at") \
+                .order("puzzle_id").order("difficulty").order("user_id") \
+                .range(len(rows), len(rows) + page - 1) \
+                .execute().data or []
+            rows.extend(data)
+            if len(data) < page:
+                return rows
@@ -0,0 +1,176 @@
+# resize.py
+# 一覧・ギャラリー用の縮小画像をその場で生成する
+# ・生成はプロセスプールで行い、イベントループとAPIのスレッドを塞がない
+# ・結果はディスク上の LRU キャッシュに保存（合計サイズの上限を超えたら古いものから削除）
+import asyncio
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from images import CACHE_DIR, decode_errors, known_hash, load_image
+
+# 許可する幅（任意の幅を許すとキャッシュを埋め尽くせてしまうため）
+ALLOWED_WIDTHS = (64, 120, 240, 480, 960)
+FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg"), "png": ("PNG", "image/png")}
+MIN_QUALITY = 30
+MAX_QUALITY = 95
+
+RESIZE_WORKERS = int(os.getenv("RESIZE_WORKERS", "2"))
+RESIZE_CACHE_MAX_BYTES = int(os.getenv("RESIZE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+_pool = None
+_pool_guard = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_guard:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=RESIZE_WORKERS)
+        return _pool
+
+
+def render_resized(data: bytes, width: int, fmt: str, quality: int) -> bytes:
+    """ワーカープロセス側で実行される縮小処理"""
+    # PIL はワーカープロセス側でだけ読み込めばよい（Web プロセスの起動を遅くしない）
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(data))
+    image.draft("RGB", (width, width))  # JPEG は読み込み時点で縮小デコード
+    if image.width > width:
+        height = max(1, round(image.height * width / image.width))
+        image = image.resize((width, height), Image.LANCZOS)
+
+    pil_format, _ = FORMATS[fmt]
+    if pil_format == "JPEG":
+        image = image.convert("RGB")
+    elif image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+
+    buf = io.BytesIO()
+    if pil_format == "PNG":
+        image.save(buf, format=pil_format, optimize=True)
+    else:
+        image.save(buf, format=pil_format, quality=quality)
+    return buf.getvalue()
+
+
+class DiskLRUCache:
+    """合計サイズに上限のあるディスクキャッシュ（最後に使った順で削除）"""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.total = 0
+        # name -> size (先頭ほど古い)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp") or not os.path.isfile(path):
+                continue
+            st = os.stat(path)
+            files.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.total += size
+        self._evict()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def get(self, name: str):
+        """キャッシュにあればパスを返し、最近使ったものとして記録する"""
+        with self.lock:
+            if name not in self.entries:
+                return None
+            self.entries.move_to_end(name)
+        path = self.path(name)
+        # 再起動後の並び順のため mtime をアクセス時刻として使う
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self.lock:
+                self.total -= self.entries.pop(name, 0)
+            return None
+        return path
+
+    def put(self, name: str, data: bytes) -> str:
+        path = self.path(name)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self.lock:
+            self.total -= self.entries.pop(name, 0)
+            self.entries[name] = len(data)
+            self.total += len(data)
+            self._evict()
+        return path
+
+    def _evict(self):
+        while self.total > self.max_bytes and len(self.entries) > 1:
+            name, size = self.entries.popitem(last=False)
+            self.total -= size
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
+
+
+_cache = None
+
+
+def get_cache() -> DiskLRUCache:
+    global _cache
+    if _cache is None:
+        _cache = DiskLRUCache(os.path.join(CACHE_DIR, "resized"), RESIZE_CACHE_MAX_BYTES)
+    return _cache
+
+
+def validate(width: int, fmt: str, quality: int):
+    if width not in ALLOWED_WIDTHS:
+        raise HTTPException(status_code=400, detail=f"width は {ALLOWED_WIDTHS} のいずれかを指定してください")
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format は {tuple(FORMATS)} のいずれかを指定してください")
+    if not MIN_QUALITY <= quality <= MAX_QUALITY:
+        raise HTTPException(status_code=400, detail=f"quality は {MIN_QUALITY}〜{MAX_QUALITY} で指定してください")
+
+
+async def get_resized(image_url: str, width: int, fmt: str, quality: int):
+    """縮小画像のパスと Content-Type を返す（キャッシュに無ければ生成）"""
+    validate(width, fmt, quality)
+    cache = await run_in_threadpool(get_cache)
+    # PNG は可逆なので quality はキーに含めない
+    suffix = f"{width}.{fmt}" if fmt == "png" else f"{width}_q{quality}.{fmt}"
+
+    digest = known_hash(image_url)
+    if digest:
+        path = cache.get(f"{digest}_{suffix}")
+        if path:
+            return path, FORMATS[fmt][1]
+
+    data, digest = await run_in_threadpool(load_image, image_url)
+    name = f"{digest}_{suffix}"
+    path = cache.get(name)
+    if path:
+        return path, FORMATS[fmt][1]
+
+    loop = asyncio.get_running_loop()
+    try:
+        resized = await loop.run_in_executor(_get_pool(), render_resized, data, width, fmt, quality)
+    except decode_errors() as e:
+        print(f"Resize error: {e}")
+        raise HTTPException(status_code=400, detail="画像を読み込めません")
+    path = await run_in_threadpool(cache.put, name, resized)
+    return path, FORMATS[fmt][1]
@@ -1,12 +1,35 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, Query
 from typing import List, Dict, Any
 import json
+import math
+import os
 import asyncio
-
-router = APIRouter()
+import time
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
+from database import repo
+import session_tokens
+import jobs
+from multiplay.spectators import SpectatorHub
+from multiplay.interest import InterestManager
+from multiplay import replay
+from multiplay.chat import ChatHistory
+from multiplay.leases import LeaseTable
+from multiplay.heartbeat import HeartbeatMonitor
+from multiplay.presence import PresenceHub
+from multiplay.admission import admission, ADMISSION_RETRY_AFTER
+from tracing import TracedRoute
+
+router = APIRouter(route_class=TracedRoute)
 
 # --- Managers ---
 
+async def reject_overloaded(websocket: WebSocket):
+    """接続数の上限を超えたときに、再試行までの秒数を伝えて閉じる"""
+    await websocket.accept()
+    await websocket.close(code=1013, reason=f"retry_after={ADMISSION_RETRY_AFTER}")
+
+
 class ConnectionManager:
     def __init__(self):
         # room_id -> List[WebSocket]
@@ -14,17 +37,34 @@ class ConnectionManager:
         # room_id -> { user_id: { "username": str, "joined_at": str } } (簡易的なメンバー管理)
         # 実際にはDBから取得するが、WebSocket接続中のユーザーを把握するために保持
         self.room_members: Dict[str, Dict[str, Any]] = {}
+        # PING/PONG による生存確認。応答の無い接続はすぐに送信先から外す
+        self.heartbeat = HeartbeatMonitor(self.drop)
+        # 受け入れた接続 -> (room_id, user_id)（定員・接続数の返却用）
+        self.admitted: Dict[WebSocket, tuple] = {}
+
+    async def connect(self, room_id: str, websocket: WebSocket, user_id: str) -> bool:
+        """定員・接続数の上限内なら受け入れる。断った場合は閉じて False"""
+        if not admission.open_connection():
+            await reject_overloaded(websocket)
+            return False
+        if not admission.enter(room_id, user_id):
+            admission.close_connection()
+            # 理由をクライアントに伝えるため、受け入れてから close code 付きで閉じる
+            await websocket.accept()
+            await websocket.close(code=4403, reason="room full")
+            return False
 
-    async def connect(self, room_id: str, websocket: WebSocket, user_id: str):
         await websocket.accept()
         if room_id not in self.active_connections:
             self.active_connections[room_id] = []
             self.room_members[room_id] = {}
         
         self.active_connections[room_id].append(websocket)
+        self.admitted[websocket] = (room_id, user_id)
         # メンバー追加は別途 JOIN メッセージで行うか、ここでDB参照してもよいが、
         # 簡易的にWebSocket接続=参加中とみなす
         print(f"User {user_id} connected to room {room_id}")
+        return True
 
     def disconnect(self, room_id: str, websocket: WebSocket, user_id: str):
         if room_id in self.active_connections:
@@ -37,15 +77,37 @@ class ConnectionManager:
                 # GameStateも消すべきだが、一時的な切断の可能性もあるので要検討
                 pass
 
+        # 席と接続数を返す（何度呼ばれても1回だけ）
+        if self.admitted.pop(websocket, None):
+            admission.leave(room_id, user_id)
+            admission.close_connection()
+
+    def drop(self, room_id: str, websocket: WebSocket):
+        """死んだ接続を送信先から外す（退出処理は受信ループ側で行う）"""
+        connections = self.active_connections.get(room_id)
+        if connections and websocket in connections:
+            connections.remove(websocket)
+
     async def broadcast(self, room_id: str, message: dict):
         if room_id in self.active_connections:
-            # 切断されたソケットへの送信エラーを防ぐためコピーして回すなどの対策が必要だが
-            # WebSocketDisconnectで処理されるので基本はOK
-            for connection in self.active_connections[room_id]:
-                try:
-                    await connection.send_text(json.dumps(message))
-                except Exception as e:
-                    print(f"Broadcast error: {e}")
+            await self.send_to(self.active_connections[room_id], message)
+
+    async def send_to(self, connections: List[WebSocket], message: dict):
+        """指定した接続にだけ送る（JSON 化は1回だけ）"""
+        text = json.dumps(message)
+        # 送信中の await の間に接続が抜けても回せるようにコピーする
+        for connection in list(connections):
+            try:
+                await connection.send_text(text)
+            except Exception as e:
+                # 送れなかった接続は以降の送信対象から外す（次の broadcast で同じエラーを出さない）
+                print(f"Broadcast error: {e}")
+                if connection in self.heartbeat.conns:
+                    self.heartbeat.expire(connection, "send error")
+                else:
+                    for room_connections in self.active_connections.values():
+                        if connection in room_connections:
+                            room_connections.remove(connection)
 
     def get_member_count(self, room_id: str):
         return len(self.active_connections.get(room_id, []))
@@ -165,13 +227,26 @@ class GameStateManager:
                 if state[member_idx]["locked_by"] == user_id:
                     state[member_idx]["locked_by"] = None
 
-    def update_piece(self, room_id: str, index: int, x: float, y: float, rotation: int, user_id: str):
+    def update_piece(self, room_id: str, index: int, x: float, y: float, rotation: int, user_id: str) -> bool:
+        """ロックを持っている本人の更新だけ反映する。反映したら True"""
         state = self.game_states.get(room_id, {})
         piece = state.get(index)
-        if piece and piece["locked_by"] == user_id:
-            piece["x"] = x
-            piece["y"] = y
-            piece["rotation"] = rotation
+        if not piece or piece["locked_by"] != user_id:
+            return False
+        # クライアント (handleRemoteMove) と同じく、グループのメンバーも同じだけ動かす
+        if len(piece["group"]) > 1 and all(isinstance(v, (int, float)) for v in (x, y, piece["x"], piece["y"])):
+            dx = x - piece["x"]
+            dy = y - piece["y"]
+            for member_idx in piece["group"]:
+                member = state.get(member_idx)
+                if member is not None and member is not piece:
+                    member["x"] += dx
+                    member["y"] += dy
+                    member["rotation"] = rotation
+        piece["x"] = x
+        piece["y"] = y
+        piece["rotation"] = rotation
+        return True
     
     def merge_groups(self, room_id: str, piece1_idx: int, piece2_idx: int):
         """2つのピース（のグループ）を結合する"""
@@ -188,37 +263,152 @@ class GameStateManager:
 
 manager = ConnectionManager()
 game_state = GameStateManager()
+# 観戦者はプレイヤーとは別の配信経路 (一定間隔のスナップショット/差分) で扱う
+spectators = SpectatorHub(game_state, manager)
+# 視野に入っているクライアントにだけ MOVED を送るための空間インデックス
+interest = InterestManager()
+# 対戦記録（ルーム解散後もリプレイできるようにディスクへ書き出す）
+recorder = replay.ReplayRecorder(game_state)
+# 途中参加者にも見えるよう、直近のチャットをルームごとに保持する
+chat_history = ChatHistory()
+# カーソル位置はピースのイベントとは別に、一定間隔でまとめて送る
+presence = PresenceHub(manager)
+
+
+async def force_unlock(room_id: str, index: int, user_id: str):
+    """期限切れ・切断でロックを外し、全員に UNLOCKED を送る"""
+    piece = game_state.get_piece(room_id, index)
+    if not piece or piece["locked_by"] != user_id:
+        return
+    game_state.unlock_piece(room_id, index, user_id)
+    interest.synced(room_id, index, piece["x"], piece["y"])
+    recorder.unlock(room_id, index, piece["x"], piece["y"], piece["rotation"])
+    await manager.broadcast(room_id, {
+        "type": "UNLOCKED",
+        "index": index,
+        "x": piece["x"],
+        "y": piece["y"],
+        "rotation": piece["rotation"]
+    })
+
+# ロックは期限付き（MOVE で延長）。ドラッグ中に落ちたクライアントのピースが固まらないようにする
+leases = LeaseTable(force_unlock)
+
+
+async def fetch_username(user_id: str) -> str:
+    """ユーザー名を取得（見つからなければ Guest_xxxx）"""
+    try:
+        username = await run_in_threadpool(repo.get_username, user_id)
+    except Exception as e:
+        print(f"Username fetch error: {e}")
+        username = None
+    return username or f"Guest_{user_id[:4]}"
+
+# --- Replay ---
+
+@router.get("/replay/{room_id}/info")
+def replay_info(room_id: str):
+    """記録の有無と、シークに使える KEYFRAME の時刻一覧"""
+    if not replay.ROOM_ID.match(room_id) or not os.path.isfile(replay.ReplayRecorder.path(room_id)):
+        raise HTTPException(status_code=404, detail="記録がありません")
+    return {
+        "room_id": room_id,
+        "recording": room_id in recorder.rooms,
+        "size": os.path.getsize(replay.ReplayRecorder.path(room_id)),
+        "keyframes": [t for t, _ in replay.read_index(room_id)]
+    }
+
+
+@router.get("/replay/{room_id}")
+def replay_stream(room_id: str, from_ms: int = Query(0, ge=0)):
+    """記録をバイナリのまま返す。from_ms を指定すると、その時刻以前で最も近い KEYFRAME から"""
+    if not replay.ROOM_ID.match(room_id) or not os.path.isfile(replay.ReplayRecorder.path(room_id)):
+        raise HTTPException(status_code=404, detail="記録がありません")
+    return StreamingResponse(
+        replay.stream_replay(room_id, from_ms),
+        media_type="application/octet-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
 
 # --- WebSocket Endpoint ---
 
+@router.websocket("/ws/spectate/{room_id}")
+async def spectate_websocket(websocket: WebSocket, room_id: str):
+    # 観戦は読み取り専用: 送られてきたメッセージは無視し、ロックや人数にも数えない
+    # （プロセス全体の接続数には数える）
+    if not admission.open_connection():
+        await reject_overloaded(websocket)
+        return
+    joined = False
+    try:
+        joined = await spectators.join(room_id, websocket)
+        if not joined:
+            return
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if joined:
+            spectators.leave(room_id, websocket)
+        admission.close_connection()
+
+
 @router.websocket("/ws/puzzle/{room_id}/{user_id}")
-async def puzzle_websocket(websocket: WebSocket, room_id: str, user_id: str):
-    await manager.connect(room_id, websocket, user_id)
-    
-    # DBからルーム情報を取得してホストを特定
+async def puzzle_websocket(websocket: WebSocket, room_id: str, user_id: str, token: str = Query(None)):
+    # ブラウザの WebSocket はヘッダを付けられないので、トークンはクエリで受け取る
+    # URL の user_id がトークンの本人と一致しなければ接続を拒否
+    user = session_tokens.verify_token(token)
+    if not user or user["id"] != user_id:
+        # 受け入れる前に閉じるとハンドシェイクが 403 になり、ブラウザには 1006 しか届かない
+        await websocket.accept()
+        await websocket.close(code=4401)
+        return
+
+    # ルーム情報は受け入れ前に取得し、定員を覚えておく
+    room_error = False
     try:
-        room_data = supabase.table("rooms").select("host_user_id, difficulty, image_url").eq("id", room_id).single().execute()
-        creator_id = room_data.data.get("host_user_id") if room_data.data else None
+        room_data = await run_in_threadpool(repo.get_room, room_id)
+    except Exception as e:
+        print(f"Error fetching room creator: {e}")
+        room_data = None
+        room_error = True
+    if room_data:
+        admission.register(room_id, room_data.get("max_players"))
+
+    if not await manager.connect(room_id, websocket, user_id):
+        return
+    
+    # DBのルーム情報からホストを特定
+    if room_error:
+        game_state.init_room(room_id, user_id)  # フォールバック
+    else:
+        creator_id = room_data.get("host_user_id") if room_data else None
         
         # 難易度を初期化時に保存
-        if room_data.data:
-            if room_data.data.get("difficulty"):
-                game_state.set_difficulty(room_id, room_data.data.get("difficulty"))
-            if room_data.data.get("image_url"):
-                game_state.set_image(room_id, room_data.data.get("image_url"))
+        if room_data:
+            if room_data.get("difficulty"):
+                game_state.set_difficulty(room_id, room_data.get("difficulty"))
+            if room_data.get("image_url"):
+                game_state.set_image(room_id, room_data.get("image_url"))
             
         game_state.init_room(room_id, creator_id)  # DBのホストを使用
-    except Exception as e:
-        print(f"Error fetching room creator: {e}")
-        game_state.init_room(room_id, user_id)  # フォールバック
+    await recorder.open(room_id)
+    conn = manager.heartbeat.register(websocket, room_id, user_id)
     
     try:
         while True:
             data = await websocket.receive_text()
             payload = json.loads(data)
             msg_type = payload.get("type")
+            manager.heartbeat.touch(websocket, activity=(msg_type != "PONG"))
+            # 持っているロックは、本人から何か届いている間（PONG・CURSOR・HOLD も含む）延長する
+            leases.renew(room_id, user_id)
             
-            if msg_type == "JOIN":
+            if msg_type in ("PONG", "HOLD"):
+                continue
+
+            elif msg_type == "JOIN":
                 # ホストかどうかを通知
                 is_host = (game_state.get_host(room_id) == user_id)
                 await websocket.send_text(json.dumps({
@@ -229,17 +419,8 @@ async def puzzle_websocket(websocket: WebSocket, room_id: str, user_id: str):
                 # 他のメンバーに通知
                 count = manager.get_member_count(room_id)
                 # ユーザー名取得
-                try:
-                    from .user import supabase
-                    # user_idが有効なUUIDかどうかチェックすべきだが、ここでは簡易的にDB参照
-                    user_data = supabase.table("users").select("username").eq("id", user_id).single().execute()
-                    if user_data.data and user_data.data.get("username"):
-                         username = user_data.data.get("username")
-                    else:
-                         username = f"Guest_{user_id[:4]}"
-                except Exception as e:
-                    print(f"Username fetch error: {e}")
-                    username = f"Guest_{user_id[:4]}"
+                username = await fetch_username(user_id)
+                presence.join(room_id, user_id, username)
                 
                 await manager.broadcast(room_id, {
                     "type": "PLAYER_JOINED", 
@@ -278,6 +459,14 @@ async def puzzle_websocket(websocket: WebSocket, room_id: str, user_id: str):
                         "image_url": current_image
                     }))
 
+                # これまでのチャットをまとめて送る
+                backlog = await chat_history.backlog(room_id)
+                if backlog:
+                    await websocket.send_text(json.dumps({
+                        "type": "CHAT_BACKLOG",
+                        "messages": backlog
+                    }))
+
             elif msg_type == "SET_IMAGE":
                 url = payload.get("image_url")
                 # 既に同じ画像が設定済みなら無視（重複送信防止）
@@ -286,6 +475,7 @@ async def puzzle_websocket(websocket: WebSocket, room_id: str, user_id: str):
                     continue
                     
                 game_state.set_image(room_id, url)
+                recorder.image(room_id, url)
                 await manager.broadcast(room_id, {
                     "type": "IMAGE_SET", 
                     "image_url": url
@@ -298,10 +488,11 @@ async def puzzle_websocket(websocket: WebSocket, room_id: str, user_id: str):
                 initial_pieces = payload.get("pieces") # List[{index, x, y, rotation}]
                 
                 # ゲーム開始時刻を記録（タイマー同期用）
-                import time
                 start_timestamp = int(time.time())
                 
                 game_state.start_game(room_id, initial_pieces, start_timestamp)
+                interest.reset_pieces(room_id, initial_pieces)
+                recorder.start(room_id, initial_pieces, start_timestamp)
                 
                 await manager.broadcast(room_id, {
                     "type": "GAME_STARTED",
@@ -312,6 +503,8 @@ async def puzzle_websocket(websocket: WebSocket, room_id: str, user_id: str):
             elif msg_type == "GRAB":
                 idx = payload.get("index")
                 if game_state.lock_piece(room_id, idx, user_id):
+                    recorder.lock(room_id, idx, user_id)
+                    leases.grant(room_id, idx, user_id)
                     await manager.broadcast(room_id, {
                         "type": "LOCKED",
                         "index": idx,
@@ -329,13 +522,21 @@ async def puzzle_websocket(websocket: WebSocket, room_id: str, user_id: str):
                 y = payload.get("y")
                 rotation = payload.get("rotation")
                 
-                game_state.update_piece(room_id, idx, x, y, rotation, user_id)
+                if not game_state.update_piece(room_id, idx, x, y, rotation, user_id):
+                    # ロックを持っていない（リースが切れた等）-> 反映されていないので誰にも送らない
+                    continue
+                recorder.move(room_id, idx, x, y, rotation)
                 
                 # *自分以外* にブロードキャストしたいが、broadcastメソッドは全員に送る
                 # クライアント側で「自分のIDのメッセージは無視」するか、
                 # broadcastメソッドを改造して exclude_socket を受け取れるようにするか。
-                # ここでは全員に送り、クライアントでフィルタリングする。
-                await manager.broadcast(room_id, {
+                # ここでは (視野内の) 全員に送り、クライアントでフィルタリングする。
+                piece = game_state.get_piece(room_id, idx)
+                targets = interest.recipients(
+                    room_id, manager.active_connections.get(room_id, []), idx, x, y,
+                    grouped=bool(piece and len(piece["group"]) > 1)
+                )
+                await manager.send_to(targets, {
                     "type": "MOVED",
                     "index": idx,
                     "x": x,
@@ -350,9 +551,13 @@ async def puzzle_websocket(websocket: WebSocket, room_id: str, user_id: str):
                 y = payload.get("y")
                 rotation = payload.get("rotation")
                 
-                # 最終位置更新してからアンロック
-                game_state.update_piece(room_id, idx, x, y, rotation, user_id)
+                # 最終位置更新してからアンロック（ロックを持っていなければ何も送らない）
+                if not game_state.update_piece(room_id, idx, x, y, rotation, user_id):
+                    continue
                 game_state.unlock_piece(room_id, idx, user_id)
+                leases.release(room_id, idx, user_id)
+                interest.synced(room_id, idx, x, y)
+                recorder.unlock(room_id, idx, x, y, rotation)
                 
                 await manager.broadcast(room_id, {
                     "type": "UNLOCKED",
@@ -362,12 +567,43 @@ async def puzzle_websocket(websocket: WebSocket, room_id: str, user_id: str):
                     "rotation": rotation
                 })
 
+            elif msg_type == "VIEWPORT":
+                # 表示範囲（ワールド座標）の報告。新しく見えた範囲で見逃していたピースを送る
+                try:
+                    rect = [float(payload[k]) for k in ("x", "y", "w", "h")]
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if not all(map(math.isfinite, rect)) or rect[2] < 0 or rect[3] < 0:
+                    continue
+                catch_up = interest.set_viewport(room_id, websocket, *rect)
+                if catch_up:
+                    pieces = []
+                    for idx in catch_up:
+                        p = game_state.get_piece(room_id, idx)
+                        if p:
+                            pieces.append({"index": idx, "x": p["x"], "y": p["y"], "rotation": p["rotation"]})
+                    await websocket.send_text(json.dumps({
+                        "type": "CATCH_UP",
+                        "pieces": pieces
+                    }))
+
+            elif msg_type == "CURSOR":
+                # カーソル位置（ワールド座標）。最新の値で上書きするだけで、ここでは送らない
+                x = payload.get("x")
+                y = payload.get("y")
+                if not isinstance(x, (int, float)) or not isinstance(y, (int, float)):
+                    continue
+                if not (math.isfinite(x) and math.isfinite(y)):
+                    continue
+                presence.update(room_id, user_id, round(x), round(y))
+
             elif msg_type == "MERGE":
                 # 結合イベント
                 p1 = payload.get("piece1_index")
                 p2 = payload.get("piece2_index")
                 
                 game_state.merge_groups(room_id, p1, p2)
+                recorder.merge(room_id, p1, p2)
                 
                 await manager.broadcast(room_id, {
                     "type": "MERGED",
@@ -384,31 +620,30 @@ async def puzzle_websocket(websocket: WebSocket, room_id: str, user_id: str):
                     continue
                 
                 # ユーザー名を取得
-                from .user import supabase
-                try:
-                    user_data = supabase.table("users").select("username").eq("id", user_id).single().execute()
-                    if user_data.data and user_data.data.get("username"):
-                         username = user_data.data.get("username")
-                    else:
-                         username = f"Guest_{user_id[:4]}"
-                except Exception as e:
-                    print(f"Username fetch error (CHAT): {e}")
-                    username = f"Guest_{user_id[:4]}"
+                username = await fetch_username(user_id)
                 
-                import time
                 timestamp = int(time.time() * 1000)  # ミリ秒
                 
-                # ルーム全体にブロードキャスト
-                await manager.broadcast(room_id, {
-                    "type": "CHAT",
+                chat_message = {
                     "user_id": user_id,
                     "username": username,
                     "message": message_text,
                     "timestamp": timestamp
-                })
+                }
+                chat_history.add(room_id, chat_message)
+
+                # ルーム全体にブロードキャスト
+                await manager.broadcast(room_id, {"type": "CHAT", **chat_message})
                 
-    except WebSocketDisconnect:
+    except (WebSocketDisconnect, asyncio.CancelledError) as e:
+        if isinstance(e, asyncio.CancelledError):
+            # 生存確認で切断と判断された場合だけ退出処理を行う（サーバー停止時のキャンセルはそのまま）
+            if not conn.expired:
+                raise
+            asyncio.current_task().uncancel()
+        manager.heartbeat.unregister(websocket)
         manager.disconnect(room_id, websocket, user_id)
+        interest.remove(room_id, websocket)
         
         # ホストが退出した場合、ルームを即座に閉じる
         is_host = (game_state.get_host(room_id) == user_id)
@@ -421,15 +656,18 @@ async def puzzle_websocket(websocket: WebSocket, room_id: str, user_id: str):
                 "message": "ホストが退出したためルームが解散されました"
             })
             
-            # データベースから削除
-            try:
-                from .room import supabase
-                supabase.table("rooms").delete().eq("id", room_id).execute()
-            except Exception as e:
-                print(f"Error deleting room from DB: {e}")
+            # データベースからの削除（メンバー・画像も含む）はバックグラウンドで行う
+            jobs.enqueue("delete_room", room_id)
 
-            # メモリ上のルームデータを削除
+            # 記録を閉じてから（最後の状態を書くため）メモリ上のルームデータを削除
+            recorder.close(room_id)
             game_state.cleanup_room(room_id)
+            interest.cleanup_room(room_id)
+            chat_history.drop_room(room_id)
+            leases.drop_room(room_id)
+            presence.drop_room(room_id)
+            admission.drop_room(room_id)
+            await spectators.close_room(room_id, "ホストが退出したためルームが解散されました")
             
             # 残っている接続を強制切断する処理があればここで実行したいが、
             # ConnectionManager側で管理しているなら、broadcast後に接続を切る等の処理が必要かも。
@@ -437,22 +675,17 @@ async def puzzle_websocket(websocket: WebSocket, room_id: str, user_id: str):
             
         else:
             # 通常の退出（ゲスト）
+            presence.leave(room_id, user_id)
+            # 持ったまま切断したピースのロックを外す
+            for idx in leases.release_user(room_id, user_id):
+                await force_unlock(room_id, idx, user_id)
+
             # ユーザー名取得 (DB削除前に取得しておく)
-            try:
-                from .user import supabase
-                user_data = supabase.table("users").select("username").eq("id", user_id).single().execute()
-                if user_data.data and user_data.data.get("username"):
-                     username = user_data.data.get("username")
-                else:
-                     username = f"Guest_{user_id[:4]}"
-            except Exception as e:
-                print(f"Username fetch error (LEFT): {e}")
-                username = f"Guest_{user_id[:4]}"
+            username = await fetch_username(user_id)
 
             # DBからメンバー削除
             try:
-                from .room import supabase
-                supabase.table("room_members").delete().eq("room_id", room_id).eq("user_id", user_id).execute()
+                await run_in_threadpool(repo.remove_member, room_id, user_id)
             except Exception as e:
                 print(f"Error deleting member from DB: {e}")
 
@@ -464,3 +697,10 @@ async def puzzle_websocket(websocket: WebSocket, room_id: str, user_id: str):
                 "username": username,
                 "count": count
             })
+    finally:
+        # 想定外の例外で抜けた場合も、送信先・生存確認・席と接続数は必ず返す（2回目以降は何もしない）
+        manager.heartbeat.unregister(websocket)
+        manager.disconnect(room_id, websocket, user_id)
+        if manager.get_member_count(room_id) == 0:
+            # 誰もいなくなったルームの記録はバッファを手放す（また接続があれば追記で再開する）
+            recorder.close(room_id, end=False)
@@ -1,10 +1,20 @@
 # routers/puzzle.py
-from fastapi import APIRouter, HTTPException, UploadFile, File
+from fastapi import APIRouter, HTTPException, UploadFile, File, Query
+from fastapi.responses import FileResponse, JSONResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List
-from database import supabase
-
-router = APIRouter()
+import os
+from database import repo
+import atlas
+import resize
+import uploads
+import jobs
+from leaderboard import leaderboards
+import tracing
+from tracing import TracedRoute
+
+router = APIRouter(route_class=TracedRoute)
 
 # --- Pydantic データモデル ---
 class PieceState(BaseModel):
@@ -30,66 +40,34 @@ class CreateSessionRequest(BaseModel):
 
 @router.get("/masters")
 def get_puzzle_masters(user_id: str = None):
-    query = supabase.table("puzzle_masters").select("*")
-    if user_id:
-        query = query.eq("user_id", user_id)
-    res = query.execute()
-    return res.data
+    masters = repo.list_puzzle_masters(user_id)
+    return [m for m in masters if not jobs.is_pending("delete_puzzle", m["id"])]
 
 @router.get("/history/{user_id}")
 def get_user_history(user_id: str):
-    res = supabase.table("single_sessions")\
-        .select("*, puzzle_masters(title, image_url)")\
-        .eq("user_id", user_id)\
-        .order("updated_at", desc=True)\
-        .execute()
-    return res.data
+    sessions = repo.list_user_sessions(user_id)
+    # 削除処理待ちのセッション・パズルは除外
+    return [s for s in sessions
+            if not jobs.is_pending("delete_session", s["id"])
+            and not jobs.is_pending("delete_puzzle", s["puzzle_id"])]
 
 @router.post("/session")
 def create_session(req: CreateSessionRequest):
     # 難易度も保存する
-    session_data = {
-        "user_id": req.user_id, 
-        "puzzle_id": req.puzzle_id, 
-        "difficulty": req.difficulty,
-        "elapsed_time": 0
-    }
-    res = supabase.table("single_sessions").insert(session_data).execute()
-    if not res.data: raise HTTPException(status_code=500, detail="Failed to create session")
-    if not res.data: raise HTTPException(status_code=500, detail="Failed to create session")
-    return res.data[0]
+    res = repo.create_session(req.user_id, req.puzzle_id, req.difficulty)
+    if not res: raise HTTPException(status_code=500, detail="Failed to create session")
+    return res
 
 @router.get("/best")
 def get_best_time(user_id: str, puzzle_id: int, difficulty: str):
     # 自己ベスト（最短時間）を取得
-    res = supabase.table("single_sessions")\
-        .select("elapsed_time")\
-        .eq("user_id", user_id)\
-        .eq("puzzle_id", puzzle_id)\
-        .eq("difficulty", difficulty)\
-        .eq("is_completed", True)\
-        .order("elapsed_time", desc=False)\
-        .limit(1)\
-        .execute()
-    
-    if res.data and len(res.data) > 0:
-        return {"best_time": res.data[0]["elapsed_time"]}
-    if res.data and len(res.data) > 0:
-        return {"best_time": res.data[0]["elapsed_time"]}
-    else:
-        return {"best_time": None}
+    return {"best_time": repo.best_session_time(user_id, puzzle_id, difficulty)}
 
 @router.get("/best_times/{user_id}")
 def get_user_best_times(user_id: str):
     # ユーザーの全完了データを取得して、パズル・難易度ごとのベストタイムを算出
-    res = supabase.table("single_sessions")\
-        .select("puzzle_id, difficulty, elapsed_time")\
-        .eq("user_id", user_id)\
-        .eq("is_completed", True)\
-        .execute()
-    
     bests = {}
-    for item in res.data:
+    for item in repo.list_completed_times(user_id):
         # キーを一意にする (puzzle_id + difficulty)
         # default difficulty handling if needed
         diff = item.get('difficulty') or 'normal' 
@@ -101,100 +79,127 @@ def get_user_best_times(user_id: str):
             
     return bests
 
+# --- ランキング ---
+# 起動時に構築したメモリ上のインデックスから返す（DB は見ない）
+
+MAX_LEADERBOARD_LIMIT = 100
+
+@router.get("/leaderboards")
+def get_leaderboards(puzzle_ids: str, difficulty: str = "normal", limit: int = Query(3, ge=1, le=10)):
+    # ギャラリーのカード用: 複数パズルの上位をまとめて返す (puzzle_ids はカンマ区切り)
+    try:
+        ids = [int(v) for v in puzzle_ids.split(",") if v.strip()][:MAX_LEADERBOARD_LIMIT]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="puzzle_ids は数値のカンマ区切りで指定してください")
+    return {str(pid): leaderboards.page(pid, difficulty, 0, limit) for pid in ids}
+
+@router.get("/leaderboard/{puzzle_id}")
+def get_leaderboard(puzzle_id: int, difficulty: str = "normal",
+                    offset: int = Query(0, ge=0), limit: int = Query(10, ge=1, le=MAX_LEADERBOARD_LIMIT)):
+    # 上位 K 件 (offset=0) またはページ単位の取得
+    return leaderboards.page(puzzle_id, difficulty, offset, limit)
+
+@router.get("/leaderboard/{puzzle_id}/rank")
+def get_leaderboard_rank(puzzle_id: int, user_id: str, difficulty: str = "normal"):
+    # ユーザーの順位
+    return leaderboards.rank_of(puzzle_id, difficulty, user_id)
+
+# --- ピースのスプライトアトラス ---
+# (画像, 難易度) ごとに全ピースを1枚にまとめた PNG を返す。
+# ルームの全員が同じアトラスをダウンロードするだけでよく、クライアントでのピース生成が不要になる
+@router.get("/atlas")
+def get_piece_atlas(image_url: str, difficulty: str = "normal"):
+    meta = atlas.get_atlas(image_url, difficulty)
+    # URL の中身が差し替えられる可能性があるので、メタデータは短めにキャッシュ
+    return JSONResponse(content=meta, headers={"Cache-Control": "public, max-age=300"})
+
+@router.get("/atlas/{key}.png")
+def get_piece_atlas_image(key: str):
+    path = atlas.atlas_file(key)
+    if not path:
+        raise HTTPException(status_code=404, detail="Atlas not found")
+    # key は画像の content hash を含むので中身は変わらない
+    return FileResponse(path, media_type="image/png", headers={
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "ETag": f'"{key}"'
+    })
+
+# --- 縮小画像 (一覧・ギャラリーのサムネイル用) ---
+@router.get("/image")
+async def get_resized_image(url: str, width: int = 240, fmt: str = Query("webp", alias="format"), quality: int = 80):
+    path, media_type = await resize.get_resized(url, width, fmt, quality)
+    # 元画像が content hash 名なら中身は変わらない
+    immutable = "/uploads/" in url and len(os.path.basename(url).split(".")[0]) == 64
+    cache_control = "public, max-age=31536000, immutable" if immutable else "public, max-age=86400"
+    return FileResponse(path, media_type=media_type, headers={"Cache-Control": cache_control})
+
 @router.get("/session/{session_id}")
 def load_session(session_id: str):
-    session_res = supabase.table("single_sessions")\
-        .select("*, puzzle_masters(*)")\
-        .eq("id", session_id).single().execute()
-    if not session_res.data: raise HTTPException(status_code=404, detail="Session not found")
+    session = repo.get_session(session_id)
+    if not session: raise HTTPException(status_code=404, detail="Session not found")
     
-    pieces_res = supabase.table("single_session_pieces")\
-        .select("*").eq("session_id", session_id).execute()
+    pieces = repo.list_pieces(session_id)
     
-    return {"session": session_res.data, "pieces": pieces_res.data}
+    return {"session": session, "pieces": pieces}
 
 @router.post("/session/{session_id}/save")
 def save_session(session_id: str, req: SaveSessionRequest):
     # 1. セッション情報の更新
-    supabase.table("single_sessions").update({
-        "elapsed_time": req.elapsed_time,
-        "is_completed": req.is_completed,
-        "updated_at": "now()"
-    }).eq("id", session_id).execute()
+    with tracing.span("session"):
+        repo.update_session(session_id, req.elapsed_time, req.is_completed)
 
     # 2. ピース情報の保存 (Upsert)
     if req.pieces:
-        pieces_data = []
-        for p in req.pieces:
-            pieces_data.append({
-                "session_id": session_id,
-                "piece_index": p.piece_index,
-                "x": p.x, "y": p.y, "rotation": p.rotation,
-                "is_locked": p.is_locked, "group_id": p.group_id
-            })
-        supabase.table("single_session_pieces").upsert(pieces_data).execute()
+        with tracing.span("pieces"):
+            pieces_data = []
+            for p in req.pieces:
+                pieces_data.append({
+                    "session_id": session_id,
+                    "piece_index": p.piece_index,
+                    "x": p.x, "y": p.y, "rotation": p.rotation,
+                    "is_locked": p.is_locked, "group_id": p.group_id
+                })
+            repo.upsert_pieces(pieces_data)
 
     # 3. ベストタイム更新 (クリア時のみ)
     if req.is_completed:
-        # セッションからパズルIDと難易度を取得
-        current_session = supabase.table("single_sessions").select("puzzle_id, difficulty").eq("id", session_id).single().execute()
-        if current_session.data:
-            p_id = current_session.data['puzzle_id']
-            diff = current_session.data['difficulty'] or 'normal'
-            
-            # 現在のベストを取得
-            current_best_rec = supabase.table("user_best_records")\
-                .select("elapsed_time")\
-                .eq("user_id", req.user_id)\
-                .eq("puzzle_id", p_id)\
-                .eq("difficulty", diff)\
-                .single().execute()
-            
-            should_update = False
-            if not current_best_rec.data:
-                should_update = True # レコードなし
-            elif req.elapsed_time < current_best_rec.data['elapsed_time']:
-                should_update = True # 新記録
-            
-            if should_update:
-                supabase.table("user_best_records").upsert({
-                    "user_id": req.user_id,
-                    "puzzle_id": p_id,
-                    "difficulty": diff,
-                    "elapsed_time": req.elapsed_time,
-                    "updated_at": "now()"
-                }).execute()
+        with tracing.span("best_record"):
+            # セッションからパズルIDと難易度を取得
+            current_session = repo.get_session(session_id)
+            if current_session:
+                p_id = current_session['puzzle_id']
+                diff = current_session['difficulty'] or 'normal'
+                
+                # 現在のベストを取得
+                current_best_rec = repo.get_best_record(req.user_id, p_id, diff)
+                
+                should_update = False
+                if not current_best_rec:
+                    should_update = True # レコードなし
+                elif req.elapsed_time < current_best_rec['elapsed_time']:
+                    should_update = True # 新記録
+                
+                if should_update:
+                    repo.upsert_best_record(req.user_id, p_id, diff, req.elapsed_time)
+                    # ランキング (メモリ上のインデックス) にも反映
+                    leaderboards.record(req.user_id, p_id, diff, req.elapsed_time)
 
     return {"status": "saved"}
 
 @router.post("/upload")
 async def upload_puzzle(user_id: str, file: UploadFile = File(...)):
+    # 1. ストリーミングで受け取り、内容のハッシュ名でローカルに保存（サイズ上限もここでチェック）
+    stored = await uploads.store_upload(file)
     try:
-        # 1. 保存パスの作成
-        file_path = f"{user_id}/{file.filename}"
-        file_content = await file.read()
-        
-        # 2. Storage へのアップロード
-        supabase.storage.from_("puzzles").upload(
-            path=file_path,
-            file=file_content,
-            file_options={"content-type": file.content_type, "x-upsert": "true"}
-        )
-
+        # 2. Storage へのアップロード（同じ内容なら送信しない）
         # 3. 公開URLの取得
-        image_url = supabase.storage.from_("puzzles").get_public_url(file_path)
+        image_url = await uploads.push_to_storage(stored)
         
         # 4. puzzle_masters テーブルへ登録
         # get_public_url は文字列(URL)を返す仕様だが、念のためstr変換
-        data = {
-            "user_id": user_id,
-            "image_url": str(image_url),
-            "title": file.filename
-        }
-        
-        db_res = supabase.table("puzzle_masters").insert(data).execute()
+        puzzle = await run_in_threadpool(repo.create_puzzle_master, user_id, str(image_url), file.filename)
         
-        return {"status": "success", "puzzle": db_res.data[0]}
+        return {"status": "success", "puzzle": puzzle}
 
     except Exception as e:
         # Supabase(PostgREST)からのエラーレスポンスを解析
@@ -215,29 +220,13 @@ async def upload_puzzle(user_id: str, file: UploadFile = File(...)):
 
 @router.delete("/{puzzle_id}")
 async def delete_puzzle(puzzle_id: int):
-    # 関連するセッションやピースはDBの CASCADE 設定で消えるようにします
-    # ...が、DB側でCASCADE設定されていない場合のエラー回避のため、
-    # 明示的に関連データを削除してからパズルマスターを削除します。
-    
-    # セッション削除 (関連するピースはCascadeまたは個別削除が必要だが、まずはセッション消去)
-    supabase.table("single_sessions").delete().eq("puzzle_id", puzzle_id).execute()
-
-    # まず画像URLを取得してStorageからも消す（任意）
-    puzzle = supabase.table("puzzle_masters").select("image_url").eq("id", puzzle_id).single().execute()
-    
-    # DBから削除
-    supabase.table("puzzle_masters").delete().eq("id", puzzle_id).execute()
-    
+    # セッション・ピース・Storage の画像・パズル本体の削除はバックグラウンドで連鎖的に行う
+    # (処理待ちの間も一覧には出さない)
+    jobs.enqueue("delete_puzzle", puzzle_id)
     return {"status": "deleted"}
 
 @router.delete("/session/{session_id}")
 async def delete_session(session_id: str):
-    # セッション削除（関連するピースはCascade設定があれば消えるが、念のため確認）
-    # Supabaseのテーブル定義で ON DELETE CASCADE になっていることを想定
-    res = supabase.table("single_sessions").delete().eq("id", session_id).execute()
-    
-    if not res.data:
-        # IDが見つからない場合など
-        raise HTTPException(status_code=404, detail="Session not found or already deleted")
-        
-    return {"status": "deleted"}
\ No newline at end of file
+    # セッションとそのピースはバックグラウンドで削除する
+    jobs.enqueue("delete_session", session_id)
+    return {"status": "deleted"}
@@ -1,9 +1,13 @@
 from fastapi import APIRouter, Form, HTTPException, Depends, UploadFile, File
-from database import supabase
+from database import repo
 from routers.user import get_current_user
 import uuid
+import uploads
+import jobs
+from multiplay.admission import admission, ADMISSION_RETRY_AFTER
+from tracing import TracedRoute
 
-router = APIRouter()
+router = APIRouter(route_class=TracedRoute)
 
 @router.post("/create")
 def create_room(
@@ -27,46 +31,39 @@ def create_room(
         "image_url": image_url # 追加 (DBカラム作成済み)
     }
 
-    result = supabase.table("rooms").insert(data).execute()
+    result = repo.create_room(data)
 
-    if not result.data:
+    if not result:
         raise HTTPException(status_code=500, detail="ルーム作成失敗")
 
+    # 定員をメモリ上で管理する（参加・接続のたびに DB で人数を数えない）
+    admission.register(room_id, max_players)
+    admission.reserve(room_id, current_user["id"], force=True)
+
     # 作成者を room_members に追加
-    supabase.table("room_members").insert({
-        "id": str(uuid.uuid4()),
-        "room_id": room_id,
-        "user_id": current_user["id"]
-    }).execute()
+    repo.add_member(room_id, current_user["id"])
 
     return {"message": "ルーム作成成功", "room_id": room_id}
 
 @router.get("/list")
 def get_rooms():
-    # difficulty, image_url も取得
-    rooms_result = supabase.table("rooms").select(
-        "id, name, max_players, password, difficulty, image_url"
-    ).execute()
+    # difficulty, image_url と参加人数もまとめて取得
+    rooms_result = repo.list_rooms_with_counts()
 
-    if not rooms_result.data:
+    if not rooms_result:
         return {"rooms": []}
 
     rooms = []
 
-    for room in rooms_result.data:
-        # 参加人数を数える
-        members_result = supabase.table("room_members") \
-            .select("id", count="exact") \
-            .eq("room_id", room["id"]) \
-            .execute()
-
-        current_players = members_result.count or 0
-
+    for room in rooms_result:
+        # 解散済み（削除処理待ち）のルームは出さない
+        if jobs.is_pending("delete_room", room["id"]):
+            continue
         rooms.append({
             "id": room["id"],
             "name": room["name"],
             "max_players": room["max_players"],
-            "current_players": current_players,
+            "current_players": room["current_players"],
             # difficultyにはピース数("25"など)が入る想定
             "difficulty": room.get("difficulty", "normal"),
             "image_url": room.get("image_url"), # 追加
@@ -81,65 +78,59 @@ def join_room(
     room_id: str = Form(...),
     current_user=Depends(get_current_user)
 ):
-    # すでに参加しているか確認
-    exists = supabase.table("room_members") \
-        .select("id") \
-        .eq("room_id", room_id) \
-        .eq("user_id", current_user["id"]) \
-        .execute()
+    # サーバーが混み合っていれば、WebSocket で断られる前にここで再試行を促す
+    if admission.overloaded():
+        raise HTTPException(
+            status_code=503,
+            detail="サーバーが混み合っています。しばらくしてから再度お試しください",
+            headers={"Retry-After": str(ADMISSION_RETRY_AFTER)}
+        )
+
+    # 定員を覚えていないルーム（再起動後など）だけ DB から取得する
+    if not admission.knows(room_id):
+        room = repo.get_room(room_id)
+        if not room:
+            raise HTTPException(status_code=404, detail="ルームが存在しません")
+        admission.register(room_id, room.get("max_players"))
 
-    if exists.data:
+    # すでに参加しているか確認
+    if repo.is_member(room_id, current_user["id"]):
+        admission.reserve(room_id, current_user["id"], force=True)
         return {"message": "すでに参加しています"}
 
+    # 定員の確認と席の確保を同時に行う（同時に参加しても定員を超えない）
+    if not admission.reserve(room_id, current_user["id"]):
+        raise HTTPException(status_code=409, detail="ルームが満員です")
+
     # 参加登録
-    supabase.table("room_members").insert({
-        "id": str(uuid.uuid4()),
-        "room_id": room_id,
-        "user_id": current_user["id"]
-    }).execute()
+    try:
+        repo.add_member(room_id, current_user["id"])
+    except Exception:
+        admission.cancel(room_id, current_user["id"])
+        raise
 
     return {"message": "ルーム参加成功"}
 
 @router.get("/wait/info")
 def get_room_wait_info(room_id: str):
-    room = supabase.table("rooms") \
-        .select("id, name, difficulty") \
-        .eq("id", room_id) \
-        .single() \
-        .execute()
+    room = repo.get_room(room_id)
 
-    if not room.data:
+    if not room:
         raise HTTPException(status_code=404, detail="ルームが存在しません")
 
-    members = supabase.table("room_members") \
-        .select("user_id") \
-        .eq("room_id", room_id) \
-        .execute()
+    members = repo.list_members(room_id)
 
     return {
-        "room": room.data,
-        "members": members.data
+        "room": {"id": room["id"], "name": room["name"], "difficulty": room.get("difficulty")},
+        "members": members
     }
 
 
 @router.post("/upload")
 async def upload_room_image(file: UploadFile = File(...)):
-    # 保存先ディレクトリ (frontend/static/uploads)
-    # ※ 本来は main.py の frontend_path を参照したいが、簡易的に相対パス算出
-    import os
-    import shutil
-    
-    # backend/routers/room.py -> backend/routers -> backend -> jigsaw_project -> frontend
-    base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    upload_dir = os.path.join(base_dir, "frontend", "uploads")
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    # ファイル名 (衝突防止のためUUID付与推奨だが、今回は簡易実装)
-    file_name = f"{uuid.uuid4()}_{file.filename}"
-    file_path = os.path.join(upload_dir, file_name)
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # 保存先は frontend/uploads (/static/uploads として公開)
+    # ファイル名は内容のハッシュなので、同じ画像は重複して保存されない
+    stored = await uploads.store_upload(file)
         
     # URLを返す
-    return {"url": f"/static/uploads/{file_name}"}
+    return {"url": stored.url}
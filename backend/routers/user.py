@@ -1,58 +1,28 @@
 # routers/user.py
 from fastapi import APIRouter, Form, HTTPException
-import bcrypt
-from database import supabase
+from starlette.concurrency import run_in_threadpool
+from database import repo
+import passwords
+import session_tokens
 import uuid
+from tracing import TracedRoute
 
-router = APIRouter()
-
-# ✅ パスワードをハッシュ化
-def get_password_hash(password: str):
-    # bcryptはbytesを扱うためエンコード
-    pwd_bytes = password.encode('utf-8')
-    
-    # 🔒 bcryptの72byte制限チェック
-    if len(pwd_bytes) > 72:
-        raise HTTPException(
-            status_code=400,
-            detail="パスワードは72バイト以内で入力してください"
-        )
-    
-    # ソルトを生成してハッシュ化
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(pwd_bytes, salt)
-    return hashed.decode('utf-8')
-
-
-# ✅ パスワード検証
-def verify_password(plain_password: str, hashed_password: str):
-    try:
-        if not hashed_password: return False
-        return bcrypt.checkpw(
-            plain_password.encode('utf-8'), 
-            hashed_password.encode('utf-8')
-        )
-    except ValueError:
-        return False
-
+router = APIRouter(route_class=TracedRoute)
 
 # ✅ ユーザー登録（サインアップ）
 @router.post("/signup")
 async def signup(username: str = Form(...), password: str = Form(...)):
     # すでに同じユーザー名が存在しないかチェック
-    existing = supabase.table("users").select("*").eq("username", username).execute()
-    if existing.data:
+    # DB アクセスも同期処理なので、イベントループを塞がないようスレッドで実行
+    existing = await run_in_threadpool(repo.get_user_by_username, username)
+    if existing:
         raise HTTPException(status_code=400, detail="このユーザー名は既に使われています")
 
-    # 🔐 ハッシュ化
-    password_hash = get_password_hash(password)
+    # 🔐 ハッシュ化（専用プールで実行。混雑時は 503）
+    password_hash = await passwords.hash_password(password)
     user_id = str(uuid.uuid4())
 
-    supabase.table("users").insert({
-        "id": user_id,
-        "username": username,
-        "password_hash": password_hash
-    }).execute()
+    await run_in_threadpool(repo.create_user, user_id, username, password_hash)
 
     return {"message": "ユーザー登録成功", "username": username}
 
@@ -60,16 +30,24 @@ async def signup(username: str = Form(...), password: str = Form(...)):
 # ✅ ログイン（サインイン）
 @router.post("/login")
 async def login(username: str = Form(...), password: str = Form(...)):
-    result = supabase.table("users").select("*").eq("username", username).execute()
+    user = await run_in_threadpool(repo.get_user_by_username, username)
 
-    if not result.data:
+    if not user:
         raise HTTPException(status_code=401, detail="ユーザー名またはパスワードが違います")
 
-    user = result.data[0]
-    if not verify_password(password, user["password_hash"]):
+    if not await passwords.verify_password(password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="ユーザー名またはパスワードが違います")
 
-    return {"message": "ログイン成功", "user_id": user["id"], "username": user["username"]}
+    # 以降の API / WebSocket はこのトークンで認証する（DB を参照せずに検証できる）
+    token = session_tokens.issue_token(user["id"], user["username"])
+
+    return {
+        "message": "ログイン成功",
+        "user_id": user["id"],
+        "username": user["username"],
+        "token": token,
+        "expires_in": session_tokens.SESSION_TOKEN_TTL
+    }
 
 
 @router.get("/")
@@ -82,9 +60,12 @@ def get_current_user(authorization: str = Header(None)):
     if not authorization:
         raise HTTPException(status_code=401, detail="未ログイン")
 
-    # 仮のユーザー（あとでJWTやSupabase認証に変える）
-    return {
-        "id": authorization,
-        "username": "test_user"
-    }
-
+    # 署名付きトークンをローカルで検証（DB 参照なし）
+    user = session_tokens.verify_token(session_tokens.token_from_header(authorization))
+    if not user:
+        raise HTTPException(
+            status_code=401,
+            detail="ログインの有効期限が切れました。再度ログインしてください",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    return user
@@ -0,0 +1,83 @@
+# session_tokens.py
+# ログイン時に発行する署名付きセッショントークン (JWT / HS256)
+# 検証はサーバー内の秘密鍵だけで完結するので、認証のたびに DB を見に行かない。
+# 一度検証したトークンは有効期限まで小さなキャッシュに入れ、署名検証も省略する。
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from database import SUPABASE_JWT_SECRET
+
+# Supabase 自体のトークンと混同されないよう audience を分ける
+TOKEN_AUDIENCE = "jigsaw-session"
+TOKEN_ALGORITHM = "HS256"
+# トークンの有効期間（秒）
+SESSION_TOKEN_TTL = int(os.getenv("SESSION_TOKEN_TTL", str(60 * 60 * 12)))
+# 検証済みトークンのキャッシュ件数
+VERIFIED_CACHE_SIZE = int(os.getenv("VERIFIED_TOKEN_CACHE_SIZE", "4096"))
+
+_secret = os.getenv("SESSION_SECRET") or SUPABASE_JWT_SECRET
+if not _secret:
+    # 秘密鍵が無い環境（ローカル開発など）ではプロセスごとの鍵を使う（再起動でトークンは無効になる）
+    print("SESSION_SECRET / SUPABASE_JWT_SECRET が未設定のため一時的な署名鍵を使用します")
+    _secret = secrets.token_urlsafe(32)
+
+# token -> (user dict, exp)
+_verified = OrderedDict()
+_verified_lock = threading.Lock()
+
+
+def issue_token(user_id: str, username: str) -> str:
+    now = int(time.time())
+    payload = {
+        "sub": user_id,
+        "name": username,
+        "aud": TOKEN_AUDIENCE,
+        "iat": now,
+        "exp": now + SESSION_TOKEN_TTL,
+    }
+    import jwt  # PyJWT (cryptography を読み込むので重い) は起動時ではなく初回に読み込む
+
+    return jwt.encode(payload, _secret, algorithm=TOKEN_ALGORITHM)
+
+
+def verify_token(token: str):
+    """トークンを検証して {"id", "username"} を返す。無効なら None"""
+    if not token:
+        return None
+    now = time.time()
+
+    with _verified_lock:
+        cached = _verified.get(token)
+        if cached:
+            user, exp = cached
+            if exp > now:
+                _verified.move_to_end(token)
+                return user
+            del _verified[token]
+
+    import jwt
+
+    try:
+        claims = jwt.decode(token, _secret, algorithms=[TOKEN_ALGORITHM], audience=TOKEN_AUDIENCE)
+    except jwt.PyJWTError:
+        return None
+
+    user = {"id": claims["sub"], "username": claims.get("name")}
+    with _verified_lock:
+        _verified[token] = (user, claims["exp"])
+        while len(_verified) > VERIFIED_CACHE_SIZE:
+            _verified.popitem(last=False)
+    return user
+
+
+def token_from_header(authorization: str):
+    """Authorization ヘッダ ("Bearer <token>") からトークン部分を取り出す"""
+    if not authorization:
+        return None
+    scheme, _, value = authorization.partition(" ")
+    if scheme.lower() == "bearer" and value:
+        return value.strip()
+    return None
@@ -0,0 +1,241 @@
+# static_files.py
+# フロントエンドの静的ファイル配信（キャッシュ対応版）
+# ・起動時に frontend/ を走査し、ETag・Content-Type・圧縮版をメモリに用意しておく
+#   （リクエストごとの os.path.exists / stat をなくす）
+#   アップロード画像 (uploads/) は数が増えるので起動時には読まず、初回アクセス時に登録する
+# ・HTML 内の /static/css, /static/js の参照には ?v=<ETag> を付けて配信し、
+#   バージョン付き URL と content hash 名のアップロード画像は immutable でキャッシュさせる
+# ・それ以外は ETag で再検証 (If-None-Match -> 304)
+#   ETag は圧縮方式ごとに別の値にする（"<hash>-br", "<hash>-gz"。RFC 9110 8.8.3）
+# ・gzip / br は起動時には作らず、そのファイルが最初に要求されたときに作って持っておく
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+from urllib.parse import parse_qs
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, JSONResponse, Response
+
+try:
+    import brotli  # 任意: インストールされていれば br も配信する
+except ImportError:
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# 圧縮方式ごとの ETag の接尾辞
+ETAG_SUFFIXES = {"": "", "br": "-br", "gzip": "-gz"}
+
+# 圧縮して配信するファイル
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+MIN_COMPRESS_SIZE = 512
+
+# バージョン付き URL を付ける対象ディレクトリ
+VERSIONED_DIRS = ("css/", "js/")
+# 起動時には読み込まないディレクトリ
+LAZY_DIR = "uploads"
+# content hash 名で保存されたアップロード画像 (uploads.py 参照)
+HASHED_UPLOAD = re.compile(r"^(static/)?uploads/[0-9a-f]{64}\.[a-z]+$")
+ASSET_REF = re.compile(r'((?:href|src)=")/static/((?:css|js)/[^"?#]+)(")')
+
+
+@dataclass
+class StaticEntry:
+    path: str
+    media_type: str
+    etag: str
+    # テキスト系はメモリに保持 (encoding -> body, "" は無圧縮)
+    bodies: Dict[str, bytes] = field(default_factory=dict)
+    compressed: bool = False
+
+    @property
+    def version(self) -> str:
+        return self.etag.strip('"')[:12]
+
+    def etag_for(self, encoding: str) -> str:
+        # etag は '"<hash>"' の形なので、閉じる引用符の前に接尾辞を入れる
+        return self.etag[:-1] + ETAG_SUFFIXES[encoding] + '"'
+
+    def ensure_compressed(self):
+        """圧縮版を（まだなら）作る。重いのでイベントループからはスレッドプール経由で呼ぶ"""
+        if not self.compressed:
+            self.bodies = _compress(self.bodies[""], self.media_type)
+            self.compressed = True
+
+
+def _compress(data: bytes, media_type: str) -> Dict[str, bytes]:
+    bodies = {"": data}
+    if len(data) < MIN_COMPRESS_SIZE or not media_type.startswith(COMPRESSIBLE_TYPES):
+        return bodies
+    gz = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(gz) < len(data):
+        bodies["gzip"] = gz
+    if brotli is not None:
+        br = brotli.compress(data)
+        if len(br) < len(data):
+            bodies["br"] = br
+    return bodies
+
+
+class StaticIndex:
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.entries: Dict[str, StaticEntry] = {}
+
+    # --- 構築 ---
+
+    def build(self):
+        """frontend/ 以下（uploads/ を除く）を読み込んでインデックスを作る（起動時に1回）"""
+        entries = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if dirpath == self.root and LAZY_DIR in dirnames:
+                dirnames.remove(LAZY_DIR)
+            for name in filenames:
+                full = os.path.join(dirpath, name)
+                rel = os.path.relpath(full, self.root).replace(os.sep, "/")
+                entry = self._load(full)
+                if entry:
+                    entries[rel] = entry
+
+        # HTML 内のアセット参照をバージョン付き URL に書き換える
+        for rel, entry in entries.items():
+            if entry.media_type == "text/html":
+                html = entry.bodies[""].decode("utf-8")
+                html = ASSET_REF.sub(lambda m: self._versioned_ref(m, entries), html)
+                data = html.encode("utf-8")
+                entry.etag = f'"{hashlib.sha256(data).hexdigest()[:32]}"'
+                entry.bodies = {"": data}
+
+        self.entries = entries
+        print(f"Static index built: {len(entries)} files")
+
+    @staticmethod
+    def _versioned_ref(m, entries):
+        target = entries.get(m.group(2))
+        if not target:
+            return m.group(0)
+        return f"{m.group(1)}/static/{m.group(2)}?v={target.version}{m.group(3)}"
+
+    def _load(self, full: str) -> Optional[StaticEntry]:
+        if not os.path.isfile(full) or full.endswith(".part"):
+            return None
+        media_type = mimetypes.guess_type(full)[0] or "application/octet-stream"
+        rel = os.path.relpath(full, self.root).replace(os.sep, "/")
+        if HASHED_UPLOAD.match(rel) and not media_type.startswith(COMPRESSIBLE_TYPES):
+            # ファイル名が内容のハッシュなので、読まずにそのまま ETag にする
+            return StaticEntry(path=full, media_type=media_type, etag=f'"{os.path.basename(full)[:32]}"')
+        with open(full, "rb") as f:
+            data = f.read()
+        entry = StaticEntry(
+            path=full,
+            media_type=media_type,
+            etag=f'"{hashlib.sha256(data).hexdigest()[:32]}"',
+        )
+        # 画像などはディスクから配信し、テキスト系だけメモリに持つ
+        if media_type.startswith(COMPRESSIBLE_TYPES):
+            entry.bodies = {"": data}
+        return entry
+
+    def needs_load(self, rel: str) -> bool:
+        """lookup がディスクを読むかどうか（読むならスレッドプールで呼ぶ）"""
+        return rel not in self.entries and rel.startswith(LAZY_DIR + "/")
+
+    def lookup(self, rel: str) -> Optional[StaticEntry]:
+        entry = self.entries.get(rel)
+        if entry:
+            return entry
+        # アップロード画像は初回アクセス時に登録する
+        if not rel.startswith(LAZY_DIR + "/"):
+            return None
+        full = os.path.abspath(os.path.join(self.root, rel))
+        if not full.startswith(self.root + os.sep):
+            return None
+        entry = self._load(full)
+        if entry:
+            self.entries[rel] = entry
+        return entry
+
+    # --- 配信 ---
+
+    def response(self, rel: str, request_headers: Headers, version: str = None):
+        entry = self.lookup(rel)
+        if not entry:
+            return None
+
+        # ?v= が現在の内容と一致する css/js、または content hash 名の画像だけ immutable
+        versioned = version == entry.version and rel.startswith(VERSIONED_DIRS)
+        if versioned or HASHED_UPLOAD.match(rel):
+            cache_control = IMMUTABLE
+        else:
+            cache_control = REVALIDATE
+        headers = {"Cache-Control": cache_control}
+
+        # 圧縮方式を先に決める（ETag は方式ごとに違い、304 にも Vary が要る）
+        encoding = ""
+        if entry.bodies:
+            headers["Vary"] = "Accept-Encoding"
+            entry.ensure_compressed()
+            accept = request_headers.get("accept-encoding", "")
+            encoding = next((e for e in ("br", "gzip") if e in entry.bodies and e in accept), "")
+        headers["ETag"] = entry.etag_for(encoding)
+
+        if headers["ETag"] in request_headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+
+        if not entry.bodies:
+            if not os.path.isfile(entry.path):
+                # 削除されたアップロード画像
+                self.entries.pop(rel, None)
+                return None
+            return FileResponse(entry.path, media_type=entry.media_type, headers=headers)
+
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(entry.bodies[encoding], media_type=entry.media_type, headers=headers)
+
+    def page(self, request, filename: str):
+        """画面 (HTML) を返す。無ければ従来通り 404 の JSON"""
+        res = self.response(filename, request.headers)
+        if res is None:
+            return JSONResponse(content={"error": f"{filename} が存在しません"}, status_code=404)
+        return res
+
+
+class CachedStaticFiles:
+    """StaticFiles の代わりに /static にマウントする ASGI アプリ"""
+
+    def __init__(self, index: StaticIndex):
+        self.index = index
+
+    async def __call__(self, scope, receive, send):
+        # マウント時は root_path に "/static" が入るので、それを除いた残りがファイルパス
+        path = scope["path"]
+        root_path = scope.get("root_path", "")
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        rel = path.lstrip("/")
+
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405)
+
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        version = query.get("v", [None])[0]
+        if self.index.needs_load(rel):
+            # 初回のアップロード画像はファイルを読むので、イベントループを止めないようスレッドで登録する
+            await run_in_threadpool(self.index.lookup, rel)
+        entry = self.index.entries.get(rel)
+        if entry and entry.bodies and not entry.compressed:
+            # 初回だけ圧縮版を作る（gzip -9 / br は重いのでスレッドで）
+            await run_in_threadpool(entry.ensure_compressed)
+        response = self.index.response(rel, Headers(scope=scope), version=version)
+        if response is None:
+            # main.py の 404 ハンドラ (error.html) に任せる
+            raise HTTPException(status_code=404)
+        await response(scope, receive, send)
@@ -0,0 +1,222 @@
+# tracing.py
+# リクエストごとの簡易トレース（外部の APM を使わずにどこが遅いかを見る）
+# ・TracingMiddleware がリクエストごとに Trace を作り、contextvars で処理中のコードから参照できるようにする
+#   （同期エンドポイントはスレッドプールで動くが、contextvars はスレッドへ引き継がれる）
+# ・TracedRoute を使うルーターはエンドポイント本体の時間を "handler" として記録する
+#   （全体からこれを引いた残りが、リクエストの解析・レスポンスのシリアライズなど）
+# ・Supabase のクエリは repository 側で span("db", "テーブル.操作") として記録する
+# ・結果は Server-Timing ヘッダで返し（ブラウザの開発者ツールで見える）、
+#   TRACE_SLOW_MS を超えたリクエストは内訳付きでログに出す
+# ・PROFILER=1 のときだけ、全スレッドのスタックを一定間隔で採取するサンプリングプロファイラを動かす
+import asyncio
+import contextvars
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import List, Optional
+
+from fastapi.routing import APIRoute
+from starlette.datastructures import MutableHeaders
+
+TRACING = os.getenv("TRACING", "1") == "1"
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "500"))
+# Server-Timing に個別に載せる DB 操作の数（多すぎるとヘッダが大きくなる）
+TRACE_MAX_TIMINGS = int(os.getenv("TRACE_MAX_TIMINGS", "8"))
+
+PROFILER = os.getenv("PROFILER", "0") == "1"
+PROFILER_INTERVAL = float(os.getenv("PROFILER_INTERVAL", "0.01"))
+PROFILER_OUTPUT = os.getenv(
+    "PROFILER_OUTPUT",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "profile.folded")
+)
+# 待機しているだけのスレッド（スレッドプールの空きワーカー・イベントループの select）は数えない
+_IDLE_FILES = {"threading.py", "selectors.py", "queue.py", "thread.py"}
+
+
+class Trace:
+    __slots__ = ("start", "spans", "done")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        # (name, ms, desc)
+        self.spans: List[tuple] = []
+        self.done = False
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.start) * 1000
+
+    def summary(self) -> List[tuple]:
+        """(metric, ms, desc) の一覧。同じ名前の span は合計する"""
+        total = self.elapsed_ms()
+        named = {}
+        db_ops = {}
+        for name, ms, desc in list(self.spans):
+            if name == "db":
+                op = db_ops.setdefault(desc, [0.0, 0])
+                op[0] += ms
+                op[1] += 1
+            else:
+                named[name] = named.get(name, 0.0) + ms
+
+        metrics = [("total", total, None)]
+        for name, ms in named.items():
+            metrics.append((name, ms, None))
+        if db_ops:
+            count = sum(n for _, n in db_ops.values())
+            metrics.append(("db", sum(ms for ms, _ in db_ops.values()), f"{count} queries"))
+            slowest = sorted(db_ops.items(), key=lambda kv: kv[1][0], reverse=True)[:TRACE_MAX_TIMINGS]
+            for desc, (ms, n) in slowest:
+                metrics.append((f"db.{desc}", ms, f"{n}x"))
+        return metrics
+
+    def server_timing(self) -> str:
+        parts = []
+        for metric, ms, desc in self.summary():
+            part = f"{metric};dur={ms:.1f}"
+            if desc:
+                part += f';desc="{desc}"'
+            parts.append(part)
+        return ", ".join(parts)
+
+
+_current: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+
+
+def current() -> Optional[Trace]:
+    trace = _current.get()
+    return trace if trace is not None and not trace.done else None
+
+
+@contextmanager
+def span(name: str, desc: str = None):
+    """処理の一部の時間を今のリクエストのトレースに記録する（トレース外なら何もしない）"""
+    trace = current()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.spans.append((name, (time.perf_counter() - start) * 1000, desc))
+
+
+def _traced_endpoint(endpoint):
+    # FastAPI は __wrapped__ を辿って引数を解析するので、シグネチャはそのまま使われる
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            with span("handler"):
+                return await endpoint(*args, **kwargs)
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            with span("handler"):
+                return endpoint(*args, **kwargs)
+    return wrapper
+
+
+class TracedRoute(APIRoute):
+    """エンドポイント本体の実行時間を "handler" として記録するルート"""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if TRACING:
+            endpoint = _traced_endpoint(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+class TracingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not TRACING or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace()
+        token = _current.set(trace)
+        status = None
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", trace.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            trace.done = True
+            total = trace.elapsed_ms()
+            if total >= TRACE_SLOW_MS:
+                breakdown = ", ".join(
+                    f"{metric}={ms:.1f}ms" + (f" ({desc})" if desc else "")
+                    for metric, ms, desc in trace.summary()[1:]
+                )
+                print(f"Slow request: {scope['method']} {scope['path']} {status} {total:.1f}ms [{breakdown}]")
+
+
+class SamplingProfiler:
+    """全スレッドのスタックを一定間隔で数える。結果は flamegraph.pl などで読める折り畳み形式"""
+
+    def __init__(self, interval: float = PROFILER_INTERVAL):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        print(f"Sampling profiler started (every {self.interval * 1000:.0f}ms)")
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                if os.path.basename(frame.f_code.co_filename) in _IDLE_FILES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def dump(self, path: str = PROFILER_OUTPUT):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        # 末尾（実際に実行中だった関数）ごとの上位をログにも出す
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        print(f"Sampling profiler: {self.samples} samples written to {path}")
+        for leaf, count in leaves.most_common(10):
+            print(f"  {count:6d}  {leaf}")
+
+
+profiler = SamplingProfiler() if PROFILER else None
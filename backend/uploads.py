@@ -0,0 +1,230 @@
+# uploads.py
+# アップロード画像の保存（ストリーミング + content-addressed）
+# ・チャンク単位で読みながら SHA-256 を計算し、サイズ上限もその場でチェック
+# ・ディスク書き込みはスレッドプールで行い、イベントループ（WebSocket）を止めない
+# ・ファイル名は内容のハッシュなので、同じ画像は1つしか保存されない
+#   （削除ジョブは直近に保存された内容を消さない。deleting() を参照）
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict
+
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+from database import get_supabase, SUPABASE_ENABLED
+from images import frontend_path
+
+UPLOAD_DIR = os.path.join(frontend_path, "uploads")
+
+# 1ファイルの上限サイズ (bytes)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+CHUNK_SIZE = 256 * 1024
+# multipart のヘッダ等の分の余裕
+MULTIPART_OVERHEAD = 64 * 1024
+
+UPLOAD_PATHS = ("/room/upload", "/puzzle/upload")
+
+ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+CONTENT_TYPE_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+}
+
+# 保存から部屋・パズルの登録までの猶予。この間は参照が無くても削除ジョブが消さない
+UPLOAD_REUSE_GRACE = float(os.getenv("UPLOAD_REUSE_GRACE", "600"))
+
+# Supabase Storage へアップロード済みのオブジェクトパス
+_pushed_objects = set()
+# 内容ハッシュ -> 最後に保存（同じ内容の再アップロードを含む）された時刻
+_stored_at: Dict[str, float] = {}
+# _finalize と画像の削除ジョブを排他する（どちらもスレッドプールで動く）
+_store_lock = threading.Lock()
+
+
+@dataclass
+class StoredUpload:
+    digest: str
+    name: str        # 保存ファイル名 ({sha256}{ext})
+    path: str        # ローカルの保存先
+    size: int
+    content_type: str
+    is_new: bool     # 今回初めて保存された内容か
+
+    @property
+    def url(self) -> str:
+        return f"/static/uploads/{self.name}"
+
+
+def _extension(file: UploadFile) -> str:
+    ext = os.path.splitext(file.filename or "")[1].lower()
+    if ext in ALLOWED_EXTENSIONS:
+        return ".jpg" if ext == ".jpeg" else ext
+    ext = CONTENT_TYPE_EXTENSIONS.get(file.content_type)
+    if ext:
+        return ext
+    raise HTTPException(status_code=400, detail="画像ファイル (jpg, png, gif, webp) を選択してください")
+
+
+def _finalize(tmp_path: str, final_path: str, digest: str) -> bool:
+    """一時ファイルを保存先へ移動する。既に同じ内容があれば捨てて False"""
+    with _store_lock:
+        now = time.monotonic()
+        if len(_stored_at) > 1024:
+            for d in [d for d, t in _stored_at.items() if now - t >= UPLOAD_REUSE_GRACE]:
+                del _stored_at[d]
+        _stored_at[digest] = now
+        if os.path.exists(final_path):
+            os.remove(tmp_path)
+            return False
+        os.replace(tmp_path, final_path)
+        return True
+
+
+@contextmanager
+def deleting():
+    """削除ジョブ用: 削除が終わるまで新しい保存を待たせ、直近に保存された内容か判定する関数を渡す"""
+    with _store_lock:
+        now = time.monotonic()
+        yield lambda digest: digest in _stored_at and now - _stored_at[digest] < UPLOAD_REUSE_GRACE
+
+
+def forget_pushed(bucket: str, object_path: str):
+    """Storage から消したオブジェクトを、次のアップロードで送り直すようにする"""
+    _pushed_objects.discard(f"{bucket}/{object_path}")
+
+
+async def store_upload(file: UploadFile) -> StoredUpload:
+    """UploadFile をチャンクごとに読み、ハッシュ名で uploads/ に保存する"""
+    ext = _extension(file)
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_DIR, suffix=".part")
+    out = os.fdopen(fd, "wb")
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        while True:
+            chunk = await file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > MAX_UPLOAD_BYTES:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"ファイルサイズは {MAX_UPLOAD_BYTES // (1024 * 1024)}MB 以内にしてください"
+                )
+            hasher.update(chunk)
+            await run_in_threadpool(out.write, chunk)
+        await run_in_threadpool(out.close)
+    except BaseException:
+        out.close()
+        os.remove(tmp_path)
+        raise
+
+    if size == 0:
+        os.remove(tmp_path)
+        raise HTTPException(status_code=400, detail="空のファイルです")
+
+    digest = hasher.hexdigest()
+    name = f"{digest}{ext}"
+    final_path = os.path.join(UPLOAD_DIR, name)
+    is_new = await run_in_threadpool(_finalize, tmp_path, final_path, digest)
+
+    return StoredUpload(
+        digest=digest,
+        name=name,
+        path=final_path,
+        size=size,
+        content_type=file.content_type or "application/octet-stream",
+        is_new=is_new,
+    )
+
+
+def _push_to_bucket(bucket: str, object_path: str, stored: StoredUpload):
+    with open(stored.path, "rb") as f:
+        try:
+            get_supabase().storage.from_(bucket).upload(
+                path=object_path,
+                file=f,
+                file_options={"content-type": stored.content_type, "x-upsert": "false"}
+            )
+        except Exception as e:
+            # 同じ内容が既にある（= 同じパス）ならそのまま使う
+            msg = str(e)
+            if "Duplicate" not in msg and "already exists" not in msg and "409" not in msg:
+                raise
+
+
+async def push_to_storage(stored: StoredUpload, bucket: str = "puzzles") -> str:
+    """保存済みファイルを Supabase Storage に送り、公開URLを返す（内容が同じなら再送しない）"""
+    if not SUPABASE_ENABLED:
+        # Supabase を使わない構成 (STORAGE_BACKEND=sqlite 等) ではローカルの URL をそのまま使う
+        return stored.url
+    object_path = f"content/{stored.name}"
+    key = f"{bucket}/{object_path}"
+    if key not in _pushed_objects:
+        await run_in_threadpool(_push_to_bucket, bucket, object_path, stored)
+        _pushed_objects.add(key)
+    return str(get_supabase().storage.from_(bucket).get_public_url(object_path))
+
+
+class _BodyTooLarge(HTTPException):
+    # HTTPException にしておくと FastAPI のボディ解析でも 400 に変換されずに伝わる
+    def __init__(self):
+        super().__init__(status_code=413, detail="ファイルサイズが大きすぎます")
+
+
+class UploadSizeLimitMiddleware:
+    """アップロードAPIのリクエストボディを受信中にサイズ制限する ASGI ミドルウェア
+
+    FastAPI は UploadFile をハンドラに渡す前に multipart 全体を受信してしまうため、
+    上限を超えたボディはここで受信を打ち切る。
+    """
+
+    def __init__(self, app, max_body: int = None):
+        self.app = app
+        self.max_body = max_body or (MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].startswith(UPLOAD_PATHS):
+            await self.app(scope, receive, send)
+            return
+
+        too_large = JSONResponse({"detail": _BodyTooLarge().detail}, status_code=413)
+        headers = dict(scope.get("headers") or [])
+        length = headers.get(b"content-length")
+        if length and length.isdigit() and int(length) > self.max_body:
+            await too_large(scope, receive, send)
+            return
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body:
+                    raise _BodyTooLarge()
+            return message
+
+        async def tracked_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except _BodyTooLarge:
+            if not response_started:
+                await too_large(scope, receive, send)
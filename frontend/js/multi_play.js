@@ -10,7 +10,8 @@ if (!ROOM_ID || !USER_ID) {
 
 // WebSocket接続
 const wsProtocol = window.location.protocol === "https:" ? "wss:" : "ws:";
-const ws = new WebSocket(`${wsProtocol}//${window.location.host}/ws/puzzle/${ROOM_ID}/${USER_ID}`);
+const SESSION_TOKEN = localStorage.getItem("session_token") || "";
+const ws = new WebSocket(`${wsProtocol}//${window.location.host}/ws/puzzle/${ROOM_ID}/${USER_ID}?token=${encodeURIComponent(SESSION_TOKEN)}`);
 
 const overlay = document.getElementById("waiting-overlay");
 const memberList = document.getElementById("waiting-members");
@@ -48,6 +49,11 @@ ws.onmessage = async (event) => {
     const msg = JSON.parse(event.data);
 
     switch (msg.type) {
+        case "PING":
+            // サーバーからの生存確認
+            ws.send(JSON.stringify({ type: "PONG" }));
+            break;
+
         case "IS_HOST":
             // サーバーからホスト判定を受信
             isHost = msg.is_host;
@@ -84,6 +90,16 @@ ws.onmessage = async (event) => {
             handleRemoteMove(msg);
             break;
 
+        case "CURSORS":
+            // 他のプレイヤーのカーソル（一定間隔でまとめて届く）
+            handleCursors(msg);
+            break;
+
+        case "CATCH_UP":
+            // 視野外で動いていたピースの現在位置
+            handleCatchUp(msg);
+            break;
+
         case "LOCKED":
             handleRemoteLock(msg);
             break;
@@ -130,11 +146,42 @@ ws.onmessage = async (event) => {
         case "CHAT":
             addChatMessage(msg.user_id, msg.message, msg.timestamp, msg.username);
             break;
+
+        case "CHAT_BACKLOG":
+            // 参加前のチャット履歴
+            msg.messages.forEach(m => addChatMessage(m.user_id, m.message, m.timestamp, m.username));
+            break;
     }
 };
 
-ws.onclose = () => {
+ws.onclose = (event) => {
     console.log("WebSocket Disconnected");
+    if (event.code === 4401 || event.code === 1008) {
+        // トークンが無効（期限切れなど）
+        alert("ログインの有効期限が切れました。再度ログインしてください。");
+        window.location.href = "/user/login";
+        return;
+    }
+    if (event.code === 4403) {
+        // 定員に達している
+        alert("ルームが満員です");
+        window.location.href = '/room/list-page';
+        return;
+    }
+    if (event.code === 1013) {
+        // サーバーが混み合っている -> 指定された秒数後に再接続する
+        const match = /retry_after=(\d+)/.exec(event.reason || "");
+        const retryAfter = match ? Number(match[1]) : 5;
+        console.log(`Server busy, retrying in ${retryAfter}s`);
+        setTimeout(() => window.location.reload(), retryAfter * 1000);
+        return;
+    }
+    if (event.code === 4409) {
+        // 長時間操作が無かったため切断された
+        alert("一定時間操作が無かったため切断されました");
+        window.location.href = '/room/list-page';
+        return;
+    }
     alert("通信が切断されました");
 };
 
@@ -170,7 +217,18 @@ function autoStartGame() {
 
 // --- Local Hooks (puzzle_logic.js から呼ばれる) ---
 
+// ピースを持っている間は、動かしていなくても一定間隔で HOLD を送ってロックを延長してもらう
+// （サーバーのロックは LOCK_LEASE_TTL = 10 秒で切れる）
+const HOLD_INTERVAL = 3000;
+let heldPieceIndex = null;
+
+setInterval(() => {
+    if (heldPieceIndex === null || ws.readyState !== WebSocket.OPEN) return;
+    ws.send(JSON.stringify({ type: "HOLD" }));
+}, HOLD_INTERVAL);
+
 window.onPieceGrab = (piece) => {
+    heldPieceIndex = piece.originalIndex;
     // 他人にロック通知
     ws.send(JSON.stringify({
         type: "GRAB",
@@ -191,6 +249,7 @@ window.onPieceMove = (piece) => {
 };
 
 window.onPieceDrop = (piece) => {
+    heldPieceIndex = null;
     // リリース通知（最終位置含む）
     ws.send(JSON.stringify({
         type: "RELEASE",
@@ -311,6 +370,95 @@ function animateRemotePieces() {
 // アニメーションループ開始
 animateRemotePieces();
 
+function handleCatchUp(msg) {
+    msg.pieces.forEach(item => {
+        const p = pieces.find(piece => piece.originalIndex === item.index);
+        if (!p) return;
+        pieceTargets.set(item.index, {
+            targetX: item.x,
+            targetY: item.y,
+            targetRotation: item.rotation
+        });
+    });
+}
+
+// --- Viewport ---
+// 表示範囲（ワールド座標）をサーバーに知らせ、視野内のピースの MOVED だけ受け取る
+let lastViewport = null;
+
+function reportViewport() {
+    if (ws.readyState !== WebSocket.OPEN || !can) return;
+    const vp = {
+        x: -view.x / view.scale,
+        y: -view.y / view.scale,
+        w: can.width / view.scale,
+        h: can.height / view.scale
+    };
+    // 少し動いただけなら送らない（サーバー側で余白を持たせている）
+    if (lastViewport) {
+        const moved = Math.abs(vp.x - lastViewport.x) + Math.abs(vp.y - lastViewport.y);
+        const resized = Math.abs(vp.w - lastViewport.w) + Math.abs(vp.h - lastViewport.h);
+        if (moved < 32 && resized < 32) return;
+    }
+    lastViewport = vp;
+    ws.send(JSON.stringify({ type: "VIEWPORT", ...vp }));
+}
+
+setInterval(reportViewport, 250);
+
+// --- カーソル表示 (プレゼンス) ---
+// 自分のカーソル位置（ワールド座標）は一定間隔で最新の値だけを送る。
+// サーバーも一定間隔で全員分をまとめて返すので、マウスを動かす量に関係なく通信量は一定
+const CURSOR_SEND_INTERVAL = 100;
+let localCursor = null;
+let lastSentCursor = null;
+const remoteCursors = new Map(); // user_id -> { name, x, y }
+
+window.addEventListener('mousemove', (ev) => {
+    if (!can) return;
+    const rect = can.getBoundingClientRect();
+    localCursor = toWorld(ev.clientX - rect.left, ev.clientY - rect.top);
+});
+
+setInterval(() => {
+    if (ws.readyState !== WebSocket.OPEN || !localCursor) return;
+    const x = Math.round(localCursor.x);
+    const y = Math.round(localCursor.y);
+    if (lastSentCursor && lastSentCursor.x === x && lastSentCursor.y === y) return;
+    lastSentCursor = { x, y };
+    ws.send(JSON.stringify({ type: "CURSOR", x, y }));
+}, CURSOR_SEND_INTERVAL);
+
+function handleCursors(msg) {
+    remoteCursors.clear();
+    msg.cursors.forEach(([userId, name, x, y]) => {
+        if (userId !== USER_ID) remoteCursors.set(userId, { name, x, y });
+    });
+}
+
+function cursorColor(userId) {
+    let hash = 0;
+    for (let i = 0; i < userId.length; i++) hash = (hash * 31 + userId.charCodeAt(i)) | 0;
+    return `hsl(${Math.abs(hash) % 360}, 80%, 60%)`;
+}
+
+// puzzle_logic.js の drawAll から（ワールド座標の変換をかけた状態で）呼ばれる
+function drawRemoteCursors() {
+    if (remoteCursors.size === 0) return;
+    const s = 1 / view.scale; // 拡大率に関係なく同じ大きさで描く
+    ctx.font = `${12 * s}px sans-serif`;
+    remoteCursors.forEach((c, userId) => {
+        ctx.fillStyle = cursorColor(userId);
+        ctx.beginPath();
+        ctx.moveTo(c.x, c.y);
+        ctx.lineTo(c.x + 4 * s, c.y + 14 * s);
+        ctx.lineTo(c.x + 10 * s, c.y + 10 * s);
+        ctx.closePath();
+        ctx.fill();
+        ctx.fillText(c.name, c.x + 12 * s, c.y + 22 * s);
+    });
+}
+
 function handleRemoteLock(msg) {
     if (msg.user_id === USER_ID) return;
 
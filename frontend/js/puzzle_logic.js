@@ -285,11 +285,23 @@ async function initPuzzle(imageUrl, savedPiecesData, difficultyArg) {
 
     isGameCompleted = false; // 初期化時にフラグをリセット
     pieces = [];
+
+    // サーバーで生成済みのスプライトアトラスがあればそれを使う（無ければ従来通り1枚ずつ生成）
+    const atlasTiles = await loadPieceAtlas(imageUrl, difficulty);
+    // 輪郭は中身の無い透明画像なので全ピースで共有する
+    const blankOutline = atlasTiles ? document.createElement('canvas') : null;
+
     let idx = 0;
     for (let row = 0; row < rowMax; row++) {
         for (let col = 0; col < colMax; col++) {
-            const image = await createPiece(resizedImage, row, col, rowMax, colMax, false);
-            const outline = await createPiece(resizedImage, row, col, rowMax, colMax, true);
+            let image, outline;
+            if (atlasTiles) {
+                image = atlasTiles[idx];
+                outline = blankOutline;
+            } else {
+                image = await createPiece(resizedImage, row, col, rowMax, colMax, false);
+                outline = await createPiece(resizedImage, row, col, rowMax, colMax, true);
+            }
             const p = new Piece(image, outline, col * pieceSize, row * pieceSize, idx);
             p.visualRotation = p.Rotation; // 初期化
             pieces.push(p);
@@ -384,6 +396,33 @@ async function createSourceImage(url) {
     });
 }
 
+// スプライトアトラスを取得してピースごとに切り出す
+// 分割数がクライアントの計算と一致しない場合は null を返して従来の生成にフォールバック
+async function loadPieceAtlas(imageUrl, difficulty) {
+    try {
+        const res = await fetch(`/puzzle/atlas?image_url=${encodeURIComponent(imageUrl)}&difficulty=${encodeURIComponent(difficulty)}`);
+        if (!res.ok) return null;
+        const meta = await res.json();
+        if (meta.rows !== rowMax || meta.cols !== colMax || meta.piece_size !== pieceSize) return null;
+
+        const atlasImage = await createSourceImage(meta.atlas_url);
+        const size = meta.tile_size;
+        return await Promise.all(meta.pieces.map(p => {
+            if (window.createImageBitmap) {
+                return createImageBitmap(atlasImage, p.atlas_x, p.atlas_y, size, size);
+            }
+            const canvas = document.createElement('canvas');
+            canvas.width = size;
+            canvas.height = size;
+            canvas.getContext('2d').drawImage(atlasImage, p.atlas_x, p.atlas_y, size, size, 0, 0, size, size);
+            return canvas;
+        }));
+    } catch (e) {
+        console.warn("Atlas load failed, falling back to client rendering", e);
+        return null;
+    }
+}
+
 async function createPiece(sourceImage, row, col, rowMax, colMax, outlineOnly) {
     const canvas = document.createElement('canvas');
     const ctx = canvas.getContext('2d');
@@ -666,6 +705,9 @@ function drawAll() {
     // 3. Moving Piece (Top)
     if (movingPiece) movingPiece.Draw();
 
+    // 4. 他のプレイヤーのカーソル (マルチプレイのみ)
+    if (typeof drawRemoteCursors === 'function') drawRemoteCursors();
+
     ctx.restore();
 }
 
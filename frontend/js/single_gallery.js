@@ -2,6 +2,12 @@
 const API_BASE_URL = ""; // ルートからの相対パスを使用 (FastAPIサーバーと同じホストを想定)
 const userId = localStorage.getItem("user_id");
 
+// カード用の縮小画像URL (サーバー側で縮小・キャッシュされる)
+function thumbUrl(url, width = 480) {
+    if (!url) return url;
+    return `${API_BASE_URL}/puzzle/image?url=${encodeURIComponent(url)}&width=${width}`;
+}
+
 // ログインチェックと初期化
 if (!userId) {
     alert("ログイン情報が見つかりません。ログイン画面へ移動します。");
@@ -13,6 +19,33 @@ if (!userId) {
 
 
 
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text == null ? '' : String(text);
+    return div.innerHTML;
+}
+
+/**
+ * パズルごとのランキング上位をカードに表示する
+ */
+async function loadRankings(puzzleIds) {
+    if (!puzzleIds.length) return;
+    try {
+        const res = await fetch(`${API_BASE_URL}/puzzle/leaderboards?puzzle_ids=${puzzleIds.join(',')}&limit=3`);
+        if (!res.ok) return;
+        const boards = await res.json();
+        Object.entries(boards).forEach(([puzzleId, board]) => {
+            const el = document.getElementById(`ranking-${puzzleId}`);
+            if (!el || !board.entries.length) return;
+            el.innerHTML = board.entries.map(e => `
+                <p><span class="label">${e.rank}. ${escapeHtml(e.username || 'Guest')}</span> <span>${e.elapsed_time}秒</span></p>
+            `).join('');
+        });
+    } catch (error) {
+        console.error("ランキングの取得に失敗:", error);
+    }
+}
+
 /**
  * ギャラリー画面にパズルマスターとプレイ履歴を表示する
  */
@@ -29,13 +62,17 @@ async function loadGallery() {
         newList.innerHTML = masters.map(m => `
             <div class="card">
                 <div onclick="startNewGame(${m.id})">
-                    <img src="${m.image_url}" alt="${m.title}">
+                    <img src="${thumbUrl(m.image_url)}" alt="${m.title}">
                     <h3>${m.title || "無題"}</h3>
                     <p>Start New</p>
+                    <div class="card-info card-ranking" id="ranking-${m.id}"></div>
                 </div>
                 <button class="btn-delete" onclick="event.stopPropagation(); deletePuzzle(${m.id})">削除</button>
             </div>
         `).join('');
+
+        // 各カードのランキング（上位3件）を1回のリクエストでまとめて取得
+        loadRankings(masters.map(m => m.id));
     } catch (error) {
         console.error("パズルマスターデータの取得に失敗:", error);
         newList.innerHTML = "<p>読み込みエラーが発生しました。</p>";
@@ -77,7 +114,7 @@ async function loadGallery() {
                 return `
                 <div class="card">
                     <div onclick="resumeGame('${h.id}')">
-                        <img src="${h.puzzle_masters.image_url}" alt="puzzle">
+                        <img src="${thumbUrl(h.puzzle_masters.image_url)}" alt="puzzle">
                         <h3>${h.puzzle_masters.title}</h3>
                         <div class="card-info">
                             <p><span class="label">難易度:</span> ${formatDifficulty(h.difficulty)}</p>
@@ -191,7 +228,7 @@ async function handleUpload(event) {
             const newCardHtml = `
                 <div class="card">
                     <div onclick="startNewGame(${m.id})">
-                        <img src="${m.image_url}" alt="${m.title}">
+                        <img src="${thumbUrl(m.image_url)}" alt="${m.title}">
                         <h3>${m.title || "無題"}</h3>
                         <p>Start New</p>
                     </div>
@@ -206,6 +243,7 @@ async function handleUpload(event) {
         } else if (res.status === 401) {
             alert("ユーザー情報が無効です。再度ログインしてください。");
             localStorage.removeItem("user_id");
+            localStorage.removeItem("session_token");
             window.location.href = "/user/login";
         } else {
             alert("アップロード失敗: " + (result.message || "不明なエラー"));
@@ -272,7 +310,7 @@ function renderGallery(puzzles) {
 
     galleryGrid.innerHTML = puzzleArray.map(puzzle => `
         <div class="puzzle-card">
-            <img src="${puzzle.image_url}" alt="${puzzle.title}">
+            <img src="${thumbUrl(puzzle.image_url)}" alt="${puzzle.title}">
             <div class="puzzle-info">
                 <h3>${puzzle.title}</h3>
                 <div class="actions">